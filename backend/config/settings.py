@@ -21,6 +21,87 @@ load_dotenv()
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+# Overrides the API endpoint, e.g. to point at orders.fake_openai during benchmarks
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')
+
+# Deadlines, retries, hedging and connection pooling for LLM calls; see orders/llm.py
+LLM_CLIENT = {
+    'TIMEOUT': 20.0,
+    'ATTEMPT_TIMEOUT': 10.0,
+    'CONNECT_TIMEOUT': 2.0,
+    'MAX_RETRIES': 2,
+    'HEDGE': True,
+    'HEDGE_PERCENTILE': 95,
+}
+
+# When LLM calls keep failing or crawling, stop calling it for a while and answer locally; see orders/breaker.py
+LLM_CIRCUIT_BREAKER = {
+    'WINDOW': 20,
+    'MIN_CALLS': 5,
+    'FAILURE_RATE': 0.5,
+    'SLOW_CALL_SECONDS': 8.0,
+    'SLOW_CALL_RATE': 0.8,
+    'OPEN_SECONDS': 30.0,
+}
+
+# Identical concurrent LLM calls share one upstream request; see orders/single_flight.py
+LLM_SINGLE_FLIGHT = {
+    'ENABLED': True,
+    'CROSS_PROCESS': os.getenv('LLM_SINGLE_FLIGHT_CROSS_PROCESS') == '1',
+    # Coalescing across processes needs a cache shared by all workers
+    'ALIAS': 'shared',
+}
+
+# Order event bus behind the kitchen display streams ('auto', 'local' or 'postgres'); see orders/events.py
+ORDER_EVENTS = {
+    'BACKEND': os.getenv('ORDER_EVENTS_BACKEND', 'auto'),
+    'KEEPALIVE_SECONDS': 15,
+}
+
+# Cache for general-query completions ('local', 'django' or 'none'); see orders/llm_cache.py
+LLM_RESPONSE_CACHE = {
+    'BACKEND': os.getenv('LLM_RESPONSE_CACHE_BACKEND', 'local'),
+    'MAX_ENTRIES': 1000,
+    'TIMEOUT': 300,
+}
+
+# /health (liveness) and /health/ready (readiness), and index warmup as each worker starts; see orders/health.py
+HEALTH = {
+    'WARMUP_ON_STARTUP': os.getenv('WARMUP_ON_STARTUP', '1') == '1',
+}
+
+# /api/orders/metrics/ is readable by staff users and by scrapers sending "Authorization: Bearer <TOKEN>"
+METRICS = {
+    'TOKEN': os.getenv('METRICS_TOKEN'),
+}
+
+# Every worker keeps a menu snapshot and re-reads the catalog version from the database this often; see orders/catalog.py
+CATALOG = {
+    'VERSION_CHECK_SECONDS': 1.0,
+}
+
+# Menu catalog read API for kiosks, rendered and compressed once per catalog version; see orders/catalog_api.py
+CATALOG_API = {
+    'PAGE_SIZE': 500,
+    'CACHE_CONTROL': 'public, no-cache',
+}
+
+# Server-side chat sessions keyed by the kiosk's sessionId; see orders/sessions.py
+CHAT_SESSIONS = {
+    # Every worker must see a kiosk's session, and it must outlive a restart or deploy
+    'ALIAS': 'shared',
+    'TIMEOUT': 1800,
+    'MAX_TURNS': 40,
+}
+
+# Token budget and layout of the LLM prompt; older turns are folded into a summary. See orders/prompt.py
+CHAT_PROMPT = {
+    'MAX_TOKENS': 3000,
+    'RECENT_MESSAGES': 8,
+    'SUMMARY_MAX_TOKENS': 300,
+    'FOLD_EVERY': 8,
+    'DIGEST_MAX_TOKENS': 800,
+}
 
 
 
@@ -51,6 +132,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'orders.middleware.HealthCheckMiddleware',
+    'orders.middleware.RequestTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -83,12 +166,16 @@ CORS_ALLOW_HEADERS = [
     'authorization',
     'content-type',
     'dnt',
+    'if-none-match',
     'origin',
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
 ]
 
+# Lets the kiosk UI read the catalog's ETag to revalidate with If-None-Match
+CORS_EXPOSE_HEADERS = ['etag']
+
 CORS_ALLOW_CREDENTIALS = True
 
 CSRF_TRUSTED_ORIGINS = [
@@ -130,6 +217,21 @@ DATABASES = {
 }
 
 
+# Caches
+# 'default' is private to each worker. 'shared' is seen by all workers and survives restarts;
+# it is a table in the database, created by `python manage.py createcachetable`.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'orders_cache',
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -149,6 +251,21 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Logging
+# One JSON line per request from orders.middleware.RequestTimingMiddleware
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'orders': {'handlers': ['console'], 'level': os.getenv('ORDERS_LOG_LEVEL', 'INFO')},
+    },
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
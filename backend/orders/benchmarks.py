@@ -0,0 +1,248 @@
+"""
+Microbenchmarks for the chat hot path.
+
+`run_benchmarks` seeds synthetic catalogs of the requested sizes into the
+current database and times each stage of a chat turn. The full-request case
+goes through the real view and OpenAI client against `fake_openai`, so no
+network access or API key is needed. Results are plain dicts meant to be
+dumped as JSON; see the `bench_chat` management command.
+
+`run_query_plans` compares the query plans and timings of the hot lookup
+shapes with and without the indexes added in migration 0012.
+"""
+import itertools
+import statistics
+import time
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from . import llm, llm_cache
+from .catalog import get_catalog, invalidate_catalog
+from .categories import get_category_from_item
+from .fake_openai import FakeOpenAIServer
+from .models import Store, MenuItem, Order, OrderItem
+from .search import search_menu_items, search_stores
+from .views import _build_db_search_result, _update_order, simple_nlu
+
+DEFAULT_SIZES = (10, 1000, 100000)
+ITEMS_PER_STORE = 50
+
+BASE_ITEM_NAMES = [
+    ('불고기버거', 4500), ('아메리카노', 2000), ('카페라떼', 3000), ('참치김밥', 4000), ('마라탕', 9000),
+    ('떡볶이', 4500), ('햄치즈토스트', 3500), ('자몽에이드', 4000), ('플레인베이글', 2500), ('에그샌드위치', 4500),
+]
+
+UTTERANCES = [
+    "커피 파는 가게 어디야?",
+    "벤치매장00000 메뉴 뭐 있어?",
+    "불고기버거 하나 주문할게",
+    "오늘 뭐 먹지 추천해줘",
+    "결제할게요",
+]
+
+# Indexes and constraints added by migration 0012.
+SCHEMA_INDEXES = ['orders_store_name_lower', 'orders_menuitem_name_lower', 'unique_menu_item_store_name', 'orders_order_status_created']
+
+FAKE_REPLY = """네, 불고기버거를 장바구니에 추가했습니다. 추가로 주문할 상품이 있으신가요?
+```json
+{"action": "add_to_cart", "item_name": "불고기버거 0", "store_name": "벤치매장00000"}
+```"""
+
+
+def seed_catalog(size):
+    """Replaces the catalog with `size` synthetic items spread over stores of ITEMS_PER_STORE."""
+    OrderItem.objects.all().delete()
+    Order.objects.all().delete()
+    MenuItem.objects.all().delete()
+    Store.objects.all().delete()
+
+    store_count = max(1, -(-size // ITEMS_PER_STORE))
+    stores = Store.objects.bulk_create([Store(name=f"벤치매장{i:05d}") for i in range(store_count)])
+    items = []
+    for i in range(size):
+        base_name, price = BASE_ITEM_NAMES[i % len(BASE_ITEM_NAMES)]
+        name = f"{base_name} {i // len(BASE_ITEM_NAMES)}"
+        items.append(MenuItem(
+            store=stores[i // ITEMS_PER_STORE], name=name, price=Decimal(price),
+            category=get_category_from_item(name) or '',
+        ))
+    MenuItem.objects.bulk_create(items, batch_size=5000)
+    invalidate_catalog()
+
+
+def _measure(name, catalog_size, func, iterations):
+    """Times `func` over `iterations` calls after one warm-up call that counts queries."""
+    with CaptureQueriesContext(connection) as queries:
+        func(0)
+    samples = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        func(i + 1)
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        'name': name,
+        'catalog_size': catalog_size,
+        'iterations': iterations,
+        'queries': len(queries),
+        'mean_ms': round(statistics.fmean(samples), 4),
+        'p50_ms': round(samples[len(samples) // 2], 4),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+        'min_ms': round(samples[0], 4),
+        'max_ms': round(samples[-1], 4),
+    }
+
+
+def _bench_size(size, iterations, client):
+    seed_catalog(size)
+    catalog = get_catalog()
+    names = [item.name for item in catalog.items[:1000]]
+    store_name = catalog.stores[0].name
+    first_item = catalog.items[0].name
+
+    def run_nlu(i):
+        simple_nlu(UTTERANCES[i % len(UTTERANCES)])
+
+    def run_categories(i):
+        for name in names:
+            get_category_from_item(name)
+
+    order_state = {}
+
+    def run_update_order(i):
+        nonlocal order_state
+        new_state, _ = _update_order(first_item, store_name, order_state)
+        order_state = new_state
+
+    def run_search(i):
+        _build_db_search_result(UTTERANCES[i % len(UTTERANCES)], simple_nlu(UTTERANCES[i % len(UTTERANCES)])['entities'])
+
+    search_terms = ['에그샌드', '자몽에이드 1', '불고기버거 ' + str(size // 20), '매장00001', '없는메뉴']
+
+    def run_indexed_search(i):
+        term = search_terms[i % len(search_terms)]
+        list(search_menu_items(term)[:50])
+        list(search_stores(term)[:50])
+
+    def run_chat(i):
+        response = client.post(
+            '/api/orders/chat/',
+            {'message': f"{UTTERANCES[(i % 2) * 3]} {i}", 'history': [], 'currentState': {}, 'conversationState': {}},
+            content_type='application/json',
+        )
+        assert response.status_code == 200, response.content
+
+    return [
+        _measure('simple_nlu', size, run_nlu, iterations),
+        _measure('get_category_from_item_x1000', size, run_categories, iterations),
+        _measure('update_order', size, run_update_order, iterations),
+        _measure('db_search_result', size, run_search, iterations),
+        _measure('indexed_name_search', size, run_indexed_search, iterations),
+        _measure('chat_post', size, run_chat, iterations),
+    ]
+
+
+def _seed_orders(count):
+    statuses = [status for status, _ in Order.STATUS_CHOICES]
+    Order.objects.bulk_create([Order(status=statuses[i % len(statuses)]) for i in range(count)], batch_size=5000)
+
+
+def _hot_queries():
+    catalog = get_catalog()
+    store = catalog.stores[len(catalog.stores) // 2]
+    item = catalog.items[len(catalog.items) // 2]
+    return {
+        'store_by_name': lambda: Store.objects.filter(name__lower=store.name.lower()),
+        'menu_item_by_name': lambda: MenuItem.objects.filter(name__lower=item.name.lower()),
+        'menu_item_by_store_and_name': lambda: MenuItem.objects.filter(store_id=store.id, name__lower=item.name.lower()),
+        'orders_awaiting_payment': lambda: Order.objects.filter(status='awaiting_payment').order_by('created_at')[:20],
+    }
+
+
+_explained = itertools.count()
+
+
+def _explain(queryset):
+    """
+    What `queryset.explain()` returns, but with a new comment in the SQL each
+    time. SQLite's driver caches prepared statements by their text, and an
+    EXPLAIN prepared before the indexes were dropped (or restored) keeps
+    describing the old schema.
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'{connection.ops.explain_query_prefix()} {sql} /* plan {next(_explained)} */', params)
+        return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+
+
+def _measure_plans(size, iterations, indexed):
+    results = []
+    for name, query in _hot_queries().items():
+        plan = _explain(query())
+        result = _measure(f'plan_{name}', size, lambda i: list(query()), iterations)
+        results.append({**result, 'indexed': indexed, 'plan': plan})
+    return results
+
+
+def run_query_plans(sizes=DEFAULT_SIZES, iterations=50):
+    """
+    Seeds each catalog size plus a tenth as many orders, then records the
+    plan and timing of each hot lookup twice: with the 0012 indexes dropped
+    (inside a transaction that is rolled back) and with them in place.
+    Databases without transactional DDL only get the indexed pass.
+    """
+    results = []
+    for size in sizes:
+        seed_catalog(size)
+        _seed_orders(max(1, size // 10))
+        if connection.features.can_rollback_ddl:
+            # Plain DROP INDEX rather than the schema editor, which SQLite won't open inside a
+            # transaction. All four are indexes in the database, the functional unique constraint too.
+            with transaction.atomic(), connection.cursor() as cursor:
+                for name in SCHEMA_INDEXES:
+                    cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+                results.extend(_measure_plans(size, iterations, indexed=False))
+                transaction.set_rollback(True)
+        results.extend(_measure_plans(size, iterations, indexed=True))
+    invalidate_catalog()
+    return results
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, iterations=50, llm_delay=0.0):
+    """Runs every benchmark for each catalog size and returns the list of results."""
+    results = []
+    with FakeOpenAIServer(reply=FAKE_REPLY, delay=llm_delay) as server:
+        with override_settings(
+            OPENAI_API_KEY='benchmark', OPENAI_BASE_URL=server.base_url,
+            LLM_RESPONSE_CACHE={'BACKEND': 'none'},
+        ):
+            llm.reset_clients()
+            llm_cache.reset_backend()
+            client = Client()
+            try:
+                for size in sizes:
+                    results.extend(_bench_size(size, iterations, client))
+            finally:
+                llm.reset_clients()
+                llm_cache.reset_backend()
+    return results
+
+
+def compare_results(current, baseline, threshold):
+    """
+    Pairs each result with the baseline run by (name, catalog_size) and returns
+    the ones whose p50 grew by more than `threshold` (a ratio, e.g. 1.2).
+    """
+    previous = {(r['name'], r['catalog_size']): r for r in baseline}
+    regressions = []
+    for result in current:
+        before = previous.get((result['name'], result['catalog_size']))
+        if not before or not before['p50_ms']:
+            continue
+        ratio = result['p50_ms'] / before['p50_ms']
+        if ratio > threshold:
+            regressions.append({**result, 'baseline_p50_ms': before['p50_ms'], 'ratio': round(ratio, 3)})
+    return regressions
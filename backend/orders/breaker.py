@@ -0,0 +1,105 @@
+"""
+Circuit breaker for the LLM.
+
+While the upstream is healthy the breaker is closed. It records the outcome of
+the most recent calls: whether each failed and whether it was slow. Once
+enough calls have been seen and too many of them failed or were slow, the
+breaker opens. `orders.llm` then refuses calls immediately with
+`CircuitOpen`, and the chat view answers from local capabilities instead of
+waiting for a deadline on every turn. After `OPEN_SECONDS` one probe call is
+let through (half-open). If the probe is good the breaker closes again;
+otherwise it stays open for another period. A probe that never reports back
+(e.g. the client went away) is replaced by a new one after the same period.
+
+Configured through `settings.LLM_CIRCUIT_BREAKER`:
+
+    'WINDOW': number of recent calls considered
+    'MIN_CALLS': calls needed in the window before the breaker can open
+    'FAILURE_RATE': share of failed calls that opens the breaker
+    'SLOW_CALL_SECONDS', 'SLOW_CALL_RATE': a call this slow counts as slow; this share of slow calls opens it
+    'OPEN_SECONDS': how long to stay open before probing
+
+State is per worker process, like `orders.metrics`.
+"""
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+from . import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+DEFAULTS = {
+    'WINDOW': 20,
+    'MIN_CALLS': 5,
+    'FAILURE_RATE': 0.5,
+    'SLOW_CALL_SECONDS': 8.0,
+    'SLOW_CALL_RATE': 0.8,
+    'OPEN_SECONDS': 30.0,
+}
+
+
+class CircuitOpen(Exception):
+    """The breaker is open; the call was not attempted."""
+
+
+def _config():
+    return {**DEFAULTS, **getattr(settings, 'LLM_CIRCUIT_BREAKER', {})}
+
+
+class CircuitBreaker:
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.state = CLOSED
+            self._outcomes = deque(maxlen=_config()['WINDOW'])
+            self._retry_at = 0.0
+
+    def _open(self, now, config):
+        self.state = OPEN
+        self._retry_at = now + config['OPEN_SECONDS']
+        metrics.incr('llm.circuit.opened')
+
+    def allow(self):
+        """Returns whether a call may go out now. In half-open, only the probe may."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = self._clock()
+            if now < self._retry_at:
+                metrics.incr('llm.circuit.rejected')
+                return False
+            self.state = HALF_OPEN
+            self._retry_at = now + _config()['OPEN_SECONDS']
+            return True
+
+    def record(self, seconds, failed=False):
+        """Records the outcome of a call that `allow()` let through."""
+        config = _config()
+        slow = seconds >= config['SLOW_CALL_SECONDS']
+        with self._lock:
+            if self.state != CLOSED:
+                if failed or slow:
+                    self._open(self._clock(), config)
+                else:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                    metrics.incr('llm.circuit.closed')
+                return
+            self._outcomes.append((failed, slow))
+            count = len(self._outcomes)
+            if count < config['MIN_CALLS']:
+                return
+            failures = sum(1 for outcome in self._outcomes if outcome[0])
+            slow_calls = sum(1 for outcome in self._outcomes if outcome[1])
+            if failures >= config['FAILURE_RATE'] * count or slow_calls >= config['SLOW_CALL_RATE'] * count:
+                self._outcomes.clear()
+                self._open(self._clock(), config)
@@ -0,0 +1,282 @@
+"""
+Cart updates.
+
+Every change a chat turn makes to the cart goes through `apply_operations`,
+whether it is one item from the local order parser or a whole `update_cart`
+action from the LLM. Items are resolved against the catalog snapshot before
+the transaction starts. The order row is then locked, the items' prices are
+read from the database (the snapshot may lag behind a repricing in another
+worker), and the cart rows are written with at most one DELETE, one UPDATE,
+one SELECT and one INSERT, however many operations there are. Additions are applied relative to the
+stored quantity (`F('quantity') + n`), so concurrent taps can't lose updates.
+
+`Order.total_price` and `Order.item_count` are kept in step with the rows
+in the same transaction. They are adjusted by the change each write makes
+(`F('total_price') + delta`), so the cart payload and order listings never
+have to aggregate the rows. Writes to `OrderItem` that bypass this module
+must be followed by `repair_order_totals()` (or the `repair_order_totals`
+command).
+"""
+import json
+import re
+from dataclasses import dataclass
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, DecimalField, F, OuterRef, PositiveIntegerField, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from . import events, metrics
+from .catalog import get_catalog
+from .fuzzy import get_resolver
+from .models import MenuItem, Order, OrderItem
+from .serializers import CartActionSerializer
+
+CART_ACTIONS = ('update_cart', 'add_to_cart')
+
+_FENCED_JSON = re.compile(r'```(?:json)?\s*(.*?)```', re.DOTALL)
+
+
+@dataclass(frozen=True)
+class CartOperation:
+    op: str  # 'add', 'remove' or 'set_quantity'
+    item_name: str
+    quantity: int = 1
+
+
+def find_action(text):
+    """
+    Returns the first JSON object with an "action" key in `text`, or None.
+    Fenced ```json blocks are tried before bare objects in the prose.
+    """
+    decoder = json.JSONDecoder()
+    for source in [*_FENCED_JSON.findall(text), text]:
+        for match in re.finditer(r'\{', source):
+            try:
+                value, _ = decoder.raw_decode(source, match.start())
+            except json.JSONDecodeError:
+                continue
+            if isinstance(value, dict) and 'action' in value:
+                return value
+    return None
+
+
+def parse_cart_action(action_data):
+    """Validates a cart action. Returns `(store_name, operations)`, or None if it is malformed."""
+    serializer = CartActionSerializer(data=action_data)
+    if not serializer.is_valid():
+        return None
+    data = serializer.validated_data
+    return data['store_name'], [CartOperation(**operation) for operation in data['operations']]
+
+
+def resolve_menu_item(catalog, item_name, store_name):
+    """Exact catalog lookup, falling back to the fuzzy resolver for spacing and speech-to-text slips."""
+    menu_item = catalog.find_item(item_name, store_name)
+    if not menu_item:
+        menu_item = get_resolver(catalog).resolve(item_name, store_name)
+        metrics.incr('menu_resolver.fuzzy_hit' if menu_item else 'menu_resolver.miss')
+    return menu_item
+
+
+def cart_state(order, store_name):
+    """Builds the `currentOrder` payload with one row query; the totals come from the order row."""
+    order_items = (
+        OrderItem.objects.filter(order=order)
+        .order_by('id')
+        .values_list('menu_item__name', 'quantity', 'menu_item__price')
+    )
+    items_data = [{'name': name, 'quantity': quantity, 'price': float(price)} for name, quantity, price in order_items]
+
+    return {
+        'orderId': order.id,
+        'storeName': store_name,
+        'items': items_data,
+        'totalPrice': float(order.total_price),
+        'itemCount': order.item_count,
+        'status': order.status
+    }
+
+
+def order_totals():
+    """`total_price` and `item_count` recomputed from the items, as subqueries correlated on the order."""
+    items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    total = items.annotate(total=Sum(F('quantity') * F('menu_item__price'), output_field=DecimalField())).values('total')
+    count = items.annotate(count=Sum('quantity')).values('count')
+    return {
+        'total_price': Coalesce(Subquery(total), Value(0), output_field=DecimalField()),
+        'item_count': Coalesce(Subquery(count), Value(0), output_field=PositiveIntegerField()),
+    }
+
+
+def repair_order_totals(batch_size=1000):
+    """
+    Recomputes the denormalized totals of every order, `batch_size` orders per
+    UPDATE, and returns how many orders were wrong.
+    """
+    repaired = 0
+    last_id = 0
+    while True:
+        ids = list(Order.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return repaired
+        last_id = ids[-1]
+        expected = order_totals()
+        stale = (
+            Order.objects.filter(id__in=ids)
+            .annotate(expected_total=expected['total_price'], expected_count=expected['item_count'])
+            .exclude(total_price=F('expected_total'), item_count=F('expected_count'))
+            .values_list('id', flat=True)
+        )
+        with transaction.atomic():
+            repaired += Order.objects.filter(id__in=list(stale)).update(**order_totals())
+
+
+def describe_item(item_name, quantity):
+    return item_name if quantity == 1 else f"{item_name} {quantity}개"
+
+
+def _collapse(resolved):
+    """
+    Folds the operations into one change per menu item, in first-mention order:
+    `('add', n)` to add to the stored quantity, `('set', n)` to overwrite it.
+    """
+    changes = {}
+    for menu_item, operation in resolved:
+        kind, quantity = changes.get(menu_item.id, ('add', 0))
+        if operation.op == 'add':
+            changes[menu_item.id] = (kind, quantity + operation.quantity)
+        else:
+            changes[menu_item.id] = ('set', 0 if operation.op == 'remove' else operation.quantity)
+    return changes
+
+
+def _total_deltas(changes, prices, previous):
+    """How much `changes` move the order's total price and item count, given the `previous` quantities."""
+    total_delta = 0
+    count_delta = 0
+    for item_id, (kind, quantity) in changes.items():
+        delta = quantity if kind == 'add' else quantity - previous.get(item_id, 0)
+        total_delta += delta * prices[item_id]
+        count_delta += delta
+    return total_delta, count_delta
+
+
+def _write_changes(order, changes, new_order=False):
+    """
+    Applies `changes` to the order's rows. Existing rows are updated first and
+    the rowcount tells whether any are missing, so the common cases need no
+    extra SELECT. Nobody else can insert into an order created in this
+    transaction, so `new_order` inserts directly, without a savepoint.
+    """
+    if new_order:
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, menu_item_id=item_id, quantity=quantity)
+            for item_id, (_, quantity) in changes.items() if quantity > 0
+        ])
+        return
+
+    removed = [item_id for item_id, change in changes.items() if change == ('set', 0)]
+    if removed:
+        OrderItem.objects.filter(order=order, menu_item_id__in=removed).delete()
+
+    updates = {item_id: change for item_id, change in changes.items() if change != ('set', 0)}
+    if not updates:
+        return
+    updated = OrderItem.objects.filter(order=order, menu_item_id__in=updates).update(quantity=Case(
+        *[
+            When(menu_item_id=item_id, then=F('quantity') + quantity if kind == 'add' else Value(quantity))
+            for item_id, (kind, quantity) in updates.items()
+        ],
+        default=F('quantity'),
+        output_field=PositiveIntegerField(),
+    ))
+    if updated == len(updates):
+        return
+    if updated:
+        existing = set(
+            OrderItem.objects.filter(order=order, menu_item_id__in=updates).values_list('menu_item_id', flat=True)
+        )
+        updates = {item_id: change for item_id, change in updates.items() if item_id not in existing}
+    try:
+        with transaction.atomic():
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, menu_item_id=item_id, quantity=quantity)
+                for item_id, (_, quantity) in updates.items()
+            ])
+    except IntegrityError:
+        # Another request inserted some of these rows first; add to them instead.
+        _write_changes(order, updates)
+
+
+def _describe_changes(store_name, changes, names):
+    added = [describe_item(names[item_id], quantity) for item_id, (kind, quantity) in changes.items() if kind == 'add']
+    removed = [names[item_id] for item_id, (kind, quantity) in changes.items() if kind == 'set' and not quantity]
+    updated = [describe_item(names[item_id], quantity) for item_id, (kind, quantity) in changes.items() if kind == 'set' and quantity]
+    sentences = []
+    if added:
+        sentences.append(f"{store_name}의 {', '.join(added)}을(를) 장바구니에 추가했습니다.")
+    if removed:
+        sentences.append(f"{', '.join(removed)}을(를) 장바구니에서 뺐습니다.")
+    if updated:
+        sentences.append(f"{', '.join(updated)}(으)로 수량을 바꿨습니다.")
+    return ' '.join(sentences)
+
+
+def apply_operations(store_name, operations, current_order_state):
+    """
+    Applies a list of `CartOperation`s to the current order, or to a new order
+    if there is none or it belongs to another store. Returns
+    `(updated_order_state, message)`; the state is None if an item can't be found.
+    """
+    catalog = get_catalog()
+    resolved = []
+    for operation in operations:
+        menu_item = resolve_menu_item(catalog, operation.item_name, store_name)
+        if not menu_item:
+            return None, f"죄송합니다. '{store_name}'에서 '{operation.item_name}' 메뉴를 찾을 수 없습니다."
+        resolved.append((menu_item, operation))
+    store = resolved[0][0].store
+    if any(menu_item.store.id != store.id for menu_item, _ in resolved):
+        return None, "죄송합니다. 한 번에 한 가게의 메뉴만 담을 수 있습니다."
+
+    changes = _collapse(resolved)
+    names = {menu_item.id: menu_item.name for menu_item, _ in resolved}
+    order_id = current_order_state.get('orderId')
+
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(id=order_id).first() if order_id else None
+        # The same prices cart_state reads, so the order's totals agree with its items.
+        prices = dict(MenuItem.objects.filter(id__in=changes).values_list('id', 'price'))
+        missing = [menu_item for menu_item, _ in resolved if menu_item.id not in prices]
+        if missing:
+            return None, f"죄송합니다. '{store_name}'에서 '{missing[0].name}' 메뉴를 찾을 수 없습니다."
+        created = order is None or bool(order.store_id and order.store_id != store.id)
+        if created:
+            total_price, item_count = _total_deltas(changes, prices, {})
+            order = Order.objects.create(store_id=store.id, total_price=total_price, item_count=item_count)
+            _write_changes(order, changes, new_order=True)
+        else:
+            if not order.store_id:
+                order.store_id = store.id
+                order.save(update_fields=['store', 'updated_at'])
+            # Setting a quantity moves the totals by the difference to the stored one.
+            set_ids = [item_id for item_id, (kind, _) in changes.items() if kind == 'set']
+            previous = dict(
+                OrderItem.objects.filter(order=order, menu_item_id__in=set_ids).values_list('menu_item_id', 'quantity')
+            ) if set_ids else {}
+            _write_changes(order, changes)
+            total_delta, count_delta = _total_deltas(changes, prices, previous)
+            if total_delta or count_delta:
+                Order.objects.filter(id=order.id).update(
+                    total_price=F('total_price') + total_delta, item_count=F('item_count') + count_delta,
+                )
+                # The row is locked, so the stored values are the ones read above plus the deltas.
+                order.total_price += total_delta
+                order.item_count += count_delta
+        updated_order_state = cart_state(order, store.name)
+        events.publish(order, 'order_created' if created else 'cart_updated', {
+            'items': [{'name': item['name'], 'quantity': item['quantity']} for item in updated_order_state['items']],
+            'totalPrice': updated_order_state['totalPrice'],
+            'itemCount': updated_order_state['itemCount'],
+        })
+    return updated_order_state, _describe_changes(store.name, changes, names)
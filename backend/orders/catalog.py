@@ -0,0 +1,220 @@
+"""
+In-process, versioned snapshot of the menu catalog.
+
+The chat endpoint needs the full list of stores and menu items on almost every
+turn. Instead of querying the database each time, every worker keeps an
+immutable snapshot that is rebuilt lazily whenever the catalog version changes.
+The version is a row in the database (`CatalogVersion`), so a write in any
+worker or management command invalidates the snapshot in all of them. A
+worker re-reads it at most every `VERSION_CHECK_SECONDS`; its own writes it
+sees at once.
+
+Configured through `settings.CATALOG`:
+
+    'VERSION_CHECK_SECONDS': how long a worker trusts the version it last read
+
+Substring search over the snapshot goes through bigram postings (see
+`orders.search` for the database-side equivalent), so it only touches the
+entries that can match.
+"""
+import threading
+import time
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from .matcher import ngrams
+from .models import CatalogVersion, Store, MenuItem
+
+DEFAULTS = {
+    'VERSION_CHECK_SECONDS': 1.0,
+}
+
+
+@dataclass(frozen=True)
+class CatalogStore:
+    id: int
+    name: str
+    name_lower: str
+
+
+@dataclass(frozen=True)
+class CatalogItem:
+    id: int
+    name: str
+    name_lower: str
+    price: Decimal
+    category: str
+    store: CatalogStore
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    version: int
+    stores: tuple
+    items: tuple
+    categories: tuple
+    stores_by_category: dict
+    items_by_key: dict
+    items_by_store: dict
+    item_grams: dict
+    store_grams: dict
+
+    def find_item(self, item_name, store_name):
+        """Case-insensitive exact lookup of an item by its name and its store's name."""
+        return self.items_by_key.get((store_name.lower(), item_name.lower()))
+
+    def stores_for_category(self, category):
+        """Returns the stores selling at least one item of `category`."""
+        return self.stores_by_category.get(category, ())
+
+    def items_for_store(self, store_name):
+        """Returns the items of the store whose name matches case-insensitively."""
+        store_name = store_name.lower()
+        positions = []
+        for store in self.stores:
+            if store.name_lower == store_name:
+                positions.extend(self.items_by_store.get(store.id, ()))
+        return [self.items[position] for position in sorted(positions)]
+
+    @staticmethod
+    def _matching(needle, records, grams):
+        """Positions in `records` whose `name_lower` contains `needle`, via the bigram postings."""
+        needle_grams = ngrams(needle)
+        if not needle_grams:
+            return [position for position, record in enumerate(records) if needle in record.name_lower]
+        candidates = min((grams.get(gram, ()) for gram in needle_grams), key=len)
+        return [position for position in candidates if needle in records[position].name_lower]
+
+    def search(self, category=None, store_name=None, text=None):
+        """
+        In-memory equivalent of the fallback `icontains` lookups:
+        items whose name contains `category`, or whose store name contains
+        `store_name`. When neither is given, `text` is matched against both.
+        """
+        needles = []
+        if category:
+            needles.append(('item', category.lower()))
+        if store_name:
+            needles.append(('store', store_name.lower()))
+        if not needles and text:
+            needles = [('item', text.lower()), ('store', text.lower())]
+
+        positions = set()
+        for field, needle in needles:
+            if field == 'item':
+                positions.update(self._matching(needle, self.items, self.item_grams))
+            else:
+                for store_position in self._matching(needle, self.stores, self.store_grams):
+                    positions.update(self.items_by_store.get(self.stores[store_position].id, ()))
+        return [self.items[position] for position in sorted(positions)]
+
+
+_lock = threading.Lock()
+_snapshot = None
+_checked = (None, 0.0)  # (version, time.monotonic() when it was read)
+
+
+def _config():
+    return {**DEFAULTS, **getattr(settings, 'CATALOG', {})}
+
+
+def _clock_version():
+    # Versions never go below the clock, so a row that was rolled back, restored or
+    # recreated can't bring back a number some worker already built a snapshot for.
+    return time.time_ns() // 1000
+
+
+def _read_version():
+    global _checked
+    version = CatalogVersion.objects.filter(pk=1).values_list('version', flat=True).first()
+    if version is None:
+        version = CatalogVersion.objects.get_or_create(pk=1, defaults={'version': _clock_version()})[0].version
+    _checked = (version, time.monotonic())
+    return version
+
+
+def get_catalog_version():
+    version, checked_at = _checked
+    if version is not None and time.monotonic() - checked_at < _config()['VERSION_CHECK_SECONDS']:
+        return version
+    return _read_version()
+
+
+def bump_catalog_version():
+    """Marks every worker's snapshot as stale."""
+    bumped = Greatest(F('version') + 1, Value(_clock_version()))
+    if not CatalogVersion.objects.filter(pk=1).update(version=bumped):
+        _read_version()
+        CatalogVersion.objects.filter(pk=1).update(version=bumped)
+    return _read_version()
+
+
+def invalidate_catalog():
+    """Drops this worker's snapshot and bumps the version in the database."""
+    global _snapshot
+    with _lock:
+        _snapshot = None
+    bump_catalog_version()
+
+
+def _build_snapshot(version):
+    stores = {
+        store_id: CatalogStore(id=store_id, name=name, name_lower=name.lower())
+        for store_id, name in Store.objects.order_by('id').values_list('id', 'name')
+    }
+    items = tuple(
+        CatalogItem(id=item_id, name=name, name_lower=name.lower(), price=price, category=category, store=stores[store_id])
+        for item_id, name, price, category, store_id
+        in MenuItem.objects.order_by('id').values_list('id', 'name', 'price', 'category', 'store_id')
+    )
+
+    items_by_store = {}
+    item_grams = {}
+    for position, item in enumerate(items):
+        items_by_store.setdefault(item.store.id, []).append(position)
+        for gram in ngrams(item.name_lower):
+            item_grams.setdefault(gram, []).append(position)
+    store_grams = {}
+    for position, store in enumerate(stores.values()):
+        for gram in ngrams(store.name_lower):
+            store_grams.setdefault(gram, []).append(position)
+
+    stores_by_category = {}
+    for item in items:
+        if not item.category:
+            continue
+        category_stores = stores_by_category.setdefault(item.category, {})
+        category_stores[item.store.id] = item.store
+    stores_by_category = {
+        category: tuple(sorted(category_stores.values(), key=lambda store: store.id))
+        for category, category_stores in stores_by_category.items()
+    }
+
+    return CatalogSnapshot(
+        version=version,
+        stores=tuple(stores.values()),
+        items=items,
+        categories=tuple(sorted(stores_by_category)),
+        stores_by_category=stores_by_category,
+        items_by_key={(item.store.name_lower, item.name_lower): item for item in reversed(items)},
+        items_by_store={store_id: tuple(positions) for store_id, positions in items_by_store.items()},
+        item_grams={gram: tuple(positions) for gram, positions in item_grams.items()},
+        store_grams={gram: tuple(positions) for gram, positions in store_grams.items()},
+    )
+
+
+def get_catalog():
+    """Returns the current snapshot, rebuilding it if the catalog version moved."""
+    global _snapshot
+    version = get_catalog_version()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+    with _lock:
+        if _snapshot is None or _snapshot.version != version:
+            _snapshot = _build_snapshot(version)
+        return _snapshot
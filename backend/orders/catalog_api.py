@@ -0,0 +1,141 @@
+"""
+Pages of the menu catalog for the kiosk UI's read API (`CatalogView`).
+
+The kiosk would otherwise learn the menu by asking the LLM. A page holds all
+items, or one store's items, `PAGE_SIZE` at a time, with their stores and
+categories. It is rendered from the catalog snapshot once per catalog version:
+the JSON body, its gzip encoding and their strong ETags are all computed
+then, so serving a page, or answering a revalidation with 304, costs a dict
+lookup. Rendered pages are dropped as soon as the version moves.
+
+The ETag is a hash of the body rather than the catalog version. Every worker
+reads the same version from the `CatalogVersion` row, so either would agree
+across workers, but the version moves on any catalog change: a hash keeps the
+tag of a page whose items did not change, such as another store's, and its
+clients keep getting 304s. The gzip encoding is a different representation
+and gets its own tag.
+
+Configured through `settings.CATALOG_API`:
+
+    'PAGE_SIZE': items per page
+    'CACHE_CONTROL': Cache-Control of every page; 'no-cache' makes clients revalidate each use
+    'COMPRESS_MIN_BYTES': bodies smaller than this are not compressed
+    'MAX_PAGES': rendered pages kept per catalog version
+"""
+import gzip
+import hashlib
+import json
+import threading
+from dataclasses import dataclass
+
+from django.conf import settings
+
+from . import metrics
+from .catalog import get_catalog
+
+DEFAULTS = {
+    'PAGE_SIZE': 500,
+    'CACHE_CONTROL': 'public, no-cache',
+    'COMPRESS_MIN_BYTES': 512,
+    'MAX_PAGES': 1000,
+}
+
+
+class PageNotFound(LookupError):
+    pass
+
+
+@dataclass(frozen=True)
+class RenderedPage:
+    body: bytes
+    etag: str
+    gzipped: bytes = None
+    gzip_etag: str = None
+
+    def matches(self, etags):
+        """Whether any of `etags` (as parsed from If-None-Match) names this page in either encoding."""
+        return '*' in etags or any(tag.removeprefix('W/') in (self.etag, self.gzip_etag) for tag in etags)
+
+
+def _config():
+    return {**DEFAULTS, **getattr(settings, 'CATALOG_API', {})}
+
+
+def cache_control():
+    return _config()['CACHE_CONTROL']
+
+
+_lock = threading.Lock()
+_rendered = (None, {})
+
+
+def _render(catalog, store_id, page, config):
+    if store_id is None:
+        items = catalog.items
+        categories = list(catalog.categories)
+    else:
+        if not any(store.id == store_id for store in catalog.stores):
+            raise PageNotFound(f"Store {store_id} not found")
+        items = [catalog.items[position] for position in catalog.items_by_store.get(store_id, ())]
+        categories = sorted({item.category for item in items if item.category})
+
+    size = config['PAGE_SIZE']
+    pages = max(1, -(-len(items) // size))
+    if page > pages:
+        raise PageNotFound(f"Page {page} not found; there are {pages}")
+    page_items = items[(page - 1) * size:page * size]
+    stores = {item.store.id: item.store for item in page_items}
+
+    body = json.dumps({
+        'store': store_id,
+        'page': page,
+        'pages': pages,
+        'count': len(items),
+        'categories': categories,
+        'stores': [{'id': store.id, 'name': store.name} for store in sorted(stores.values(), key=lambda s: s.id)],
+        'items': [
+            {'id': item.id, 'store': item.store.id, 'name': item.name, 'price': float(item.price), 'category': item.category}
+            for item in page_items
+        ],
+    }, ensure_ascii=False, separators=(',', ':')).encode()
+
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    gzipped = None
+    if len(body) >= config['COMPRESS_MIN_BYTES']:
+        # mtime=0 keeps the bytes, and so the tag, the same across workers.
+        gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+    return RenderedPage(
+        body=body,
+        etag=f'"{digest}"',
+        gzipped=gzipped,
+        gzip_etag=f'"{digest}-gzip"' if gzipped is not None else None,
+    )
+
+
+def get_page(store_id=None, page=1):
+    """
+    The rendered `page` (1-based) of all items, or of `store_id`'s items, for
+    the current catalog version. Raises PageNotFound for an unknown store or
+    a page past the end.
+    """
+    global _rendered
+    config = _config()
+    catalog = get_catalog()
+    version, pages = _rendered
+    if version != catalog.version:
+        with _lock:
+            if _rendered[0] is None or _rendered[0] < catalog.version:
+                _rendered = (catalog.version, {})
+            version, pages = _rendered
+        if version != catalog.version:
+            # Another request already serves a newer version; don't cache this one's pages under it.
+            pages = {}
+
+    key = (store_id, page)
+    rendered = pages.get(key)
+    if rendered is None:
+        rendered = _render(catalog, store_id, page, config)
+        metrics.incr('catalog_api.rendered')
+        if len(pages) < config['MAX_PAGES']:
+            pages[key] = rendered
+    return rendered
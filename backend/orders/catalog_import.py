@@ -0,0 +1,226 @@
+"""
+Bulk import of stores and menu items.
+
+Franchise menus arrive as CSV (with a `store,name,price` header) or as JSON
+Lines (one `{"store": ..., "name": ..., "price": ...}` object per line). Rows
+are read as a stream and applied in chunks of `batch_size`, each in its own
+transaction. A chunk costs a few queries rather than a few per row:
+
+    1. the existing items it names, looked up by (store, LOWER(name))
+    2. `bulk_create` of the stores it introduces
+    3. `bulk_create` of new items
+    4. one UPDATE per new price of the repriced items
+
+Stores and items are matched case-insensitively, as `MenuItem`'s unique
+constraint and the catalog snapshot do. That constraint is on an expression,
+which `bulk_create(update_conflicts=True)` cannot name as its conflict target,
+so each chunk is diffed against the rows it read in step 1 instead. Rows that
+did not change are not written at all.
+
+Bulk writes skip `MenuItem.save()` and the model signals, so the category
+and the catalog version are maintained here. The version is bumped once at
+the end, not per row. It lives in the database, so web workers running in
+other processes pick the import up within their `VERSION_CHECK_SECONDS` (see
+`orders.catalog`). Chunks that committed before a failure stay committed;
+importing the same file again picks up where it stopped, because rows already
+applied come out unchanged.
+"""
+import csv
+import json
+import time
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+
+from .catalog import bump_catalog_version
+from .categories import get_category_from_item
+from .models import Store, MenuItem
+
+FORMATS = ('csv', 'jsonl')
+COLUMNS = ('store', 'name', 'price')
+
+NAME_LENGTH = MenuItem._meta.get_field('name').max_length
+STORE_NAME_LENGTH = Store._meta.get_field('name').max_length
+PRICE_LIMIT = Decimal(10) ** (MenuItem._meta.get_field('price').max_digits - 2)
+CENTS = Decimal('0.01')
+
+
+@dataclass
+class ImportReport:
+    rows: int = 0
+    stores_created: int = 0
+    items_created: int = 0
+    items_updated: int = 0
+    items_unchanged: int = 0
+    duplicates: int = 0
+    errors: list = field(default_factory=list)   # (line, message)
+    changes: list = field(default_factory=list)  # (store, item, old price or None, new price), up to max_changes
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def guess_format(path):
+    """'csv' or 'jsonl' from the file extension, or None."""
+    lowered = path.lower()
+    if lowered.endswith('.csv'):
+        return 'csv'
+    if lowered.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return None
+
+
+def read_rows(stream, format):
+    """Yields `(line number, raw row)` from an open text stream in one of `FORMATS`."""
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        missing = [column for column in COLUMNS if column not in (reader.fieldnames or ())]
+        if missing:
+            raise ValueError(f"CSV header lacks the column(s): {', '.join(missing)}")
+        for row in reader:
+            yield reader.line_num, row
+    elif format == 'jsonl':
+        for line, text in enumerate(stream, 1):
+            if not text.strip():
+                continue
+            try:
+                yield line, json.loads(text)
+            except json.JSONDecodeError as e:
+                yield line, e
+    else:
+        raise ValueError(f"Unknown catalog format {format!r}; expected one of {', '.join(FORMATS)}")
+
+
+def parse_row(raw):
+    """Returns `(store name, item name, price)` from a raw row, or raises ValueError."""
+    if isinstance(raw, json.JSONDecodeError):
+        raise ValueError(f"invalid JSON: {raw.msg}")
+    if not isinstance(raw, dict):
+        raise ValueError("not an object")
+    store = str(raw.get('store') or '').strip()
+    name = str(raw.get('name') or '').strip()
+    if not store or not name:
+        raise ValueError("store and name are required")
+    if len(store) > STORE_NAME_LENGTH or len(name) > NAME_LENGTH:
+        raise ValueError("name too long")
+    try:
+        price = Decimal(str(raw.get('price')).strip().replace(',', ''))
+    except InvalidOperation:
+        raise ValueError(f"invalid price {raw.get('price')!r}") from None
+    if not price.is_finite() or price < 0 or price >= PRICE_LIMIT:
+        raise ValueError(f"invalid price {raw.get('price')!r}")
+    return store, name, price.quantize(CENTS)
+
+
+def _store_ids(using):
+    """Lowercased store name -> (id, name). Of stores sharing a name, the oldest wins."""
+    stores = {}
+    for store_id, name in Store.objects.using(using).order_by('id').values_list('id', 'name'):
+        stores.setdefault(name.lower(), (store_id, name))
+    return stores
+
+
+def _existing_items(stores, rows, using):
+    """(store id, lowercased name) -> MenuItem for the already known items among `rows`."""
+    store_ids = {stores[store.lower()][0] for store, _, _ in rows if store.lower() in stores} - {None}
+    if not store_ids:
+        return {}
+    names = {name.lower() for _, name, _ in rows}
+    # Both conditions are indexed; the product may over-fetch a little, the dict lookup sorts it out.
+    items = MenuItem.objects.using(using).filter(store_id__in=store_ids, name__lower__in=names)
+    return {(item.store_id, item.name.lower()): item for item in items.only('id', 'store_id', 'name', 'price')}
+
+
+def _apply_chunk(rows, stores, report, dry_run, max_changes, using):
+    """Diffs one chunk of parsed rows against the database and writes the difference. Returns whether it wrote."""
+    existing = _existing_items(stores, rows, using)
+    new_stores = {}
+    creates, renames, repriced = [], [], {}
+    for store_name, name, price in rows:
+        store_key = store_name.lower()
+        if store_key not in stores and store_key not in new_stores:
+            new_stores[store_key] = Store(name=store_name)
+        store_id = stores[store_key][0] if store_key in stores else None
+        item = existing.get((store_id, name.lower()))
+        if item is None:
+            creates.append((store_key, MenuItem(name=name, price=price, category=get_category_from_item(name) or '')))
+            change = (store_name, name, None, price)
+        elif item.name != name:
+            old_price = item.price
+            item.name, item.price, item.category = name, price, get_category_from_item(name) or ''
+            renames.append(item)
+            change = (store_name, name, old_price, price)
+        elif item.price != price:
+            repriced.setdefault(price, []).append(item.id)
+            change = (store_name, name, item.price, price)
+        else:
+            report.items_unchanged += 1
+            continue
+        if len(report.changes) < max_changes:
+            report.changes.append(change)
+
+    report.stores_created += len(new_stores)
+    report.items_created += len(creates)
+    report.items_updated += len(renames) + sum(len(ids) for ids in repriced.values())
+    if dry_run or not (new_stores or creates or renames or repriced):
+        for store_key, store in new_stores.items():
+            stores[store_key] = (None, store.name)
+        return False
+
+    with transaction.atomic(using=using):
+        if new_stores:
+            Store.objects.using(using).bulk_create(new_stores.values())
+            for store_key, store in new_stores.items():
+                stores[store_key] = (store.id, store.name)
+        for store_key, item in creates:
+            item.store_id = stores[store_key][0]
+        items = [item for _, item in creates]
+        MenuItem.objects.using(using).bulk_create(items)
+        # A refresh mostly moves prices, and branches share them: one UPDATE per price rather
+        # than bulk_update's CASE per row, which slows down badly at thousands of rows.
+        for price, ids in repriced.items():
+            MenuItem.objects.using(using).filter(id__in=ids).update(price=price)
+        # Names only ever change case here, so the LOWER(name) indexes and unique constraint keep their keys;
+        # the catalog snapshot picks the new spelling up from the version bump at the end of the import.
+        MenuItem.objects.using(using).bulk_update(renames, ['name', 'price', 'category'])
+    return True
+
+
+def import_catalog(rows, batch_size=2000, dry_run=False, max_changes=100, using='default'):
+    """
+    Creates or reprices the stores and items in `rows`, an iterable of
+    `(line number, raw row)` as yielded by `read_rows`. Rows that fail to parse
+    are skipped and listed in the report's errors. Within a chunk the last row
+    for an item wins. With `dry_run`, nothing is written and the report says
+    what would have been.
+    """
+    report = ImportReport()
+    started = time.perf_counter()
+    stores = _store_ids(using)
+    rows = iter(rows)
+    wrote = False
+    try:
+        while chunk := list(islice(rows, batch_size)):
+            parsed = {}
+            for line, raw in chunk:
+                report.rows += 1
+                try:
+                    store, name, price = parse_row(raw)
+                except ValueError as e:
+                    report.errors.append((line, str(e)))
+                    continue
+                key = (store.lower(), name.lower())
+                if key in parsed:
+                    report.duplicates += 1
+                parsed[key] = (store, name, price)
+            if _apply_chunk(list(parsed.values()), stores, report, dry_run, max_changes, using):
+                wrote = True
+    finally:
+        if wrote:
+            transaction.on_commit(bump_catalog_version, using=using)
+        report.seconds = time.perf_counter() - started
+    return report
@@ -0,0 +1,13 @@
+def get_category_from_item(item_name):
+    """Extracts a representative category from a menu item name."""
+    if '버거' in item_name: return '버거'
+    if '커피' in item_name or '라떼' in item_name: return '커피'
+    if '김밥' in item_name: return '김밥'
+    if '마라탕' in item_name or '마라샹궈' in item_name: return '마라'
+    if '떡볶이' in item_name or '라면' in item_name: return '분식'
+    if '토스트' in item_name: return '토스트'
+    if '스무디' in item_name or '티' in item_name or '에이드' in item_name: return '음료'
+    if '베이글' in item_name or '크로와상' in item_name: return '베이커리'
+    if '샌드위치' in item_name: return '샌드위치'
+    if '과일' in item_name: return '과일'
+    return None
@@ -0,0 +1,312 @@
+"""
+Order event bus for kitchen displays.
+
+Every change to an order is appended to `OrderEvent` in the same transaction
+as the change itself: carts written by `orders.cart` and status transitions
+saved with `update_fields` (see `orders.signals`). The event id is the
+offset a client resumes from. `OrderEventsView` streams one store's events
+as Server-Sent Events. It first replays the log after the client's
+`Last-Event-ID`, then forwards live events from the bus. A display that
+connects without an offset starts from the latest event, live only.
+
+The bus only carries committed events to the subscribers in this process:
+
+    'local'     in-process fan-out after commit; enough for a single worker and for tests
+    'postgres'  NOTIFY in the writing transaction; one LISTEN connection per process
+                loads the announced events in a batch and fans them out locally
+
+Either way an event reaches a process once and is then handed to all of
+its subscribers with one callback per event loop. Hundreds of open
+streams cost a queue each rather than a database connection or a query
+each. A subscriber that falls `QUEUE_SIZE` events behind is not blocked on.
+It is told to catch up from the log instead.
+
+Configured through `settings.ORDER_EVENTS`:
+
+    'BACKEND': 'local', 'postgres', or 'auto' (postgres on PostgreSQL, else local)
+    'CHANNEL': NOTIFY channel name
+    'QUEUE_SIZE': live events buffered per subscriber before it falls back to the log
+    'REPLAY_BATCH': events read per query when replaying the log
+    'KEEPALIVE_SECONDS': interval of SSE comment frames on an idle stream
+"""
+import asyncio
+import logging
+import select
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection, connections, transaction
+
+from . import metrics
+from .models import OrderEvent
+
+DEFAULTS = {
+    'BACKEND': 'auto',
+    'CHANNEL': 'order_events',
+    'QUEUE_SIZE': 1000,
+    'REPLAY_BATCH': 500,
+    'KEEPALIVE_SECONDS': 15,
+}
+
+logger = logging.getLogger(__name__)
+
+# Wakes a subscriber that overflowed: it has to read the log from its offset.
+CATCH_UP = None
+
+
+def _config():
+    return {**DEFAULTS, **getattr(settings, 'ORDER_EVENTS', {})}
+
+
+def serialize(event):
+    return {
+        'id': event.id,
+        'order': event.order_id,
+        'store': event.store_id,
+        'kind': event.kind,
+        'status': event.status,
+        'payload': event.payload,
+        'created_at': event.created_at.isoformat(),
+    }
+
+
+def latest_event_id(store_id):
+    """Id of the last logged event of `store_id`, or 0."""
+    return OrderEvent.objects.filter(store_id=store_id).order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def events_after(store_id, after, limit):
+    """Up to `limit` logged events of `store_id` with an id above `after`, oldest first."""
+    events = OrderEvent.objects.filter(store_id=store_id, id__gt=after).order_by('id')[:limit]
+    return [serialize(event) for event in events]
+
+
+class Subscription:
+    """Live events of one store for one stream. Created and read on the stream's event loop."""
+
+    def __init__(self, store_id, queue_size):
+        self.store_id = store_id
+        self.loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def put(self, event):
+        """Queues `event`; runs on the subscription's loop."""
+        if self.overflowed:
+            return
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            metrics.incr('order_events.overflowed')
+            self.overflowed = True
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self._queue.put_nowait(CATCH_UP)
+
+    async def get(self, timeout=None):
+        """The next live event, CATCH_UP, or asyncio.TimeoutError after `timeout` seconds."""
+        event = await asyncio.wait_for(self._queue.get(), timeout)
+        if event is CATCH_UP:
+            self.overflowed = False
+        return event
+
+
+def _deliver(batches):
+    for subscription, events in batches.items():
+        for event in events:
+            subscription.put(event)
+
+
+class LocalBackend:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def subscribe(self, store_id):
+        subscription = Subscription(store_id, _config()['QUEUE_SIZE'])
+        with self._lock:
+            self._subscriptions.setdefault(store_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.store_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.store_id, None)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def publish(self, event, using):
+        transaction.on_commit(lambda: self.dispatch([event]), using=using)
+
+    def dispatch(self, events):
+        """Hands committed `events` to this process's subscribers, one callback per event loop."""
+        by_loop = {}
+        with self._lock:
+            for event in events:
+                for subscription in self._subscriptions.get(event['store'], ()):
+                    by_loop.setdefault(subscription.loop, {}).setdefault(subscription, []).append(event)
+        for loop, batches in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(_deliver, batches)
+            except RuntimeError:  # the loop is closed; its streams are gone
+                for subscription in batches:
+                    self.unsubscribe(subscription)
+        metrics.incr('order_events.dispatched', len(events))
+
+    def catch_up_all(self):
+        """Makes every subscriber re-read the log, e.g. after notifications may have been lost."""
+        with self._lock:
+            subscriptions = [s for store in self._subscriptions.values() for s in store]
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, CATCH_UP)
+            except RuntimeError:
+                self.unsubscribe(subscription)
+
+
+class PostgresBackend(LocalBackend):
+    RECONNECT_DELAY = 1.0
+    POLL_SECONDS = 5.0
+
+    def __init__(self, channel, using='default'):
+        super().__init__()
+        self.channel = channel
+        self.using = using
+        self._listener = None
+
+    def subscribe(self, store_id):
+        self._ensure_listener()
+        return super().subscribe(store_id)
+
+    def publish(self, event, using):
+        # Delivered by PostgreSQL when (and only if) the transaction commits.
+        with connections[using].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, str(event['id'])])
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen_forever, name='order-events-listener', daemon=True)
+                self._listener.start()
+
+    def _listen_forever(self):
+        while True:
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("Order event listener lost its connection")
+            # Notifications sent while disconnected are lost; the log still has the events.
+            self.catch_up_all()
+            time.sleep(self.RECONNECT_DELAY)
+
+    def _listen(self):
+        wrapper = connections[self.using]
+        listener = wrapper.get_new_connection(wrapper.get_connection_params())
+        try:
+            listener.autocommit = True
+            with listener.cursor() as cursor:
+                cursor.execute(f'LISTEN {wrapper.ops.quote_name(self.channel)}')
+            while True:
+                if select.select([listener], [], [], self.POLL_SECONDS) == ([], [], []):
+                    continue
+                listener.poll()
+                ids = [int(notify.payload) for notify in listener.notifies]
+                listener.notifies.clear()
+                if ids:
+                    self.dispatch(self._load(ids))
+        finally:
+            listener.close()
+
+    def _load(self, ids):
+        close_old_connections()
+        return [serialize(event) for event in OrderEvent.objects.filter(id__in=ids).order_by('id')]
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                config = _config()
+                name = config['BACKEND']
+                if name == 'auto':
+                    name = 'postgres' if connection.vendor == 'postgresql' else 'local'
+                _backend = PostgresBackend(config['CHANNEL']) if name == 'postgres' else LocalBackend()
+    return _backend
+
+
+def reset_backend():
+    """Forgets the configured backend so settings changes take effect (used by tests)."""
+    global _backend
+    with _backend_lock:
+        _backend = None
+
+
+def publish(order, kind, payload=None, using='default'):
+    """
+    Appends an event for `order` to the log and announces it once the
+    surrounding transaction commits. Orders without a store have no display
+    to go to and are skipped.
+    """
+    if order.store_id is None:
+        return None
+    event = OrderEvent.objects.using(using).create(
+        order_id=order.id, store_id=order.store_id, kind=kind, status=order.status, payload=payload or {},
+    )
+    get_backend().publish(serialize(event), using)
+    return event
+
+
+async def stream(store_id, after=None):
+    """
+    Yields the events of `store_id` after offset `after`: first from the log,
+    then live. Without `after`, starts after the latest logged event; pass 0
+    for the whole log. Each event is yielded once; None is yielded when the
+    stream has been idle for `KEEPALIVE_SECONDS`.
+    """
+    config = _config()
+    backend = get_backend()
+    # Subscribe before reading the log so nothing committed in between is missed.
+    subscription = backend.subscribe(store_id)
+    metrics.incr('order_events.subscribed')
+    replayed = set()  # live copies of these arrive too; skip them
+    try:
+        if after is None:
+            after = await sync_to_async(latest_event_id)(store_id)
+        needs_log = True
+        while True:
+            if needs_log:
+                needs_log = False
+                replayed = set()
+                while True:
+                    replay = await sync_to_async(events_after)(store_id, after, config['REPLAY_BATCH'])
+                    for event in replay:
+                        replayed.add(event['id'])
+                        after = max(after, event['id'])
+                        yield event
+                    if len(replay) < config['REPLAY_BATCH']:
+                        break
+            try:
+                event = await subscription.get(config['KEEPALIVE_SECONDS'])
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            if event is CATCH_UP:
+                needs_log = True
+                continue
+            if event['id'] in replayed:
+                continue
+            after = max(after, event['id'])
+            yield event
+    finally:
+        backend.unsubscribe(subscription)
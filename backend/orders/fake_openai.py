@@ -0,0 +1,141 @@
+"""
+Local stand-in for the OpenAI chat completions API.
+
+Serves `POST /v1/chat/completions` (plain and `stream=True`) from a background
+thread so benchmarks and tests can exercise the real client code path without
+network access. Point `settings.OPENAI_BASE_URL` at `server.base_url`.
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        with server.lock:
+            index = len(server.requests)
+            server.requests.append(body)
+        delay = server.delay(index) if callable(server.delay) else server.delay
+        if delay:
+            time.sleep(delay)
+        if index < server.failures:
+            self._send_error(503)
+            return
+
+        reply = server.reply(body) if callable(server.reply) else server.reply
+        model = body.get('model', 'fake')
+        if body.get('stream'):
+            self._send_stream(reply, model, server.chunk_size)
+        else:
+            self._send_json({
+                'id': 'chatcmpl-fake',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': reply}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+            })
+
+    def _send_json(self, data):
+        payload = json.dumps(data, ensure_ascii=False).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, status):
+        payload = json.dumps({'error': {'message': 'fake upstream failure', 'type': 'server_error'}}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_stream(self, reply, model, chunk_size):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for start in range(0, len(reply), chunk_size):
+            chunk = {
+                'id': 'chatcmpl-fake',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': {'content': reply[start:start + chunk_size]}, 'finish_reason': None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Cancelled hedges and timed-out calls hang up mid-reply; that is expected here.
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+
+class FakeOpenAIServer:
+    """
+    Context manager running the stub on a free local port.
+
+    `reply` is either a string or a callable receiving the request body.
+    `delay` adds a latency in seconds to every call; a callable receives the
+    0-based request index, so individual requests can be made slow.
+    The first `failures` requests are answered with a 503.
+    """
+
+    def __init__(self, reply="네, 무엇을 도와드릴까요?", delay=0.0, chunk_size=8, failures=0):
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.reply = reply
+        self._server.delay = delay
+        self._server.chunk_size = chunk_size
+        self._server.failures = failures
+        self._server.requests = []
+        self._server.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def requests(self):
+        return self._server.requests
+
+    def set_reply(self, reply, delay=None, failures=None):
+        self._server.reply = reply
+        if delay is not None:
+            self._server.delay = delay
+        if failures is not None:
+            self._server.failures = failures
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
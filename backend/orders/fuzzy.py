@@ -0,0 +1,188 @@
+"""
+Typo-tolerant resolution of menu item and store names.
+
+Item names reach `_update_order` through speech-to-text and the LLM, so they
+often differ from the catalog in spacing ("싸이 버거") or by a misheard
+syllable ("싸이버가"). Names are compared after normalization (lowercase,
+no whitespace or punctuation) and decomposed into jamo, so one wrong vowel
+costs one edit instead of a whole syllable. Candidates come from precomputed
+indexes: exact normalized names, choseong (initial consonant) keys and jamo
+trigram postings. Only those candidates are scored with an edit distance.
+
+`get_resolver(catalog)` returns the resolver for a catalog snapshot and
+rebuilds it only when the catalog version changes.
+"""
+import re
+
+HANGUL_FIRST = 0xAC00
+HANGUL_LAST = 0xD7A3
+CHOSEONG = 'ㄱㄲㄴㄷㄸㄹㅁㅂㅃㅅㅆㅇㅈㅉㅊㅋㅌㅍㅎ'
+JUNGSEONG = 'ㅏㅐㅑㅒㅓㅔㅕㅖㅗㅘㅙㅚㅛㅜㅝㅞㅟㅠㅡㅢㅣ'
+JONGSEONG = ('', 'ㄱ', 'ㄲ', 'ㄳ', 'ㄴ', 'ㄵ', 'ㄶ', 'ㄷ', 'ㄹ', 'ㄺ', 'ㄻ', 'ㄼ', 'ㄽ', 'ㄾ', 'ㄿ', 'ㅀ',
+             'ㅁ', 'ㅂ', 'ㅄ', 'ㅅ', 'ㅆ', 'ㅇ', 'ㅈ', 'ㅊ', 'ㅋ', 'ㅌ', 'ㅍ', 'ㅎ')
+
+GRAM_SIZE = 3
+# Jamo similarity (1 - edit distance / length) a name must reach to be accepted.
+MIN_SIMILARITY = 0.75
+# Postings longer than this carry too little information to rank candidates.
+MAX_POSTINGS = 2000
+MAX_CANDIDATES = 32
+
+_NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalize(text):
+    """Lowercases `text` and drops whitespace and punctuation."""
+    return _NON_WORD.sub('', (text or '').lower())
+
+
+def decompose(text):
+    """Splits precomposed Hangul syllables into their jamo; other characters pass through."""
+    jamo = []
+    for char in text:
+        code = ord(char)
+        if HANGUL_FIRST <= code <= HANGUL_LAST:
+            index = code - HANGUL_FIRST
+            jamo.append(CHOSEONG[index // 588])
+            jamo.append(JUNGSEONG[index // 28 % 21])
+            jamo.append(JONGSEONG[index % 28])
+        else:
+            jamo.append(char)
+    return ''.join(jamo)
+
+
+def choseong(text):
+    """Replaces each Hangul syllable with its initial consonant ("싸이버거" -> "ㅆㅇㅂㄱ")."""
+    return ''.join(
+        CHOSEONG[(ord(char) - HANGUL_FIRST) // 588] if HANGUL_FIRST <= ord(char) <= HANGUL_LAST else char
+        for char in text
+    )
+
+
+def _is_choseong_only(text):
+    return bool(text) and all(char in CHOSEONG for char in text)
+
+
+def edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def similarity(a, b):
+    if not a or not b:
+        return 0.0
+    return 1 - edit_distance(a, b) / max(len(a), len(b))
+
+
+def _grams(text):
+    return {text[i:i + GRAM_SIZE] for i in range(max(1, len(text) - GRAM_SIZE + 1))}
+
+
+class _NameIndex:
+    """Lookup structures over the names of one kind of catalog record (stores or items)."""
+
+    def __init__(self, records):
+        self.records = records
+        self.jamo = []
+        self.by_name = {}
+        self.by_choseong = {}
+        self.postings = {}
+        for position, record in enumerate(records):
+            name = normalize(record.name)
+            jamo = decompose(name)
+            self.jamo.append(jamo)
+            self.by_name.setdefault(name, []).append(position)
+            self.by_choseong.setdefault(choseong(name), []).append(position)
+            for gram in _grams(jamo):
+                self.postings.setdefault(gram, []).append(position)
+
+    def _candidates(self, name, jamo):
+        """Positions worth scoring: choseong matches, then the best jamo trigram overlaps."""
+        found = set(self.by_choseong.get(choseong(name), ()))
+        overlaps = {}
+        for gram in _grams(jamo):
+            postings = self.postings.get(gram, ())
+            if len(postings) > MAX_POSTINGS:
+                continue
+            for position in postings:
+                overlaps[position] = overlaps.get(position, 0) + 1
+        found.update(sorted(overlaps, key=lambda position: (-overlaps[position], position))[:MAX_CANDIDATES])
+        return found
+
+    def _closest(self, jamo, positions):
+        best = None
+        for position in sorted(positions):
+            other = self.jamo[position]
+            floor = MIN_SIMILARITY if best is None else best[0]
+            # The length difference alone is a lower bound on the edit distance.
+            if abs(len(jamo) - len(other)) > (1 - floor) * max(len(jamo), len(other)):
+                continue
+            score = similarity(jamo, other)
+            if score > floor or (best is None and score >= floor):
+                best = (score, position)
+        return best[1] if best else None
+
+    def lookup(self, name, positions=None):
+        """
+        Returns the position of the record closest to the normalized `name`,
+        or None. Ties go to the lowest position; `positions` restricts the search.
+        """
+        if not name:
+            return None
+        exact = self.by_name.get(name, ())
+        if _is_choseong_only(name):
+            exact = self.by_choseong.get(name, ())
+        if positions is not None:
+            exact = [position for position in exact if position in positions]
+        if exact or _is_choseong_only(name):
+            return min(exact, default=None)
+
+        jamo = decompose(name)
+        return self._closest(jamo, self._candidates(name, jamo) if positions is None else positions)
+
+
+class MenuResolver:
+    def __init__(self, catalog):
+        self._stores = _NameIndex(catalog.stores)
+        self._items = _NameIndex(catalog.items)
+        self._item_positions_by_store = {}
+        for position, item in enumerate(catalog.items):
+            self._item_positions_by_store.setdefault(item.store.id, set()).add(position)
+
+    def resolve_store(self, store_name):
+        """Returns the closest catalog store to `store_name`, or None."""
+        position = self._stores.lookup(normalize(store_name))
+        return None if position is None else self._stores.records[position]
+
+    def resolve_item(self, item_name, store=None):
+        """
+        Returns the closest catalog item to `item_name`, or None. With `store`,
+        only that store's menu is considered.
+        """
+        positions = None if store is None else self._item_positions_by_store.get(store.id, frozenset())
+        position = self._items.lookup(normalize(item_name), positions)
+        return None if position is None else self._items.records[position]
+
+    def resolve(self, item_name, store_name):
+        store = self.resolve_store(store_name) if store_name else None
+        if store_name and store is None:
+            return None
+        return self.resolve_item(item_name, store)
+
+
+_resolver = None
+
+
+def get_resolver(catalog):
+    """Returns the resolver for `catalog`, rebuilding it only when the catalog version changes."""
+    global _resolver
+    cached = _resolver
+    if cached is None or cached[0] != catalog.version:
+        cached = (catalog.version, MenuResolver(catalog))
+        _resolver = cached
+    return cached[1]
@@ -0,0 +1,129 @@
+"""
+Liveness, readiness and startup warmup of a worker.
+
+`HealthCheckMiddleware` answers two paths before the rest of the stack runs:
+
+    LIVENESS_PATH   200 as long as the process serves requests; no queries, no work
+    READINESS_PATH  200 once the database answers and this worker's catalog
+                    snapshot, NLU automaton, menu resolver, order parser and
+                    prompt digest are built; 503 with the cold parts otherwise
+
+The indexes are per process and built lazily, so without a warmup the first
+customer on each new worker pays for them. `config.asgi` and `config.wsgi`
+call `warm_up_on_startup()` once they have loaded Django, so each worker
+builds them before it accepts connections. This is not done in
+`AppConfig.ready`, which also runs for `migrate` and the other management
+commands, possibly before the tables exist. A worker whose warmup failed
+(e.g. the database was not reachable yet) warms up in the background when
+its readiness is next asked for. A catalog change later does not make a
+worker unready: its indexes are rebuilt on the next request that needs them,
+and readiness reports them as stale until then.
+
+Configured through `settings.HEALTH`:
+
+    'LIVENESS_PATH', 'READINESS_PATH': the two paths
+    'WARMUP_ON_STARTUP': whether the server entry points warm the worker up
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, connections
+
+DEFAULTS = {
+    'LIVENESS_PATH': '/health',
+    'READINESS_PATH': '/health/ready',
+    'WARMUP_ON_STARTUP': True,
+}
+
+logger = logging.getLogger(__name__)
+
+_warming = threading.Lock()
+
+
+def _config():
+    return {**DEFAULTS, **getattr(settings, 'HEALTH', {})}
+
+
+def _built_versions():
+    """Catalog version each per-process index was built for, or None if it was not built yet."""
+    from . import catalog, fuzzy, order_parser, prompt, views
+
+    def version(cached):
+        return None if cached is None else cached[0]
+
+    snapshot = catalog._snapshot
+    return {
+        'catalog': None if snapshot is None else snapshot.version,
+        'nlu': version(views._nlu_automaton),
+        'resolver': version(fuzzy._resolver),
+        'order_parser': version(order_parser._parser),
+        'prompt_digest': version(prompt._digest),
+    }
+
+
+def warm_up():
+    """Builds this worker's catalog snapshot and the indexes derived from it. Returns the seconds taken."""
+    from .catalog import get_catalog
+    from .fuzzy import get_resolver
+    from .order_parser import get_order_parser
+    from .prompt import get_catalog_digest
+    from .views import get_nlu_automaton
+
+    started = time.perf_counter()
+    catalog = get_catalog()
+    get_nlu_automaton(catalog)
+    get_resolver(catalog)
+    get_order_parser(catalog)
+    get_catalog_digest(catalog)
+    return time.perf_counter() - started
+
+
+def _warm_up_once():
+    if not _warming.acquire(blocking=False):
+        return  # already under way
+    try:
+        seconds = warm_up()
+        logger.info("Worker warmed up in %.2fs", seconds)
+    except Exception:
+        logger.exception("Worker warmup failed")
+    finally:
+        # Requests don't run on this thread; don't keep its connection open.
+        connections.close_all()
+        _warming.release()
+
+
+def warm_up_on_startup():
+    if _config()['WARMUP_ON_STARTUP']:
+        _warm_up_once()
+
+
+def _start_warm_up():
+    threading.Thread(target=_warm_up_once, name='worker-warmup', daemon=True).start()
+
+
+def _check_database():
+    started = time.perf_counter()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except Exception as e:
+        return {'ok': False, 'error': str(e)}
+    return {'ok': True, 'ms': round((time.perf_counter() - started) * 1000, 2)}
+
+
+def readiness():
+    """`(ready, report)` for the readiness path. Starts a background warmup if an index is missing."""
+    from .catalog import get_catalog_version
+
+    report = {'database': _check_database()}
+    ready = report['database']['ok']
+    current = get_catalog_version() if ready else None
+    for name, version in _built_versions().items():
+        report[name] = {'built': version is not None, 'stale': version is not None and version != current}
+        ready = ready and version is not None
+    if report['database']['ok'] and not ready:
+        _start_warm_up()
+    report['ready'] = ready
+    return ready, report
@@ -0,0 +1,267 @@
+"""
+Access to the OpenAI chat completion API.
+
+The chat view is async, so completions go through `AsyncOpenAI`. One client
+(and therefore one keep-alive connection pool) is kept per event loop: under
+ASGI that is one per worker, while under WSGI each request's loop gets its own.
+
+Every call is bounded. Each HTTP attempt has connect and read timeouts, and
+the call as a whole has a deadline that covers retries and hedges too.
+Timeouts, connection errors, 429s and 5xx responses are retried with
+full-jitter exponential backoff; the SDK's own retries are disabled so only
+this policy applies. When hedging is on, `complete` sends a second identical
+request if the first has not answered within the recent p95 latency. Whichever
+answers first wins and the other is cancelled.
+
+Configured through `settings.LLM_CLIENT`:
+
+    'TIMEOUT': deadline in seconds for a whole call, retries and hedges included
+    'ATTEMPT_TIMEOUT': read timeout of a single HTTP attempt
+    'CONNECT_TIMEOUT': connect timeout of a single HTTP attempt
+    'MAX_RETRIES': retries after the first attempt
+    'BACKOFF_BASE', 'BACKOFF_MAX': backoff before retry n is uniform in [0, min(max, base * 2**n)]
+    'HEDGE': whether `complete` hedges slow requests
+    'HEDGE_PERCENTILE', 'HEDGE_MIN_SAMPLES': latency percentile that triggers a hedge,
+        and how many successful calls must be observed before hedging starts
+    'MAX_CONNECTIONS', 'MAX_KEEPALIVE', 'KEEPALIVE_EXPIRY': connection pool limits
+
+Changes take effect for new clients; call `reset_clients()` after overriding them.
+
+Calls also go through the circuit breaker in `orders.breaker`: while it is
+open they fail at once with `CircuitOpen`. `UNAVAILABLE_ERRORS` lists what a
+caller should treat as "the LLM can't answer this turn".
+"""
+import asyncio
+import random
+import threading
+import time
+import weakref
+from collections import deque
+
+import httpx
+from django.conf import settings
+from openai import (
+    APIConnectionError, APIError, AsyncOpenAI, DefaultAsyncHttpxClient, InternalServerError, RateLimitError,
+)
+
+from . import metrics, single_flight
+from .breaker import CircuitBreaker, CircuitOpen
+
+CHAT_MODEL = "gpt-3.5-turbo"
+
+DEFAULTS = {
+    'TIMEOUT': 20.0,
+    'ATTEMPT_TIMEOUT': 10.0,
+    'CONNECT_TIMEOUT': 2.0,
+    'MAX_RETRIES': 2,
+    'BACKOFF_BASE': 0.2,
+    'BACKOFF_MAX': 2.0,
+    'HEDGE': True,
+    'HEDGE_PERCENTILE': 95,
+    'HEDGE_MIN_SAMPLES': 20,
+    'MAX_CONNECTIONS': 20,
+    'MAX_KEEPALIVE': 10,
+    'KEEPALIVE_EXPIRY': 30.0,
+}
+
+# APITimeoutError is a subclass of APIConnectionError.
+RETRYABLE_ERRORS = (APIConnectionError, RateLimitError, InternalServerError)
+
+_clients = weakref.WeakKeyDictionary()
+
+
+class LLMTimeout(Exception):
+    """The call did not finish within its deadline."""
+
+
+UNAVAILABLE_ERRORS = (CircuitOpen, LLMTimeout, APIError)
+
+breaker = CircuitBreaker()
+
+
+class LatencyWindow:
+    """Durations of the most recent successful requests, for the hedging threshold."""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percent, min_samples=1):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples or len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+
+latencies = LatencyWindow()
+
+
+def _config():
+    return {**DEFAULTS, **getattr(settings, 'LLM_CLIENT', {})}
+
+
+def get_client():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        config = _config()
+        client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=settings.OPENAI_BASE_URL,
+            max_retries=0,
+            timeout=httpx.Timeout(config['ATTEMPT_TIMEOUT'], connect=config['CONNECT_TIMEOUT']),
+            http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(
+                max_connections=config['MAX_CONNECTIONS'],
+                max_keepalive_connections=config['MAX_KEEPALIVE'],
+                keepalive_expiry=config['KEEPALIVE_EXPIRY'],
+            )),
+        )
+        _clients[loop] = client
+    return client
+
+
+def reset_clients():
+    """Drops cached clients and breaker state so settings changes (e.g. the base URL) take effect."""
+    _clients.clear()
+    latencies.clear()
+    breaker.reset()
+
+
+def _check_breaker():
+    if not breaker.allow():
+        raise CircuitOpen("LLM circuit breaker is open")
+
+
+def backoff_delay(attempt, config):
+    """Full jitter: a uniform delay up to the capped exponential backoff for `attempt` (0-based)."""
+    return random.uniform(0, min(config['BACKOFF_MAX'], config['BACKOFF_BASE'] * 2 ** attempt))
+
+
+async def _with_retries(call, config):
+    for attempt in range(config['MAX_RETRIES'] + 1):
+        try:
+            return await call()
+        except RETRYABLE_ERRORS:
+            if attempt == config['MAX_RETRIES']:
+                metrics.incr('llm.failures')
+                raise
+            metrics.incr('llm.retries')
+            await asyncio.sleep(backoff_delay(attempt, config))
+
+
+async def _timed(call):
+    started = time.perf_counter()
+    result = await call()
+    elapsed = time.perf_counter() - started
+    latencies.add(elapsed)
+    metrics.observe('llm.request', elapsed)
+    return result
+
+
+async def _hedged(call, config):
+    """
+    Runs `call`, starting a second copy if the first is slower than the recent
+    percentile latency. Returns the first successful result; if both copies
+    fail, raises the first error.
+    """
+    hedge_after = None
+    if config['HEDGE']:
+        hedge_after = latencies.percentile(config['HEDGE_PERCENTILE'], config['HEDGE_MIN_SAMPLES'])
+    if hedge_after is None:
+        return await _timed(call)
+
+    first = asyncio.ensure_future(_timed(call))
+    tasks = [first]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+        if not done:
+            metrics.incr('llm.hedged')
+            tasks.append(asyncio.ensure_future(_timed(call)))
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not first:
+                        metrics.incr('llm.hedge_won')
+                    return task.result()
+        raise first.exception()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def complete(messages, model=CHAT_MODEL, timeout=None):
+    """
+    Returns the text of a single chat completion for `messages`. `timeout`
+    overrides the configured deadline for this call. Identical concurrent
+    calls share one upstream request (see `orders.single_flight`).
+    """
+    deadline = _config()['TIMEOUT'] if timeout is None else timeout
+    try:
+        return await single_flight.run(
+            single_flight.prompt_key(model, messages),
+            lambda: _complete(messages, model, deadline),
+            wait_timeout=deadline,
+        )
+    except asyncio.TimeoutError:
+        # Only a waiting follower (or a leader waiting on another worker) gets here;
+        # the call's own deadline raises LLMTimeout below.
+        metrics.incr('llm.deadline_exceeded')
+        raise LLMTimeout(f"LLM call exceeded its {deadline}s deadline") from None
+
+
+async def _complete(messages, model, deadline):
+    _check_breaker()
+    config = _config()
+    create = lambda: get_client().chat.completions.create(model=model, messages=messages)
+    started = time.perf_counter()
+    try:
+        response = await asyncio.wait_for(_with_retries(lambda: _hedged(create, config), config), deadline)
+    except asyncio.TimeoutError:
+        metrics.incr('llm.deadline_exceeded')
+        breaker.record(time.perf_counter() - started, failed=True)
+        raise LLMTimeout(f"LLM call exceeded its {deadline}s deadline") from None
+    except Exception:
+        breaker.record(time.perf_counter() - started, failed=True)
+        raise
+    breaker.record(time.perf_counter() - started)
+    return response.choices[0].message.content
+
+
+async def stream(messages, model=CHAT_MODEL, timeout=None):
+    """
+    Yields the text deltas of a streamed chat completion as they arrive.
+    Opening the stream is retried and bounded by the deadline; once text has
+    been yielded the stream is never restarted, and each read is bounded by
+    the attempt timeout.
+    """
+    _check_breaker()
+    config = _config()
+    deadline = config['TIMEOUT'] if timeout is None else timeout
+    create = lambda: get_client().chat.completions.create(model=model, messages=messages, stream=True)
+    started = time.perf_counter()
+    try:
+        try:
+            response = await asyncio.wait_for(_with_retries(create, config), deadline)
+        except asyncio.TimeoutError:
+            metrics.incr('llm.deadline_exceeded')
+            raise LLMTimeout(f"LLM call exceeded its {deadline}s deadline") from None
+        # A long answer is not a slow upstream: judge latency by the time to open the stream.
+        opened = time.perf_counter() - started
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except Exception:
+        breaker.record(time.perf_counter() - started, failed=True)
+        raise
+    breaker.record(opened)
@@ -0,0 +1,168 @@
+"""
+Response cache in front of the chat completion call.
+
+Kiosk traffic is very repetitive, so identical general queries asked against
+the same catalog and conversation context reuse an earlier completion. The
+cached value is the raw completion text; the view still parses it, so any
+`add_to_cart` action is applied again on a hit.
+
+Configured through `settings.LLM_RESPONSE_CACHE`:
+
+    'BACKEND': 'local' (per-worker LRU), 'django' (the Django cache) or 'none'
+    'MAX_ENTRIES': LRU size for the local backend
+    'TIMEOUT': entry lifetime in seconds
+    'ALIAS': Django cache alias for the 'django' backend
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+# conversationState fields that change what the model should answer.
+KEY_STATE_FIELDS = ('awaiting_payment_confirmation', 'last_ai_question', 'last_inquired_category', 'presented_stores')
+
+DEFAULTS = {
+    'BACKEND': 'local',
+    'MAX_ENTRIES': 1000,
+    'TIMEOUT': 300,
+    'ALIAS': 'default',
+}
+
+
+def normalize_message(text):
+    """Lowercases, collapses whitespace and drops trailing punctuation."""
+    text = re.sub(r'\s+', ' ', text.lower()).strip()
+    return text.rstrip('?!.~ ')
+
+
+def make_cache_key(user_message, conversation_state, db_search_result, catalog_version, history=(), summary_lines=()):
+    """
+    `history` and `summary_lines` are the earlier turns the prompt carries. A
+    short reply such as "네" only means something in their context, so two
+    conversations never share an answer unless they share those too.
+    """
+    state = {field: conversation_state.get(field) for field in KEY_STATE_FIELDS}
+    context = json.dumps([list(summary_lines), list(history)], ensure_ascii=False, sort_keys=True)
+    raw = json.dumps(
+        [
+            normalize_message(user_message), state, hashlib.sha256(db_search_result.encode()).hexdigest(),
+            catalog_version, hashlib.sha256(context.encode()).hexdigest(),
+        ],
+        ensure_ascii=False, sort_keys=True,
+    )
+    return 'orders:llm:' + hashlib.sha256(raw.encode()).hexdigest()
+
+
+class LocalLRUBackend:
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def aget(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    async def aset(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DjangoCacheBackend:
+    def __init__(self, alias, timeout):
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    async def aget(self, key):
+        return await self.cache.aget(key)
+
+    async def aset(self, key, value):
+        await self.cache.aset(key, value, timeout=self.timeout)
+
+    def clear(self):
+        self.cache.clear()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Returns the configured backend, or None when caching is disabled."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                config = {**DEFAULTS, **getattr(settings, 'LLM_RESPONSE_CACHE', {})}
+                if config['BACKEND'] == 'local':
+                    _backend = LocalLRUBackend(config['MAX_ENTRIES'], config['TIMEOUT'])
+                elif config['BACKEND'] == 'django':
+                    _backend = DjangoCacheBackend(config['ALIAS'], config['TIMEOUT'])
+                else:
+                    _backend = False
+    return _backend or None
+
+
+def reset_backend():
+    """Forgets the configured backend so settings changes take effect (used by tests)."""
+    global _backend
+    with _backend_lock:
+        _backend = None
+
+
+async def get_cached(cache_key):
+    """Returns the cached completion for `cache_key`, or None on a miss."""
+    backend = get_backend()
+    if backend is None:
+        return None
+    started = time.perf_counter()
+    cached = await backend.aget(cache_key)
+    if cached is not None:
+        metrics.incr('llm_cache.hit')
+        metrics.observe('llm_cache.hit_latency', time.perf_counter() - started)
+    return cached
+
+
+async def store(cache_key, text, latency):
+    """Stores a freshly produced completion; `latency` is how long it took upstream."""
+    backend = get_backend()
+    if backend is None:
+        return
+    metrics.incr('llm_cache.miss')
+    metrics.observe('llm_cache.miss_latency', latency)
+    if text:
+        await backend.aset(cache_key, text)
+
+
+async def cached_completion(cache_key, produce):
+    """Returns the cached completion for `cache_key`, or awaits `produce()` and caches its result."""
+    cached = await get_cached(cache_key)
+    if cached is not None:
+        return cached
+    started = time.perf_counter()
+    text = await produce()
+    await store(cache_key, text, time.perf_counter() - started)
+    return text
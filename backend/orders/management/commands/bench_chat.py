@@ -0,0 +1,67 @@
+import json
+import platform
+from datetime import datetime, timezone
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from orders.benchmarks import DEFAULT_SIZES, compare_results, run_benchmarks, run_query_plans
+
+
+class Command(BaseCommand):
+    help = (
+        "Times the chat hot path against synthetic catalogs and a local fake OpenAI server. "
+        "Runs in a throwaway test database and prints JSON results."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='Catalog sizes (menu items) to benchmark.')
+        parser.add_argument('--iterations', type=int, default=50, help='Timed calls per benchmark.')
+        parser.add_argument('--llm-delay', type=float, default=0.0, help='Simulated upstream latency in seconds.')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout.')
+        parser.add_argument('--compare', help='Baseline JSON file from an earlier run to compare against.')
+        parser.add_argument('--query-plans', action='store_true', help='Also report plans of the hot lookups with and without the schema indexes.')
+        parser.add_argument('--threshold', type=float, default=1.2, help='p50 ratio above which a result counts as a regression.')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = run_benchmarks(options['sizes'], options['iterations'], options['llm_delay'])
+            query_plans = run_query_plans(options['sizes'], options['iterations']) if options['query_plans'] else None
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'meta': {
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+            },
+            'results': results,
+        }
+        if query_plans is not None:
+            report['query_plans'] = query_plans
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline = json.load(f)['results']
+            regressions = compare_results(results, baseline, options['threshold'])
+            for regression in regressions:
+                self.stderr.write(
+                    f"REGRESSION {regression['name']} @ {regression['catalog_size']}: "
+                    f"p50 {regression['baseline_p50_ms']}ms -> {regression['p50_ms']}ms (x{regression['ratio']})"
+                )
+            if regressions:
+                raise CommandError(f"{len(regressions)} benchmark(s) regressed beyond x{options['threshold']}")
@@ -0,0 +1,63 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.catalog_import import FORMATS, guess_format, import_catalog, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates or reprices stores and menu items in bulk from a CSV file (store,name,price header) "
+        "or a JSON Lines file, and bumps the catalog version once at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or '-' for standard input.")
+        parser.add_argument('--format', choices=FORMATS, help='Input format. Guessed from the file extension by default.')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows applied per transaction.')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing.')
+        parser.add_argument('--show-changes', type=int, default=20, help='Created or repriced items to list.')
+        parser.add_argument('--database', default='default', help='Database alias to import into.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or guess_format(path)
+        if format is None:
+            raise CommandError(f"Can't tell the format of {path!r}; pass --format ({' or '.join(FORMATS)}).")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        # utf-8-sig: spreadsheet exports often start with a byte order mark.
+        try:
+            stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+        except OSError as e:
+            raise CommandError(f"Can't read {path!r}: {e}")
+        try:
+            report = import_catalog(
+                read_rows(stream, format),
+                batch_size=options['batch_size'],
+                dry_run=options['dry_run'],
+                max_changes=options['show_changes'],
+                using=options['database'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for store, name, old_price, new_price in report.changes:
+            if old_price is None:
+                self.stdout.write(f"+ {store} / {name}: {new_price}")
+            else:
+                self.stdout.write(f"~ {store} / {name}: {old_price} -> {new_price}")
+        for line, message in report.errors:
+            self.stderr.write(f"line {line}: {message}")
+
+        verb = "Would import" if options['dry_run'] else "Imported"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {report.rows} row(s) in {report.seconds:.2f}s ({report.rows_per_second:,.0f} rows/s): "
+            f"{report.stores_created} store(s) created, {report.items_created} item(s) created, "
+            f"{report.items_updated} updated, {report.items_unchanged} unchanged, "
+            f"{report.duplicates} duplicate(s), {len(report.errors)} error(s)."
+        ))
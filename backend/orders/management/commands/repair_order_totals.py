@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from orders.cart import repair_order_totals
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the denormalized total_price and item_count of every order from its items. "
+        "Run after writes to order items that bypass orders.cart."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Orders checked and fixed per UPDATE.')
+
+    def handle(self, *args, **options):
+        repaired = repair_order_totals(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Repaired the totals of {repaired} order(s)."))
@@ -0,0 +1,81 @@
+"""
+Text matching primitives.
+
+`KeywordAutomaton` is an Aho-Corasick multi-pattern matcher: it finds every
+occurrence of a fixed set of keywords in a single pass over the text, so the
+cost of a lookup depends on the length of the utterance rather than on the
+number of keywords or catalog entries. `ngrams` splits names into the
+character n-grams that the catalog snapshot's substring index is built from.
+"""
+from collections import deque
+
+GRAM_SIZE = 2
+
+
+def ngrams(text, size=GRAM_SIZE):
+    """Returns the set of lowercase character n-grams of `text`."""
+    text = (text or '').lower()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class KeywordAutomaton:
+    """
+    Compiled automaton over `(pattern, tag)` pairs.
+
+    The same tag may be shared by several patterns (e.g. every finalization
+    keyword) and a pattern may carry several tags.
+    """
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+
+        outputs = [[]]
+        for pattern, tag in patterns:
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    outputs.append([])
+                state = next_state
+            outputs[state].append(tag)
+
+        # Breadth-first pass to compute failure links and merge the outputs of
+        # every suffix state into its parent, so matching never walks the chain.
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                outputs[next_state].extend(outputs[self._fail[next_state]])
+
+        self._output = [tuple(tags) for tags in outputs]
+
+    def find(self, text):
+        """Returns the set of tags whose patterns occur anywhere in `text`."""
+        found = set()
+        for _, tags in self.iter_matches(text):
+            found.update(tags)
+        return found
+
+    def iter_matches(self, text):
+        """Yields `(end, tags)` for every position where at least one pattern ends (exclusive end index)."""
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                yield index + 1, output[state]
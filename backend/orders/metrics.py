@@ -0,0 +1,49 @@
+"""
+Minimal in-process metrics registry.
+
+Counters and timing summaries are kept per worker and exposed as JSON by
+`MetricsView`, which is enough to compare hit rates and latencies without
+pulling in a metrics client.
+"""
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_timings = {}
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name, seconds):
+    """Records one duration sample for `name`."""
+    with _lock:
+        count, total, maximum = _timings.get(name, (0, 0.0, 0.0))
+        _timings[name] = (count + 1, total + seconds, max(maximum, seconds))
+
+
+def snapshot():
+    with _lock:
+        counters = dict(_counters)
+        timings = dict(_timings)
+    return {
+        'counters': counters,
+        'timings': {
+            name: {
+                'count': count,
+                'total_ms': round(total * 1000, 3),
+                'avg_ms': round(total * 1000 / count, 3),
+                'max_ms': round(maximum * 1000, 3),
+            }
+            for name, (count, total, maximum) in timings.items()
+        },
+    }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timings.clear()
@@ -0,0 +1,142 @@
+import json
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.http import HttpResponse, JsonResponse
+
+from . import health
+from .timing import resume_timer, start_timer, stop_timer
+
+logger = logging.getLogger('orders.timing')
+
+
+class RequestTimingMiddleware:
+    """
+    Times each request with a `RequestTimer`, adds a `Server-Timing` header
+    and logs the per-stage breakdown as one JSON line.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer, token = start_timer()
+        try:
+            response = self.get_response(request)
+        finally:
+            stop_timer(token)
+        return self._finish(request, response, timer)
+
+    async def __acall__(self, request):
+        timer, token = start_timer()
+        try:
+            response = await self.get_response(request)
+        finally:
+            stop_timer(token)
+        return self._finish(request, response, timer)
+
+    def _finish(self, request, response, timer):
+        response['Server-Timing'] = timer.server_timing()
+        response.request_timing = timer
+        if response.streaming:
+            # Logged once the body has been sent, with whatever was timed while streaming it.
+            if response.is_async:
+                response.streaming_content = self._timed_async(response.streaming_content, request, response, timer)
+            else:
+                response.streaming_content = self._timed(response.streaming_content, request, response, timer)
+        else:
+            self._log(request, response, timer)
+        return response
+
+    def _log(self, request, response, timer):
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            **timer.as_dict(),
+        }, ensure_ascii=False))
+
+    def _timed(self, content, request, response, timer):
+        try:
+            iterator = iter(content)
+            while True:
+                token = resume_timer(timer)
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    stop_timer(token)
+                yield chunk
+        finally:
+            self._log(request, response, timer)
+
+    async def _timed_async(self, content, request, response, timer):
+        try:
+            iterator = aiter(content)
+            while True:
+                token = resume_timer(timer)
+                try:
+                    chunk = await anext(iterator)
+                except StopAsyncIteration:
+                    return
+                finally:
+                    stop_timer(token)
+                yield chunk
+        finally:
+            self._log(request, response, timer)
+
+
+class HealthCheckMiddleware:
+    """
+    Answers the liveness and readiness paths (see `orders.health`) without
+    running the rest of the stack. Goes first in MIDDLEWARE: probes are
+    neither timed nor logged, and they don't go through the ALLOWED_HOSTS
+    check, since the platform's prober doesn't use the public host name.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = health._config()
+        self.liveness_path = config['LIVENESS_PATH'].rstrip('/')
+        self.readiness_path = config['READINESS_PATH'].rstrip('/')
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        path = request.path_info.rstrip('/')
+        if path == self.liveness_path:
+            return self._alive()
+        if path == self.readiness_path:
+            return self._ready(*health.readiness())
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        path = request.path_info.rstrip('/')
+        if path == self.liveness_path:
+            return self._alive()
+        if path == self.readiness_path:
+            return self._ready(*await sync_to_async(health.readiness)())
+        return await self.get_response(request)
+
+    @staticmethod
+    def _alive():
+        response = HttpResponse(b'ok', content_type='text/plain')
+        response['Cache-Control'] = 'no-store'
+        return response
+
+    @staticmethod
+    def _ready(ready, report):
+        response = JsonResponse(report, status=200 if ready else 503)
+        response['Cache-Control'] = 'no-store'
+        return response
@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-18 01:06
+
+from django.db import migrations, models
+
+from orders.categories import get_category_from_item
+
+
+def fill_categories(apps, schema_editor):
+    MenuItem = apps.get_model('orders', 'MenuItem')
+    items = list(MenuItem.objects.only('id', 'name'))
+    for item in items:
+        item.category = get_category_from_item(item.name) or ''
+    MenuItem.objects.bulk_update(items, ['category'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_alter_order_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menuitem',
+            name='category',
+            field=models.CharField(blank=True, db_index=True, max_length=20),
+        ),
+        migrations.RunPython(fill_categories, migrations.RunPython.noop),
+    ]
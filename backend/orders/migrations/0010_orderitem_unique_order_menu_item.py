@@ -0,0 +1,34 @@
+# Generated by Django 5.2 on 2026-10-18 01:14
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_order_items(apps, schema_editor):
+    # Lost-update races could leave several rows per (order, menu_item); fold them into one.
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    duplicates = (
+        OrderItem.objects.values('order_id', 'menu_item_id')
+        .annotate(rows=Count('id'), keep=Min('id'), total=Sum('quantity'))
+        .filter(rows__gt=1)
+    )
+    for duplicate in duplicates:
+        OrderItem.objects.filter(id=duplicate['keep']).update(quantity=duplicate['total'])
+        OrderItem.objects.filter(
+            order_id=duplicate['order_id'], menu_item_id=duplicate['menu_item_id'],
+        ).exclude(id=duplicate['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0009_menuitem_category'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_order_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(fields=('order', 'menu_item'), name='unique_order_menu_item'),
+        ),
+    ]
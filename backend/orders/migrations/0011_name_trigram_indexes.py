@@ -0,0 +1,34 @@
+# Generated by Django 5.2 on 2026-10-18 01:20
+
+from django.db import migrations
+
+TRIGRAM_INDEXES = [
+    ('orders_store_name_trgm', 'orders_store'),
+    ('orders_menuitem_name_trgm', 'orders_menuitem'),
+]
+
+
+def add_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for index_name, table in TRIGRAM_INDEXES:
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON {table} USING gin (UPPER(name::text) gin_trgm_ops)')
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for index_name, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {index_name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0010_orderitem_unique_order_menu_item'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_trigram_indexes, drop_trigram_indexes),
+    ]
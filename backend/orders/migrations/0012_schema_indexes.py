@@ -0,0 +1,58 @@
+# Generated by Django 5.2 on 2026-10-18 01:44
+
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models import Count, F, Min
+from django.db.models.functions import Lower
+
+
+def merge_duplicate_menu_items(apps, schema_editor):
+    # Items entered twice in a store (same name up to case) are folded into the oldest row.
+    MenuItem = apps.get_model('orders', 'MenuItem')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    duplicates = (
+        MenuItem.objects.values('store_id', name_lower=Lower('name'))
+        .annotate(rows=Count('id'), keep=Min('id'))
+        .filter(rows__gt=1)
+    )
+    for duplicate in duplicates:
+        extra = (
+            MenuItem.objects.annotate(name_lower=Lower('name'))
+            .filter(store_id=duplicate['store_id'], name_lower=duplicate['name_lower'])
+            .exclude(id=duplicate['keep'])
+        )
+        for order_item in OrderItem.objects.filter(menu_item__in=extra):
+            kept = OrderItem.objects.filter(order_id=order_item.order_id, menu_item_id=duplicate['keep'])
+            if kept.update(quantity=F('quantity') + order_item.quantity):
+                order_item.delete()
+            else:
+                order_item.menu_item_id = duplicate['keep']
+                order_item.save(update_fields=['menu_item'])
+        extra.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0011_name_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='menuitem',
+            index=models.Index(django.db.models.functions.text.Lower('name'), name='orders_menuitem_name_lower'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'created_at'], name='orders_order_status_created'),
+        ),
+        migrations.AddIndex(
+            model_name='store',
+            index=models.Index(django.db.models.functions.text.Lower('name'), name='orders_store_name_lower'),
+        ),
+        migrations.RunPython(merge_duplicate_menu_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='menuitem',
+            constraint=models.UniqueConstraint(models.F('store'), django.db.models.functions.text.Lower('name'), name='unique_menu_item_store_name'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2 on 2026-10-18 01:48
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, PositiveIntegerField, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_order_totals(apps, schema_editor):
+    Order = apps.get_model('orders', 'Order')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    total = items.annotate(total=Sum(F('quantity') * F('menu_item__price'), output_field=DecimalField())).values('total')
+    count = items.annotate(count=Sum('quantity')).values('count')
+    Order.objects.update(
+        total_price=Coalesce(Subquery(total), Value(0), output_field=DecimalField()),
+        item_count=Coalesce(Subquery(count), Value(0), output_field=PositiveIntegerField()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0012_schema_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(fill_order_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-18 01:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0013_order_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('order_created', '주문 생성'), ('cart_updated', '장바구니 변경'), ('status_changed', '상태 변경')], max_length=20)),
+                ('status', models.CharField(choices=[('pending', '주문중'), ('awaiting_payment', '결제 대기'), ('completed', '주문 완료'), ('cancelled', '주문 취소')], max_length=20)),
+                ('payload', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='orders.order')),
+                ('store', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='orders.store')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['store', 'id'], name='orders_orderevent_store')],
+            },
+        ),
+    ]
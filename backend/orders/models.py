@@ -1,9 +1,17 @@
 from django.db import models
+from django.db.models.functions import Lower
+
+from .categories import get_category_from_item
 
 class Store(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(Lower('name'), name='orders_store_name_lower'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -11,10 +19,35 @@ class MenuItem(models.Model):
     store = models.ForeignKey(Store, related_name='menu_items', on_delete=models.CASCADE)
     name = models.CharField(max_length=100)
     price = models.DecimalField(max_digits=10, decimal_places=2)
+    category = models.CharField(max_length=20, blank=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            # Also the (store, name) index: serves store_id = ? AND LOWER(name) = ?, and store_id = ? alone.
+            models.UniqueConstraint(models.F('store'), Lower('name'), name='unique_menu_item_store_name'),
+        ]
+        indexes = [
+            models.Index(Lower('name'), name='orders_menuitem_name_lower'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Keep the category index in sync with the name on every write.
+        self.category = get_category_from_item(self.name) or ''
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'category'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f'{self.name} - {self.store.name}'
 
+# `name__lower='...'` compiles to LOWER("name") = '...', which the functional
+# Lower('name') indexes above can serve. `name__iexact` can't use them: it is
+# UPPER(...) = UPPER(...) on PostgreSQL and LIKE on SQLite. Registered on these
+# two fields only, not on every CharField in the project.
+Store._meta.get_field('name').register_lookup(Lower)
+MenuItem._meta.get_field('name').register_lookup(Lower)
+
 class Order(models.Model):
     STATUS_CHOICES = [
         ('pending', '주문중'),
@@ -27,6 +60,14 @@ class Order(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Denormalized from the order's items by orders.cart; `repair_order_totals` recomputes them.
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='orders_order_status_created'),
+        ]
 
     def __str__(self):
         return f'Order {self.id} at {self.store.name if self.store else "N/A"}'
@@ -36,5 +77,41 @@ class OrderItem(models.Model):
     menu_item = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'menu_item'], name='unique_order_menu_item'),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity} x {self.menu_item.name}'
+
+class OrderEvent(models.Model):
+    """Append-only log of order changes; see orders/events.py. The id is the offset clients resume from."""
+    KIND_CHOICES = [
+        ('order_created', '주문 생성'),
+        ('cart_updated', '장바구니 변경'),
+        ('status_changed', '상태 변경'),
+    ]
+
+    order = models.ForeignKey(Order, related_name='events', on_delete=models.CASCADE)
+    # Indexed by the (store, id) index below.
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, db_index=False)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['store', 'id'], name='orders_orderevent_store'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} of order {self.order_id} ({self.status})'
+
+class CatalogVersion(models.Model):
+    """The one row counting catalog changes; every worker compares it with its snapshot. See orders/catalog.py."""
+    version = models.BigIntegerField()
+
     def __str__(self):
-        return f'{self.quantity} x {self.menu_item.name}'
\ No newline at end of file
+        return f'catalog version {self.version}'
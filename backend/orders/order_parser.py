@@ -0,0 +1,165 @@
+"""
+Deterministic parser for explicit orders.
+
+Utterances such as "불고기버거 2개 주세요" or "아메리카노 두 잔이랑 카페라떼"
+need no language model: they consist only of catalog item names, quantities
+with counters, connectives and ordering phrases. `parse_order` accepts an
+utterance only when every part of it is one of those; anything else
+("불고기버거 맛있어?") returns None and goes to the LLM as before.
+
+Matching runs on the utterance with whitespace removed, against item and
+store names with whitespace removed, so "불고기 버거" is the same item as
+"불고기버거". At every position the longest name wins.
+"""
+import re
+from dataclasses import dataclass
+
+from .matcher import KeywordAutomaton
+
+MAX_QUANTITY = 99
+
+NATIVE_NUMBERS = {
+    '하나': 1, '한': 1, '둘': 2, '두': 2, '셋': 3, '세': 3, '석': 3, '넷': 4, '네': 4,
+    '다섯': 5, '여섯': 6, '일곱': 7, '여덟': 8, '아홉': 9,
+}
+COUNTERS = ['세트', '인분', '그릇', '조각', '개', '잔', '병', '캔', '컵', '판']
+# Connectives, particles and ordering phrases allowed around the items.
+FILLERS = [
+    '주문해주세요', '주문할게요', '주문할게', '주문해줘', '주문이요', '주문',
+    '추가해주세요', '추가해줘', '추가요', '추가', '담아주세요', '담아줘',
+    '주시겠어요', '주실래요', '주세요', '줘요', '줘', '주라',
+    '할게요', '할게', '시킬게요', '시킬게', '부탁해요', '부탁합니다',
+    '그리고', '이랑', '하고', '에서', '이요', '랑', '와', '과', '도', '또', '더', '좀', '의', '요',
+]
+
+# These only count as numbers before a counter; a bare "네" is "yes", a bare "한" starts "한라봉".
+NEEDS_COUNTER = {'한', '두', '세', '석', '네'}
+
+_NUMBER_PATTERN = '|'.join(sorted(NATIVE_NUMBERS, key=len, reverse=True))
+_COUNTER_PATTERN = '|'.join(COUNTERS)
+_QUANTITY_RE = re.compile(
+    rf'(?P<digits>\d+)(?:{_COUNTER_PATTERN})?'
+    rf'|(?P<ten>열)?(?P<native>{_NUMBER_PATTERN})(?P<counter>{_COUNTER_PATTERN})?'
+    rf'|(?P<only_ten>열)(?:{_COUNTER_PATTERN})?'
+)
+_FILLER_RE = re.compile('(?:' + '|'.join(sorted(FILLERS, key=len, reverse=True)) + r'|[.,!?~])+')
+_WHITESPACE = re.compile(r'\s+')
+
+
+@dataclass(frozen=True)
+class OrderLine:
+    name: str
+    quantity: int
+    items: tuple  # every catalog item with this name, in catalog order
+
+
+@dataclass(frozen=True)
+class ParsedOrder:
+    lines: tuple
+    store: object  # the CatalogStore named in the utterance, if any
+
+
+def _compact(text):
+    return _WHITESPACE.sub('', (text or '').lower())
+
+
+def _quantity(match):
+    if match.group('digits'):
+        return int(match.group('digits'))
+    if match.group('only_ten'):
+        return 10
+    native = match.group('native')
+    if native in NEEDS_COUNTER and not match.group('counter'):
+        return None
+    return NATIVE_NUMBERS[native] + (10 if match.group('ten') else 0)
+
+
+class OrderParser:
+    """Item and store name automaton for one catalog snapshot."""
+
+    def __init__(self, catalog):
+        self._items = {}
+        for item in catalog.items:
+            self._items.setdefault(_compact(item.name), []).append(item)
+        self._stores = {}
+        for store in catalog.stores:
+            self._stores.setdefault(_compact(store.name), store)
+        patterns = [(name, ('item', name)) for name in self._items]
+        patterns += [(name, ('store', name)) for name in self._stores]
+        self._automaton = KeywordAutomaton(patterns)
+
+    def _longest_matches(self, text):
+        """Maps each start position to the longest `(end, tag)` that starts there."""
+        longest = {}
+        for end, tags in self._automaton.iter_matches(text):
+            for tag in tags:
+                start = end - len(tag[1])
+                if start not in longest or longest[start][0] < end:
+                    longest[start] = (end, tag)
+        return longest
+
+    def parse(self, text):
+        """Returns a `ParsedOrder`, or None if `text` isn't purely an explicit order."""
+        text = _compact(text)
+        matches = self._longest_matches(text)
+        lines = []
+        store = None
+        position = 0
+        while position < len(text):
+            if position in matches:
+                end, (kind, name) = matches[position]
+                position = end
+                if kind == 'store':
+                    if store is not None and store is not self._stores[name]:
+                        return None
+                    store = self._stores[name]
+                    continue
+                quantity = 1
+                quantity_match = _QUANTITY_RE.match(text, position)
+                if quantity_match and _quantity(quantity_match) is not None:
+                    quantity = _quantity(quantity_match)
+                    position = quantity_match.end()
+                if not 0 < quantity <= MAX_QUANTITY:
+                    return None
+                lines.append(OrderLine(name=name, quantity=quantity, items=tuple(self._items[name])))
+                continue
+            filler = _FILLER_RE.match(text, position)
+            if not filler:
+                return None
+            position = filler.end()
+        return ParsedOrder(lines=tuple(lines), store=store) if lines else None
+
+
+_parser = None
+
+
+def get_order_parser(catalog):
+    """Returns the parser for `catalog`, rebuilding it only when the catalog version changes."""
+    global _parser
+    cached = _parser
+    if cached is None or cached[0] != catalog.version:
+        cached = (catalog.version, OrderParser(catalog))
+        _parser = cached
+    return cached[1]
+
+
+def parse_order(text, catalog):
+    return get_order_parser(catalog).parse(text)
+
+
+def pick_store(parsed, current_store_name=None):
+    """
+    Chooses the store for a parsed order: the one named in the utterance, else
+    the only store selling every item, else the store of the current cart if it
+    sells them all. Returns None when the choice is ambiguous.
+    """
+    candidates = None
+    for line in parsed.lines:
+        stores = {item.store.id: item.store for item in line.items}
+        candidates = stores if candidates is None else {k: v for k, v in candidates.items() if k in stores}
+    if parsed.store is not None:
+        return parsed.store if parsed.store.id in candidates else None
+    if len(candidates) == 1:
+        return next(iter(candidates.values()))
+    current = [store for store in candidates.values() if store.name == current_store_name]
+    return current[0] if current else None
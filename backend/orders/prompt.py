@@ -0,0 +1,251 @@
+"""
+Token-budgeted prompt construction for the LLM fallback.
+
+The system prompt, the DB search block and the newest turns go to the model
+verbatim; older turns are folded into a compact rolling summary so that long
+kiosk sessions don't make every following turn slower and more expensive.
+Folding is incremental: `fold_to_window` compresses each message once, when it
+leaves the verbatim window, and the server-side session (`orders.sessions`)
+stores the resulting lines, so later turns only send them along. Clients that
+upload their own `history` have no stored summary, so theirs is rebuilt from
+the full history every turn.
+
+Messages are laid out from the most to the least stable, so the upstream's
+prefix cache can skip re-reading the front of the prompt:
+
+    1. `SYSTEM_PROMPT`, a constant
+    2. the catalog digest: categories and stores in a fixed order, the same
+       for every turn until the catalog version changes
+    3. the rolling summary and the recent turns. Messages are folded into the
+       summary `FOLD_EVERY` at a time rather than every turn, so between folds
+       this part only grows at its end
+    4. the DB search block and the user message, which change every turn
+
+`token_counts` reports each part, and `prefix` is what 1 and 2 add up to.
+
+Limits come from `settings.CHAT_PROMPT`:
+
+    'MAX_TOKENS': budget for the whole prompt
+    'RECENT_MESSAGES': history messages always kept verbatim (budget permitting)
+    'SUMMARY_MAX_TOKENS': budget for the rolling summary
+    'FOLD_EVERY': history messages moved into the summary at a time
+    'DIGEST_MAX_TOKENS': budget for the catalog digest; stores past it are only counted
+"""
+import logging
+import re
+
+from django.conf import settings
+
+try:
+    import tiktoken
+except ImportError:  # pinned in requirements.txt; without it, tokens are estimated
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'MAX_TOKENS': 3000,
+    'RECENT_MESSAGES': 8,
+    'SUMMARY_MAX_TOKENS': 300,
+    'FOLD_EVERY': 8,
+    'DIGEST_MAX_TOKENS': 800,
+}
+
+# Opens every prompt, so keep it byte-for-byte stable: any edit starts the upstream's prefix cache over.
+SYSTEM_PROMPT = (
+    "너는 AI 키오스크 '보이스오더'의 친절한 안내원이야. 너의 목표는 사용자가 DB에 있는 메뉴를 주문하고 결제하도록 돕는 거야."
+    "1. **DB 검색 결과 활용:** 사용자가 메뉴, 가게, 추천을 물어보면, 반드시 '메뉴 카탈로그'와 'DB 검색 결과' 섹션에 제공된 정보만을 사용해서 답변해야 해. 없는 것은 절대 제안해서는 안 돼."
+    "2. **주문 실행 (장바구니 변경):** 사용자가 메뉴를 주문하거나 빼거나 수량을 바꾸면, '네, [메뉴이름]을 장바구니에 추가했습니다. 추가로 주문할 상품이 있으신가요?'와 같은 확인 메시지와 함께 다음 JSON 형식을 반드시 응답의 마지막에 포함해야 해."
+    '''```json
+{
+  "action": "update_cart",
+  "store_name": "가게이름",
+  "operations": [
+    {"op": "add", "item_name": "메뉴이름", "quantity": 2},
+    {"op": "remove", "item_name": "메뉴이름"},
+    {"op": "set_quantity", "item_name": "메뉴이름", "quantity": 1}
+  ]
+}
+```'''
+    "   - 한 번에 여러 메뉴를 주문하면 `operations`에 모두 넣어. `op`는 add(추가), remove(삭제), set_quantity(수량 지정) 중 하나야."
+    "   - `item_name`과 `store_name`에는 'DB 검색 결과'에 명시된 정확한 전체 이름을 사용해야 해. 사용자가 모호하게 말하면, 명확한 메뉴를 다시 물어봐줘."
+    "   - 이 액션 외의 다른 말은 절대로 JSON에 넣지 마."
+    "3. **결제 안내:** 사용자가 '카드 결제', 'QR 결제' 등 결제 방식을 말하면, 그에 맞는 안내 메시지를 생성해줘. 예를 들어 '카드로 결제할게요'라고 하면 '네, 카드 결제를 진행합니다. 잠시만 기다려주세요.' 와 같이 답변해. 이 때는 JSON을 생성하면 안 돼."
+    "4. **일반 대화:** 주문과 관련 없는 일반 대화나, JSON 행동이 필요 없는 경우에는 JSON 블록 없이 자유롭게 답변해."
+    "5. **금지된 행동:** '결제할게', '주문 완료' 같은 말에는 직접 반응하지 마. 백엔드가 이 말을 먼저 처리해서 결제 페이지로 안내할 거야. 또한 '결제 성공', '결제 취소' 같은 시스템 용어에도 반응하지 마."
+    "6. **명확한 안내:** 가게 이름, 메뉴 이름, 가격을 명확하게 말해서 사용자가 혼동하지 않게 해야 해."
+    "7. **'아니요' 처리:** 만약 AI가 '추가로 필요하신 거 있으세요?'라고 물었을 때 사용자가 '아니요'라고 답하면, 이는 주문을 확정하고 결제 단계로 넘어가겠다는 의미로 해석하고, '결제 페이지로 이동합니다. 결제 방법을 선택해주세요.'라고 안내해줘. 이 때는 JSON을 생성하면 안 돼."
+)
+
+
+# Per-message framing overhead of the chat format.
+MESSAGE_OVERHEAD_TOKENS = 4
+SUMMARY_LINE_MAX_CHARS = 60
+# Cart actions the assistant emitted earlier; already applied, so only their surrounding text is worth resending.
+_CODE_BLOCK = re.compile(r'```.*?```', re.DOTALL)
+
+_encoding = None
+_digest = None
+
+
+def _config():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_PROMPT', {})}
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        except Exception as e:
+            # The vocabulary is downloaded on first use; without it, token counts fall back to the estimate.
+            logger.warning("tiktoken encoding unavailable, estimating token counts: %s", e)
+            _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text):
+    """Counts tokens with tiktoken when available, otherwise estimates them."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # Roughly four ASCII characters per token; Hangul is about one token per syllable.
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def count_message_tokens(messages):
+    return sum(count_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def summarize_message(message):
+    """Compresses one history message into a short summary line."""
+    text = _CODE_BLOCK.sub('', message.get('text') or '')
+    text = re.sub(r'\s+', ' ', text).strip()
+    if len(text) > SUMMARY_LINE_MAX_CHARS:
+        text = text[:SUMMARY_LINE_MAX_CHARS] + '…'
+    speaker = '고객' if message.get('sender') == 'user' else '안내'
+    return f"{speaker}: {text}"
+
+
+def trim_summary(summary_lines, max_tokens):
+    """Drops the oldest summary lines until the summary fits `max_tokens`."""
+    lines = list(summary_lines)
+    while lines and count_tokens('\n'.join(lines)) > max_tokens:
+        lines.pop(0)
+    return lines
+
+
+def fold_history(summary_lines, history, keep):
+    """
+    Moves all but the last `keep` messages of `history` into the summary.
+    Returns `(summary_lines, recent_history)`.
+    """
+    if keep <= 0:
+        older, recent = history, []
+    else:
+        older, recent = history[:-keep], history[-keep:]
+    lines = list(summary_lines) + [summarize_message(message) for message in older]
+    return trim_summary(lines, _config()['SUMMARY_MAX_TOKENS']), list(recent)
+
+
+def fold_to_window(summary_lines, history):
+    """
+    Folds the messages that left the verbatim window into the summary,
+    `FOLD_EVERY` at a time. Returns `(summary_lines, recent_history)`; history
+    that is already within the window comes back unchanged.
+    """
+    config = _config()
+    keep = config['RECENT_MESSAGES']
+    if len(history) > keep:
+        keep += (len(history) - keep) % config['FOLD_EVERY']
+    return fold_history(summary_lines, history, keep)
+
+
+def _history_messages(history):
+    messages = []
+    for msg in history:
+        if msg.get("sender") == "user":
+            messages.append({"role": "user", "content": msg.get("text")})
+        else:
+            text = msg.get("text") or ''
+            messages.append({"role": "assistant", "content": _CODE_BLOCK.sub('', text).strip() or text})
+    return messages
+
+
+def _summary_message(summary_lines):
+    return {"role": "system", "content": "이전 대화 요약:\n" + '\n'.join(summary_lines)}
+
+
+def _build_catalog_digest(catalog, max_tokens):
+    lines = ["메뉴 카탈로그:", f"주문 가능한 주요 음식 종류: {', '.join(catalog.categories)}", "가게:"]
+    budget = max_tokens - count_tokens('\n'.join(lines))
+    stores = sorted(catalog.stores, key=lambda store: (store.name, store.id))
+    for position, store in enumerate(stores):
+        items = [catalog.items[i] for i in catalog.items_by_store.get(store.id, ())]
+        categories = sorted({item.category for item in items if item.category})
+        line = f"- {store.name}: {', '.join(categories) or '기타'} (메뉴 {len(items)}개)"
+        cost = count_tokens(line) + 1
+        if cost > budget:
+            lines.append(f"- 외 {len(stores) - position}개 가게")
+            break
+        lines.append(line)
+        budget -= cost
+    return '\n'.join(lines)
+
+
+def get_catalog_digest(catalog):
+    """Returns the digest of `catalog` for the prompt prefix, rebuilding it only when the catalog version changes."""
+    global _digest
+    cached = _digest
+    if cached is None or cached[0] != catalog.version:
+        cached = (catalog.version, _build_catalog_digest(catalog, _config()['DIGEST_MAX_TOKENS']))
+        _digest = cached
+    return cached[1]
+
+
+def build_prompt(system_prompt, db_search_result, history, user_message, summary_lines=(), digest=None):
+    """
+    Assembles the chat messages within the configured token budget, in the
+    layout described above. Returns `(messages, token_counts)`; `token_counts`
+    breaks the prompt down by section so latency can be related to prompt size.
+    """
+    config = _config()
+    prefix = [{"role": "system", "content": system_prompt}]
+    if digest:
+        prefix.append({"role": "system", "content": digest})
+    search = {"role": "system", "content": f"DB 검색 결과: {db_search_result}"}
+    user = {"role": "user", "content": user_message}
+    prefix_tokens = count_message_tokens(prefix)
+    fixed_tokens = prefix_tokens + count_message_tokens([search, user])
+
+    summary_lines, recent = fold_to_window(summary_lines, history)
+    while True:
+        summary = [_summary_message(summary_lines)] if summary_lines else []
+        recent_messages = _history_messages(recent)
+        summary_tokens = count_message_tokens(summary)
+        history_tokens = count_message_tokens(recent_messages)
+        if fixed_tokens + summary_tokens + history_tokens <= config['MAX_TOKENS']:
+            break
+        if recent:
+            summary_lines, recent = fold_history(summary_lines, recent, len(recent) - 1)
+        elif summary_lines:
+            summary_lines = summary_lines[1:]
+        else:
+            break
+
+    messages = prefix + summary + recent_messages + [search, user]
+    token_counts = {
+        'system': count_message_tokens(prefix[:1]),
+        'digest': prefix_tokens - count_message_tokens(prefix[:1]),
+        'search': count_message_tokens([search]),
+        'prefix': prefix_tokens,
+        'summary': summary_tokens,
+        'history': history_tokens,
+        'user': count_message_tokens([user]),
+        'total': fixed_tokens + summary_tokens + history_tokens,
+        'history_messages': len(recent),
+    }
+    return messages, token_counts
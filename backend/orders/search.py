@@ -0,0 +1,24 @@
+"""
+Substring search over store and menu item names in the database.
+
+The chat views search the in-process catalog snapshot (`orders.catalog`), not
+the database; these helpers are for callers that need a queryset, such as
+admin tooling and `bench_chat`.
+
+A plain `name__icontains` filter is a sequential scan. On PostgreSQL,
+migration 0011 adds pg_trgm GIN indexes on both name columns, and those serve
+the `UPPER(name::text) LIKE UPPER(...)` that icontains compiles to. There is
+no database-side index on SQLite: the hot path's substring search runs over
+the bigram postings of the catalog snapshot instead.
+"""
+from .models import Store, MenuItem
+
+
+def search_menu_items(text, queryset=None):
+    """Menu items whose name contains `text`, case-insensitively."""
+    return (MenuItem.objects.all() if queryset is None else queryset).filter(name__icontains=text)
+
+
+def search_stores(text, queryset=None):
+    """Stores whose name contains `text`, case-insensitively."""
+    return (Store.objects.all() if queryset is None else queryset).filter(name__icontains=text)
@@ -0,0 +1,42 @@
+from rest_framework import serializers
+
+MAX_OPERATIONS = 20
+MAX_QUANTITY = 99
+
+
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=['add', 'remove', 'set_quantity'])
+    item_name = serializers.CharField(max_length=100)
+    quantity = serializers.IntegerField(min_value=0, max_value=MAX_QUANTITY, required=False)
+
+    def validate(self, data):
+        if data['op'] == 'add':
+            data['quantity'] = data.get('quantity', 1)
+            if data['quantity'] < 1:
+                raise serializers.ValidationError("'add' needs a positive quantity.")
+        elif data['op'] == 'set_quantity':
+            if 'quantity' not in data:
+                raise serializers.ValidationError("'set_quantity' needs a quantity.")
+        else:
+            data['quantity'] = 0
+        return data
+
+
+class CartActionSerializer(serializers.Serializer):
+    """
+    Cart action emitted by the LLM. `update_cart` carries a list of operations;
+    the older single-item `add_to_cart` form is accepted as one `add`.
+    """
+    action = serializers.ChoiceField(choices=['update_cart', 'add_to_cart'])
+    store_name = serializers.CharField(max_length=100)
+    operations = CartOperationSerializer(many=True, required=False, min_length=1, max_length=MAX_OPERATIONS)
+    item_name = serializers.CharField(max_length=100, required=False)
+
+    def validate(self, data):
+        if data['action'] == 'add_to_cart':
+            if 'item_name' not in data:
+                raise serializers.ValidationError({'item_name': "This field is required."})
+            data['operations'] = [{'op': 'add', 'item_name': data.pop('item_name'), 'quantity': 1}]
+        elif 'operations' not in data:
+            raise serializers.ValidationError({'operations': "This field is required."})
+        return data
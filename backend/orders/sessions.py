@@ -0,0 +1,75 @@
+"""
+Server-side chat sessions.
+
+A kiosk that sends a `sessionId` only needs to upload the new utterance: the
+turn log, the current order and the conversation state are kept here, in the
+Django cache alias named by `settings.CHAT_SESSIONS['ALIAS']`. That alias must
+be shared by all workers and outlive them (the project's 'shared' database
+cache, or Redis): with a per-process cache, a turn that lands on another
+worker, or comes after a restart, silently starts over with an empty cart.
+
+Messages that leave the prompt's verbatim window are folded into the
+session's rolling summary as the turn is saved (see `orders.prompt`), so each
+is summarized once rather than on every following turn. `MAX_TURNS` caps the
+verbatim log regardless of the prompt settings.
+"""
+import re
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .prompt import fold_history, fold_to_window
+
+DEFAULTS = {
+    'ALIAS': 'default',
+    'TIMEOUT': 1800,
+    'MAX_TURNS': 40,
+}
+
+SESSION_ID_RE = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+
+def _config():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_SESSIONS', {})}
+
+
+def _key(session_id):
+    return f'orders:session:{session_id}'
+
+
+def is_valid_session_id(session_id):
+    return isinstance(session_id, str) and bool(SESSION_ID_RE.match(session_id))
+
+
+def new_session():
+    return {'history': [], 'summary': [], 'currentOrder': {}, 'conversationState': {}}
+
+
+async def load(session_id):
+    """Returns the stored session, or a fresh one if it expired or never existed."""
+    session = await caches[_config()['ALIAS']].aget(_key(session_id))
+    return session if session is not None else new_session()
+
+
+async def save_turn(session_id, session, user_message, payload):
+    """Appends the turn to the log and stores the state returned to the client."""
+    config = _config()
+    if payload.get('action') == 'navigate_to_home':
+        # The order was paid for; the next customer starts a new conversation.
+        summary, history = [], []
+    else:
+        history = session['history'] + [{'sender': 'user', 'text': user_message}]
+        if payload.get('reply'):
+            history.append({'sender': 'assistant', 'text': payload['reply']})
+        summary, history = fold_to_window(session.get('summary', []), history)
+        if len(history) > config['MAX_TURNS']:
+            summary, history = fold_history(summary, history, config['MAX_TURNS'])
+
+    session = {
+        'history': history,
+        'summary': summary,
+        'currentOrder': payload.get('currentOrder', session['currentOrder']),
+        'conversationState': payload.get('conversationState', session['conversationState']),
+    }
+    await caches[config['ALIAS']].aset(_key(session_id), session, timeout=config['TIMEOUT'])
+    return session
@@ -0,0 +1,27 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import events
+from .catalog import bump_catalog_version
+from .models import Store, MenuItem, Order
+from .timing import install_query_counter
+
+connection_created.connect(install_query_counter)
+
+
+@receiver(post_save, sender=Store)
+@receiver(post_delete, sender=Store)
+@receiver(post_save, sender=MenuItem)
+@receiver(post_delete, sender=MenuItem)
+def invalidate_catalog_on_change(sender, **kwargs):
+    # Wait for the commit so no worker rebuilds from data that isn't visible yet.
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Order)
+def publish_status_change(sender, instance, created, update_fields, using, **kwargs):
+    # Only saves that name their fields say whether the status moved; orders.cart publishes cart changes itself.
+    if not created and update_fields and 'status' in update_fields:
+        events.publish(instance, 'status_changed', using=using)
@@ -0,0 +1,137 @@
+"""
+Single-flight coalescing of identical LLM calls.
+
+At opening time many kiosks send the same prompt at once. `run(key, produce)`
+lets the first caller for a key (the leader) call `produce()`; callers that
+arrive while it is in flight wait for the leader's result instead of making
+their own upstream call. Followers may be on another thread, each with its own
+event loop under WSGI, so the shared result is a `concurrent.futures.Future`.
+If the leader is cancelled (its client went away), the followers start over
+and one of them becomes the new leader.
+
+With `CROSS_PROCESS` on, the leader also takes a lock in the Django cache
+(`cache.add`), so identical calls in other workers wait for it too. Those
+workers poll the cache for the result. If the lock holder fails or the lock
+expires, a waiter makes the call itself. Either way the leader's wait is
+bounded by the caller's deadline, not by the lock's lifetime. This only helps
+with a cache shared between workers (Redis, Memcached, the database cache),
+which is why the settings point `ALIAS` at the 'shared' database cache.
+
+Configured through `settings.LLM_SINGLE_FLIGHT`:
+
+    'ENABLED': whether calls are coalesced at all
+    'CROSS_PROCESS': whether to coalesce across workers through the cache
+    'ALIAS': Django cache alias holding the locks and results
+    'LOCK_TIMEOUT': lifetime of a lock, and how long other workers wait for it at most
+    'RESULT_TIMEOUT': how long a finished result stays readable by waiters
+    'POLL_INTERVAL': seconds between cache polls while waiting
+
+`metrics` counts `single_flight.saved` (upstream calls avoided) and
+`single_flight.saved_remote` (those of them saved across workers).
+"""
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CROSS_PROCESS': False,
+    'ALIAS': 'default',
+    'LOCK_TIMEOUT': 30,
+    'RESULT_TIMEOUT': 10,
+    'POLL_INTERVAL': 0.05,
+}
+
+_lock = threading.Lock()
+_in_flight = {}
+
+
+class _LeaderCancelled(Exception):
+    pass
+
+
+def _config():
+    return {**DEFAULTS, **getattr(settings, 'LLM_SINGLE_FLIGHT', {})}
+
+
+def prompt_key(model, messages):
+    """Hash of everything that goes upstream, so only truly identical calls share a result."""
+    raw = json.dumps([model, messages], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+async def _produce_once_across_processes(key, produce, config):
+    cache = caches[config['ALIAS']]
+    lock_key = f'orders:llm:flight:{key}:lock'
+    result_key = f'orders:llm:flight:{key}:result'
+    loop = asyncio.get_running_loop()
+    give_up_at = loop.time() + config['LOCK_TIMEOUT']
+    while loop.time() < give_up_at:
+        if await cache.aadd(lock_key, 1, config['LOCK_TIMEOUT']):
+            try:
+                result = await produce()
+                await cache.aset(result_key, result, config['RESULT_TIMEOUT'])
+                return result
+            finally:
+                await cache.adelete(lock_key)
+        result = await cache.aget(result_key)
+        if result is not None:
+            metrics.incr('single_flight.saved')
+            metrics.incr('single_flight.saved_remote')
+            return result
+        await asyncio.sleep(config['POLL_INTERVAL'])
+    return await produce()
+
+
+async def run(key, produce, wait_timeout=None):
+    """
+    Returns `await produce()`, sharing one call among concurrent callers with
+    the same `key`. Followers wait at most `wait_timeout` seconds for the leader,
+    and so does a leader waiting on another worker; they raise
+    asyncio.TimeoutError after that.
+    """
+    config = _config()
+    if not config['ENABLED']:
+        return await produce()
+
+    while True:
+        with _lock:
+            future = _in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = _in_flight[key] = concurrent.futures.Future()
+
+        if not leader:
+            try:
+                # shield: a follower that times out must not cancel the shared future.
+                result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), wait_timeout)
+            except _LeaderCancelled:
+                continue
+            metrics.incr('single_flight.saved')
+            return result
+
+        try:
+            if config['CROSS_PROCESS']:
+                # Waiting on another worker, then calling upstream, all within the caller's deadline.
+                result = await asyncio.wait_for(_produce_once_across_processes(key, produce, config), wait_timeout)
+            else:
+                result = await produce()
+        except asyncio.CancelledError:
+            future.set_exception(_LeaderCancelled())
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with _lock:
+                _in_flight.pop(key, None)
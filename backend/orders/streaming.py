@@ -0,0 +1,57 @@
+"""
+Helpers for the Server-Sent Events mode of the chat endpoint.
+"""
+import json
+
+ACTION_BLOCK_MARKERS = ('```', '{')
+
+
+def sse_event(event, data, event_id=None):
+    """Formats one SSE frame with a JSON payload. `event_id` becomes the client's Last-Event-ID."""
+    payload = json.dumps(data, ensure_ascii=False)
+    frame = f"event: {event}\ndata: {payload}\n\n"
+    return frame if event_id is None else f"id: {event_id}\n{frame}"
+
+
+class SpokenTextFilter:
+    """
+    Splits streamed completion text into the part that may be spoken.
+
+    Everything from the start of the `add_to_cart` JSON block (either a
+    fenced ```json block or a bare object) onwards is held back, since it is
+    parsed after the stream ends rather than read out to the customer.
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._emitted = 0
+        self._blocked = False
+
+    def feed(self, chunk):
+        """Adds `chunk` and returns the newly speakable text, possibly ''."""
+        if self._blocked:
+            return ''
+        self._buffer += chunk
+
+        cut = len(self._buffer)
+        for marker in ACTION_BLOCK_MARKERS:
+            index = self._buffer.find(marker, self._emitted)
+            if index != -1 and index < cut:
+                cut = index
+                self._blocked = True
+        if not self._blocked:
+            # A trailing '`' may be the start of a fence; wait for the next chunk.
+            while cut > self._emitted and self._buffer[cut - 1] == '`':
+                cut -= 1
+
+        text = self._buffer[self._emitted:cut]
+        self._emitted = cut
+        return text
+
+    def flush(self):
+        """Returns any text held back only because the stream might continue a fence."""
+        if self._blocked:
+            return ''
+        text = self._buffer[self._emitted:]
+        self._emitted = len(self._buffer)
+        return text
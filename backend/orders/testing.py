@@ -0,0 +1,40 @@
+"""
+Test helpers for keeping the chat endpoint's SQL usage in check.
+
+`QUERY_BUDGETS` is the maximum number of queries a single chat turn may run,
+keyed by the NLU intent or, for turns where the reply triggered a cart
+action, by that action. The catalog snapshot is assumed to be warm.
+"""
+from .catalog import get_catalog
+
+QUERY_BUDGETS = {
+    # Every change to an order also appends one OrderEvent (see orders/events.py).
+    'finalize_order': 3,
+    'payment_success': 3,
+    'payment_cancel': 3,
+    'list_menu_by_store': 0,
+    'find_stores_by_category': 0,
+    'general_query': 0,
+    # Cart writes also read the items' current prices for the order's totals.
+    'add_to_cart': 8,
+    'update_cart': 11,
+}
+
+
+class QueryBudgetMixin:
+    """Mixin for `TestCase`s that post chat turns and check their query counts."""
+
+    def post_chat_within_budget(self, message, budget_key=None, **data):
+        """Posts one chat turn and fails if it ran more queries than its budget allows."""
+        get_catalog()
+        response = self.client.post('/api/orders/chat/', {'message': message, **data}, content_type='application/json')
+        self.assertWithinQueryBudget(response, budget_key)
+        return response
+
+    def assertWithinQueryBudget(self, response, budget_key=None):
+        timer = response.request_timing
+        key = budget_key or timer.tags.get('action') or timer.tags.get('intent')
+        budget = QUERY_BUDGETS[key]
+        if timer.queries > budget:
+            stages = ', '.join(f"{name}={queries}" for name, (_, queries) in timer.stages.items())
+            self.fail(f"'{key}' ran {timer.queries} queries, budget is {budget} ({stages})")
@@ -1,3 +1,1425 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.exceptions import FieldError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from . import breaker, cart, events, health, llm, llm_cache, metrics, sessions, single_flight
+from .benchmarks import SCHEMA_INDEXES, compare_results, run_benchmarks, run_query_plans
+from .cart import CartOperation
+from .catalog import bump_catalog_version, get_catalog, invalidate_catalog
+from .catalog_import import import_catalog, read_rows
+from .fake_openai import FakeOpenAIServer
+from .fuzzy import get_resolver
+from .matcher import KeywordAutomaton
+from .models import CatalogVersion, Store, MenuItem, Order, OrderEvent, OrderItem
+from .order_parser import parse_order, pick_store
+from .prompt import build_prompt, count_message_tokens, count_tokens, get_catalog_digest, summarize_message
+from .search import search_menu_items, search_stores
+from .streaming import SpokenTextFilter
+from .testing import QueryBudgetMixin
+from .timing import span
+
+# Keep the per-request timing lines out of the test output.
+logging.getLogger('orders.timing').setLevel(logging.WARNING)
+from .views import DEGRADED_REPLY, _update_order, get_nlu_automaton, simple_nlu
+
+
+class CatalogSnapshotTests(TestCase):
+    def setUp(self):
+        invalidate_catalog()
+
+    def test_snapshot_is_reused_until_catalog_changes(self):
+        first = get_catalog()
+        with self.assertNumQueries(0):
+            self.assertIs(get_catalog(), first)
+
+        store = Store.objects.create(name="테스트분식")
+        with self.captureOnCommitCallbacks(execute=True):
+            MenuItem.objects.create(store=store, name="라볶이", price=4000)
+
+        second = get_catalog()
+        self.assertGreater(second.version, first.version)
+        self.assertIn("라볶이", [item.name for item in second.items])
+
+    def test_snapshot_follows_a_version_bumped_by_another_process(self):
+        first = get_catalog()
+        store = Store.objects.create(name="테스트분식")
+        MenuItem.objects.bulk_create([MenuItem(store=store, name="라볶이", price=4000)])  # no signals here
+        # What a bump made by another worker or a management command looks like from this one.
+        CatalogVersion.objects.filter(pk=1).update(version=F('version') + 1)
+
+        with override_settings(CATALOG={'VERSION_CHECK_SECONDS': 60}):
+            self.assertIs(get_catalog(), first)
+        with override_settings(CATALOG={'VERSION_CHECK_SECONDS': 0}):
+            second = get_catalog()
+        self.assertEqual(second.version, first.version + 1)
+        self.assertIn("라볶이", [item.name for item in second.items])
+
+    def test_search_matches_item_and_store_names(self):
+        catalog = get_catalog()
+        names = {item.name for item in catalog.search(category='버거')}
+        self.assertIn("불고기버거", names)
+        stores = {item.store.name for item in catalog.search(store_name='컴포즈커피')}
+        self.assertEqual(stores, {"컴포즈커피 천안용암마을점"})
+
+    def test_indexed_search_agrees_with_a_full_scan(self):
+        catalog = get_catalog()
+        for needle in ('버거', '라떼', 'ㅋ', '아', '커피 천안', '싸이버거', '없는메뉴'):
+            expected = [item for item in catalog.items if needle in item.name_lower]
+            self.assertEqual(catalog.search(category=needle), expected, needle)
+            expected = [item for item in catalog.items if needle in item.store.name_lower]
+            self.assertEqual(catalog.search(store_name=needle), expected, needle)
+
+    def test_simple_nlu_reads_stores_from_snapshot(self):
+        get_catalog()
+        with self.assertNumQueries(0):
+            result = simple_nlu("컴포즈커피 천안용암마을점 메뉴 뭐 있어?")
+        self.assertEqual(result['intent'], 'list_menu_by_store')
+        self.assertEqual(result['entities']['store_name'], "컴포즈커피 천안용암마을점")
+
+
+class NameSearchTests(TestCase):
+    def setUp(self):
+        invalidate_catalog()
+
+    def test_matches_icontains(self):
+        for text in ('버거', '싸이', '아메리카노', 'A', '맘스터치 천안', '없는메뉴'):
+            self.assertQuerySetEqual(
+                search_menu_items(text).order_by('id'), MenuItem.objects.filter(name__icontains=text).order_by('id'),
+            )
+            self.assertQuerySetEqual(
+                search_stores(text).order_by('id'), Store.objects.filter(name__icontains=text).order_by('id'),
+            )
+
+    def test_follows_saves(self):
+        store = Store.objects.create(name="테스트분식")
+        item = MenuItem.objects.create(store=store, name="라볶이", price=4000)
+        self.assertEqual(list(search_menu_items('볶이')), [item])
+
+        item.name = "쫄면"
+        item.save()
+        self.assertEqual(list(search_menu_items('볶이')), [])
+        self.assertEqual(list(search_menu_items('쫄면')), [item])
+
+    def test_does_not_build_the_catalog_snapshot(self):
+        with mock.patch('orders.catalog._build_snapshot') as build:
+            list(search_menu_items('싸이버거'))
+            list(search_stores('맘스터치'))
+        build.assert_not_called()
+
+
+class CategoryIndexTests(TestCase):
+    def setUp(self):
+        invalidate_catalog()
+
+    def test_category_is_filled_on_save(self):
+        store = Store.objects.create(name="테스트카페")
+        item = MenuItem.objects.create(store=store, name="바닐라라떼", price=4000)
+        self.assertEqual(item.category, '커피')
+        item.name = "딸기스무디"
+        item.save(update_fields=['name'])
+        item.refresh_from_db()
+        self.assertEqual(item.category, '음료')
+
+    def test_find_stores_by_category_uses_index(self):
+        catalog = get_catalog()
+        store_names = {store.name for store in catalog.stores_for_category('커피')}
+        self.assertIn("컴포즈커피 천안용암마을점", store_names)
+        self.assertIn('버거', catalog.categories)
+
+        with self.assertNumQueries(0):
+            response = self.client.post('/api/orders/chat/', {'message': '커피 파는 가게 어디야?'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("컴포즈커피 천안용암마을점", response.json()['reply'])
+
+
+class CatalogImportTests(TestCase):
+    COMPOSE = "컴포즈커피 천안용암마을점"
+
+    def setUp(self):
+        invalidate_catalog()
+
+    def _import(self, text, format='csv', **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return import_catalog(read_rows(io.StringIO(text), format), **kwargs)
+
+    def test_creates_reprices_and_skips_unchanged_rows(self):
+        version = get_catalog().version
+        with mock.patch('orders.catalog_import.bump_catalog_version', wraps=bump_catalog_version) as bump:
+            report = self._import(
+                "store,name,price\n"
+                f"{self.COMPOSE},아메리카노,1800\n"
+                f"{self.COMPOSE},카페라떼,\"3,100\"\n"
+                "테스트김밥,묵은지김밥,4500\n"
+                "테스트김밥,라볶이,공짜\n"
+            )
+        self.assertEqual(
+            (report.rows, report.stores_created, report.items_created, report.items_updated, report.items_unchanged),
+            (4, 1, 1, 1, 1),
+        )
+        self.assertEqual(report.errors, [(5, "invalid price '공짜'")])
+        self.assertEqual(MenuItem.objects.get(store__name=self.COMPOSE, name="카페라떼").price, 3100)
+
+        item = MenuItem.objects.get(store__name="테스트김밥")
+        self.assertEqual((item.name, item.category), ("묵은지김밥", '김밥'))
+        self.assertEqual(list(search_menu_items('묵은지')), [item])
+        self.assertEqual(list(search_stores('테스트김')), [item.store])
+        bump.assert_called_once()  # once per import, not per row
+        self.assertGreater(get_catalog().version, version)
+
+    def test_matches_case_insensitively_and_reads_json_lines(self):
+        store = Store.objects.create(name="Test Cafe")
+        latte = MenuItem.objects.create(store=store, name="latte", price=4000)
+        report = self._import(
+            '{"store": "TEST CAFE", "name": "Latte", "price": 4000}\n'
+            '\n'
+            '{"store": "test cafe", "name": "Mocha", "price": "4500.5"}\n'
+            '{"store": "test cafe"\n',
+            format='jsonl',
+        )
+        self.assertEqual((report.stores_created, report.items_created, report.items_updated), (0, 1, 1))
+        self.assertEqual([line for line, _ in report.errors], [4])
+        latte.refresh_from_db()
+        self.assertEqual(latte.name, "Latte")
+        self.assertEqual(MenuItem.objects.get(store=store, name="Mocha").price, Decimal('4500.50'))
+
+    def test_queries_per_chunk_do_not_grow_with_its_rows(self):
+        def queries(count, store, price):
+            rows = "store,name,price\n" + "".join(f"{store},메뉴{i},{price}\n" for i in range(count))
+            with CaptureQueriesContext(connection) as captured:
+                self._import(rows)
+            return len(captured)
+
+        # Creating: a few queries, plus the version bump.
+        self.assertLess(queries(5, "가게1", 1000), 17)
+        self.assertLess(queries(200, "가게2", 1000), 22)
+        # Repricing: one UPDATE per new price, however many items take it.
+        self.assertEqual(queries(5, "가게1", 2000), queries(200, "가게2", 2000))
+        self.assertEqual(MenuItem.objects.filter(store__name="가게2", price=2000).count(), 200)
+
+    def test_dry_run_writes_nothing(self):
+        before = (Store.objects.count(), MenuItem.objects.count())
+        report = self._import(
+            f"store,name,price\n테스트김밥,참치김밥,4500\n테스트김밥,참치김밥,4600\n{self.COMPOSE},카페라떼,3100\n",
+            dry_run=True,
+        )
+        self.assertEqual((report.stores_created, report.items_created, report.items_updated, report.duplicates), (1, 1, 1, 1))
+        self.assertEqual(report.changes, [("테스트김밥", "참치김밥", None, 4600), (self.COMPOSE, "카페라떼", 2900, 3100)])
+        self.assertEqual((Store.objects.count(), MenuItem.objects.count()), before)
+        self.assertEqual(MenuItem.objects.get(store__name=self.COMPOSE, name="카페라떼").price, 2900)
+
+    def test_command_reports_the_diff(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8-sig', delete=False) as f:
+            f.write(f"store,name,price\n{self.COMPOSE},카페라떼,3100\n")
+        self.addCleanup(os.unlink, f.name)
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_catalog', f.name, stdout=out)
+        self.assertIn(f"~ {self.COMPOSE} / 카페라떼: 2900.00 -> 3100.00", out.getvalue())
+        self.assertIn("1 updated", out.getvalue())
+
+        with self.assertRaises(CommandError):
+            call_command('import_catalog', 'menu.txt')
+
+    def test_running_workers_see_an_import_made_by_another_process(self):
+        worker_script = (
+            "import sys, time\n"
+            "from orders.catalog import get_catalog\n"
+            "print(len(get_catalog().items), flush=True)\n"
+            "sys.stdin.readline()\n"
+            "deadline = time.monotonic() + 10\n"
+            "while time.monotonic() < deadline and '묵은지김밥' not in {i.name for i in get_catalog().items}:\n"
+            "    time.sleep(0.1)\n"
+            "print(len(get_catalog().items), flush=True)\n"
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {**os.environ, 'DATABASE_URL': f"sqlite:///{tmp}/db.sqlite3", 'PYTHONIOENCODING': 'utf-8'}
+            manage = [sys.executable, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'manage.py')]
+            subprocess.run(manage + ['migrate', '-v', '0'], env=env, check=True, timeout=120)
+            worker = subprocess.Popen(
+                manage + ['shell', '--no-imports', '-c', worker_script],
+                env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, encoding='utf-8',
+            )
+            try:
+                before = int(worker.stdout.readline())
+                with open(f"{tmp}/menu.csv", 'w', encoding='utf-8') as f:
+                    f.write("store,name,price\n테스트김밥,묵은지김밥,4500\n")
+                subprocess.run(
+                    manage + ['import_catalog', f"{tmp}/menu.csv"],
+                    env=env, check=True, timeout=60, stdout=subprocess.DEVNULL,
+                )
+                out, _ = worker.communicate('\n', timeout=30)
+            finally:
+                worker.kill()
+        self.assertEqual(int(out), before + 1)
+
+
+class CatalogAPITests(TestCase):
+    COMPOSE = "컴포즈커피 천안용암마을점"
+
+    def setUp(self):
+        invalidate_catalog()
+
+    def test_revalidation_with_the_etag_is_a_bodyless_304(self):
+        response = self.client.get('/api/orders/catalog/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, no-cache')
+        data = response.json()
+        self.assertEqual(data['count'], MenuItem.objects.count())
+        self.assertIn('버거', data['categories'])
+        self.assertIn(self.COMPOSE, [store['name'] for store in data['stores']])
+
+        with self.assertNumQueries(0):
+            again = self.client.get('/api/orders/catalog/', headers={'If-None-Match': response['ETag']})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.content, b'')
+        self.assertEqual(again['ETag'], response['ETag'])
+
+    def test_gzip_is_precompressed_and_tagged_separately(self):
+        plain = self.client.get('/api/orders/catalog/')
+        zipped = self.client.get('/api/orders/catalog/', headers={'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(zipped['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', zipped['Vary'])
+        self.assertEqual(gzip.decompress(zipped.content), plain.content)
+        self.assertLess(len(zipped.content), len(plain.content))
+        self.assertNotEqual(zipped['ETag'], plain['ETag'])
+
+        response = self.client.get(
+            '/api/orders/catalog/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': f'W/{zipped["ETag"]}'},
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], zipped['ETag'])
+
+    def test_a_catalog_change_changes_the_etag(self):
+        etag = self.client.get('/api/orders/catalog/')['ETag']
+        store = Store.objects.get(name=self.COMPOSE)
+        with self.captureOnCommitCallbacks(execute=True):
+            MenuItem.objects.create(store=store, name="돌체라떼", price=3300)
+
+        response = self.client.get('/api/orders/catalog/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn("돌체라떼", [item['name'] for item in response.json()['items']])
+
+    @override_settings(CATALOG_API={'PAGE_SIZE': 2})
+    def test_filters_by_store_and_paginates(self):
+        store = Store.objects.get(name=self.COMPOSE)
+        expected = list(MenuItem.objects.filter(store=store).order_by('id').values_list('name', flat=True))
+        names = []
+        for page in range(1, 100):
+            response = self.client.get('/api/orders/catalog/', {'store': store.id, 'page': page})
+            if response.status_code == 404:
+                break
+            data = response.json()
+            self.assertEqual((data['store'], data['page'], data['count']), (store.id, page, len(expected)))
+            self.assertEqual(data['stores'], [{'id': store.id, 'name': self.COMPOSE}])
+            names.extend(item['name'] for item in data['items'])
+        self.assertEqual(names, expected)
+        self.assertEqual(page - 1, data['pages'])
+        categories = MenuItem.objects.filter(store=store).exclude(category='').values_list('category', flat=True)
+        self.assertEqual(data['categories'], sorted(set(categories)))
+
+        self.assertEqual(self.client.get('/api/orders/catalog/', {'store': 0}).status_code, 404)
+        self.assertEqual(self.client.get('/api/orders/catalog/', {'page': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/orders/catalog/', {'page': 0}).status_code, 400)
+
+
+class HealthCheckTests(TestCase):
+    def setUp(self):
+        invalidate_catalog()
+
+    def test_liveness_skips_the_stack(self):
+        with self.assertNumQueries(0):
+            response = self.client.get('/health', headers={'Host': 'healthcheck.railway.app'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'ok')
+        self.assertNotIn('Server-Timing', response)
+        # The prober's host name is only accepted on the health paths.
+        self.assertEqual(self.client.get('/api/orders/metrics/', headers={'Host': 'healthcheck.railway.app'}).status_code, 400)
+
+    def test_failed_warmup_is_logged(self):
+        # close_all would close the test's own connection too.
+        with mock.patch.object(health, 'warm_up', side_effect=RuntimeError('no database')), \
+                mock.patch.object(health.connections, 'close_all'), self.assertLogs('orders.health', 'ERROR') as logs:
+            health.warm_up_on_startup()
+        self.assertIn('Worker warmup failed', logs.output[0])
+        self.assertIn('RuntimeError: no database', logs.output[0])
+
+    def test_readiness_waits_for_the_database_and_the_indexes(self):
+        from . import catalog, fuzzy, order_parser, prompt, views
+
+        with mock.patch.object(catalog, '_snapshot', None), mock.patch.object(views, '_nlu_automaton', None), \
+                mock.patch.object(fuzzy, '_resolver', None), mock.patch.object(order_parser, '_parser', None), \
+                mock.patch.object(prompt, '_digest', None), mock.patch.object(health, '_start_warm_up') as start_warm_up:
+            response = self.client.get('/health/ready')
+            self.assertEqual(response.status_code, 503)
+            self.assertTrue(response.json()['database']['ok'])
+            self.assertEqual(response.json()['resolver'], {'built': False, 'stale': False})
+            start_warm_up.assert_called_once()
+
+            health.warm_up()
+            response = self.client.get('/health/ready/')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.json()['ready'])
+
+            # A catalog change leaves the worker ready; the indexes catch up on the next request.
+            bump_catalog_version()
+            response = self.client.get('/health/ready')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.json()['nlu']['stale'])
+
+            with mock.patch.object(health, '_check_database', return_value={'ok': False, 'error': 'down'}):
+                self.assertEqual(self.client.get('/health/ready').status_code, 503)
+
+
+class KeywordAutomatonTests(TestCase):
+    def test_finds_overlapping_patterns_in_one_pass(self):
+        automaton = KeywordAutomaton([('버거', 'burger'), ('햄버거', 'burger'), ('거', 'short'), ('그만', 'stop')])
+        self.assertEqual(automaton.find('햄버거 주세요'), {'burger', 'short'})
+        self.assertEqual(automaton.find('이제 그만'), {'stop'})
+        self.assertEqual(automaton.find('콜라'), set())
+
+
+class SimpleNLUTests(TestCase):
+    def setUp(self):
+        invalidate_catalog()
+
+    def test_intent_priorities(self):
+        cases = [
+            ("결제 성공", None, 'payment_success'),
+            ("네 좋아요", {'awaiting_payment_confirmation': True}, 'payment_success'),
+            ("네 좋아요", None, 'general_query'),
+            ("아니요", {'last_ai_question': '추가로 필요하신 거 있으세요?'}, 'finalize_order'),
+            ("이제 계산할게요", None, 'finalize_order'),
+            ("롯데리아 메뉴 뭐 있어", None, 'list_menu_by_store'),
+            ("버거 파는 가게 어디야", None, 'find_stores_by_category'),
+            ("안녕하세요", None, 'general_query'),
+        ]
+        for text, state, expected in cases:
+            with self.subTest(text=text, state=state):
+                self.assertEqual(simple_nlu(text, state)['intent'], expected)
+
+    def test_first_store_and_category_in_catalog_order_win(self):
+        entities = simple_nlu("맘스터치 천안쌍용점 커피 버거")['entities']
+        self.assertEqual(entities['store_name'], "맘스터치")
+        self.assertEqual(entities['category'], '커피')
+
+    def test_automaton_is_rebuilt_only_when_catalog_changes(self):
+        catalog = get_catalog()
+        automaton = get_nlu_automaton(catalog)
+        self.assertIs(get_nlu_automaton(get_catalog()), automaton)
+
+        store = Store.objects.create(name="새로운분식")
+        with self.captureOnCommitCallbacks(execute=True):
+            MenuItem.objects.create(store=store, name="떡볶이", price=3000)
+        self.assertIsNot(get_nlu_automaton(get_catalog()), automaton)
+        self.assertEqual(simple_nlu("새로운분식 메뉴")['entities']['store_name'], "새로운분식")
+
+
+FAKE_ADD_TO_CART_REPLY = """네, 싸이버거를 장바구니에 추가했습니다. 추가로 주문할 상품이 있으신가요?
+```json
+{
+  "action": "add_to_cart",
+  "item_name": "싸이버거",
+  "store_name": "맘스터치 천안쌍용점"
+}
+```"""
+
+
+class OrderParserTests(TestCase):
+    def setUp(self):
+        invalidate_catalog()
+
+    def parse(self, text):
+        parsed = parse_order(text, get_catalog())
+        return parsed and [(line.name, line.quantity) for line in parsed.lines]
+
+    def test_reads_items_quantities_and_counters(self):
+        self.assertEqual(self.parse("불고기버거 2개 주세요"), [('불고기버거', 2)])
+        self.assertEqual(self.parse("아메리카노 두 잔이랑 카페라떼"), [('아메리카노', 2), ('카페라떼', 1)])
+        self.assertEqual(self.parse("싸이 버거 열두 개 주문할게요"), [('싸이버거', 12)])
+        self.assertEqual(self.parse("싸이버거 하나 더"), [('싸이버거', 1)])
+
+    def test_leaves_everything_else_to_the_llm(self):
+        for text in ("불고기버거 맛있어?", "아메리카노 네", "버거 파는 가게 어디야", "네", "싸이버거 100개"):
+            self.assertIsNone(self.parse(text), text)
+
+    def test_picks_the_named_single_or_current_store(self):
+        catalog = get_catalog()
+        self.assertIsNone(pick_store(parse_order("싸이버거 3개", catalog)))
+        named = parse_order("맘스터치 천안쌍용점에서 싸이버거 세 개", catalog)
+        self.assertEqual(pick_store(named).name, "맘스터치 천안쌍용점")
+        self.assertEqual(pick_store(parse_order("싸이버거 3개", catalog), "맘스터치").name, "맘스터치")
+        self.assertEqual(pick_store(parse_order("아메리카노 주세요", catalog)).name, "컴포즈커피 천안용암마을점")
+
+
+class MetricsViewTests(TestCase):
+    def test_is_not_public(self):
+        self.assertEqual(self.client.get('/api/orders/metrics/').status_code, 403)
+        user = User.objects.create_user('kiosk', password='pw')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get('/api/orders/metrics/').status_code, 403)
+
+    def test_staff_may_read(self):
+        self.client.force_login(User.objects.create_user('ops', password='pw', is_staff=True))
+        self.assertIn('counters', self.client.get('/api/orders/metrics/').json())
+
+    @override_settings(METRICS={'TOKEN': 'scraper'})
+    def test_scraper_token(self):
+        self.assertEqual(self.client.get('/api/orders/metrics/', headers={'Authorization': 'Bearer scraper'}).status_code, 200)
+        self.assertEqual(self.client.get('/api/orders/metrics/', headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+
+
+class ChatViewTests(TestCase):
+    def setUp(self):
+        invalidate_catalog()
+        llm_cache.reset_backend()
+        metrics.reset()
+
+    def post_chat(self, **data):
+        return self.client.post('/api/orders/chat/', data, content_type='application/json')
+
+    def test_rejects_missing_message_and_bad_json(self):
+        self.assertEqual(self.post_chat().status_code, 400)
+        response = self.client.post('/api/orders/chat/', '{', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_general_query_applies_add_to_cart_action(self):
+        with mock.patch('orders.llm.complete', mock.AsyncMock(return_value=FAKE_ADD_TO_CART_REPLY)) as complete:
+            response = self.post_chat(message='싸이버거 하나 주문할게', history=[{'sender': 'user', 'text': '안녕'}])
+
+        self.assertEqual(response.status_code, 200)
+        messages = complete.await_args.args[0]
+        self.assertEqual(messages[-1], {'role': 'user', 'content': '싸이버거 하나 주문할게'})
+        self.assertEqual(messages[2], {'role': 'user', 'content': '안녕'})
+
+        body = response.json()
+        self.assertEqual(body['currentOrder']['storeName'], "맘스터치 천안쌍용점")
+        self.assertEqual(body['currentOrder']['items'], [{'name': '싸이버거', 'quantity': 1, 'price': 4600.0}])
+        self.assertFalse(body['conversationState']['awaiting_payment_confirmation'])
+
+    def test_repeated_query_is_served_from_cache_and_still_updates_cart(self):
+        with mock.patch('orders.llm.complete', mock.AsyncMock(return_value=FAKE_ADD_TO_CART_REPLY)) as complete:
+            first = self.post_chat(message='싸이버거 먹고 싶어').json()
+            second = self.post_chat(message='  싸이버거  먹고 싶어! ', currentState=first['currentOrder']).json()
+
+        self.assertEqual(complete.await_count, 1)
+        self.assertEqual(second['currentOrder']['items'][0]['quantity'], 2)
+        with override_settings(METRICS={'TOKEN': 'scraper'}):
+            counters = self.client.get('/api/orders/metrics/', headers={'Authorization': 'Bearer scraper'}).json()['counters']
+        self.assertEqual((counters['llm_cache.hit'], counters['llm_cache.miss']), (1, 1))
+
+    def test_explicit_order_is_added_without_the_llm(self):
+        with mock.patch('orders.llm.complete', mock.AsyncMock()) as complete:
+            body = self.post_chat(message='아메리카노 두 잔이랑 카페라떼 주세요').json()
+        complete.assert_not_awaited()
+        self.assertEqual(
+            [(item['name'], item['quantity']) for item in body['currentOrder']['items']],
+            [('아메리카노', 2), ('카페라떼', 1)],
+        )
+        self.assertEqual(body['currentOrder']['storeName'], '컴포즈커피 천안용암마을점')
+        self.assertTrue(body['reply'].endswith('추가로 필요하신 거 있으세요?'))
+
+        body = self.post_chat(message='아니요', currentState=body['currentOrder'], conversationState=body['conversationState']).json()
+        self.assertEqual(body['action'], 'navigate_to_payment')
+
+    def test_order_sold_by_several_stores_goes_to_the_llm(self):
+        with mock.patch('orders.llm.complete', mock.AsyncMock(return_value=FAKE_ADD_TO_CART_REPLY)) as complete:
+            body = self.post_chat(message='싸이버거 2개 주세요').json()
+        self.assertEqual(complete.await_count, 1)
+        self.assertEqual(body['currentOrder']['storeName'], '맘스터치 천안쌍용점')
+
+    def test_one_reply_can_update_several_cart_items(self):
+        reply = """네, 세 가지 모두 담았습니다.
+```json
+{"action": "update_cart", "store_name": "컴포즈커피 천안용암마을점", "operations": [
+  {"op": "add", "item_name": "아메리카노", "quantity": 2},
+  {"op": "add", "item_name": "카페라떼"},
+  {"op": "set_quantity", "item_name": "아메리카노", "quantity": 3}
+]}
+```"""
+        with mock.patch('orders.llm.complete', mock.AsyncMock(return_value=reply)) as complete:
+            body = self.post_chat(message='커피 몇 잔 부탁할게').json()
+        self.assertEqual(complete.await_count, 1)
+        self.assertEqual(
+            [(item['name'], item['quantity']) for item in body['currentOrder']['items']],
+            [('아메리카노', 3), ('카페라떼', 1)],
+        )
+
+    def test_cache_key_tracks_catalog_version_and_state(self):
+        key = llm_cache.make_cache_key('커피 추천해줘', {}, '결과', 1)
+        self.assertEqual(key, llm_cache.make_cache_key('커피  추천해줘?', {'unrelated': 1}, '결과', 1))
+        self.assertNotEqual(key, llm_cache.make_cache_key('커피 추천해줘', {}, '결과', 2))
+        self.assertNotEqual(key, llm_cache.make_cache_key('커피 추천해줘', {'last_ai_question': '어느 가게요?'}, '결과', 1))
+        history = [{'sender': 'user', 'text': '싸이버거 주문할게'}, {'sender': 'assistant', 'text': '몇 개 드릴까요?'}]
+        self.assertNotEqual(key, llm_cache.make_cache_key('커피 추천해줘', {}, '결과', 1, history))
+        self.assertNotEqual(key, llm_cache.make_cache_key('커피 추천해줘', {}, '결과', 1, summary_lines=['고객: 안녕']))
+
+    def test_context_dependent_replies_are_not_shared_across_conversations(self):
+        with mock.patch('orders.llm.complete', mock.AsyncMock(return_value=FAKE_ADD_TO_CART_REPLY)) as complete:
+            self.post_chat(message='네', history=[{'sender': 'assistant', 'text': '싸이버거 담을까요?'}])
+            other = self.post_chat(message='네', history=[{'sender': 'assistant', 'text': '결제 도와드릴까요?'}])
+        self.assertEqual(complete.await_count, 2)
+        self.assertEqual(other.status_code, 200)
+
+
+class LocalLRUBackendTests(TestCase):
+    async def test_evicts_least_recently_used_and_expired_entries(self):
+        backend = llm_cache.LocalLRUBackend(max_entries=2, timeout=60)
+        await backend.aset('a', 'A')
+        await backend.aset('b', 'B')
+        await backend.aget('a')
+        await backend.aset('c', 'C')
+        self.assertIsNone(await backend.aget('b'))
+        self.assertEqual(await backend.aget('a'), 'A')
+
+        backend.timeout = -1
+        await backend.aset('d', 'D')
+        self.assertIsNone(await backend.aget('d'))
+
+
+class LLMClientTests(TestCase):
+    MESSAGES = [{'role': 'user', 'content': '안녕'}]
+
+    def setUp(self):
+        self.server = FakeOpenAIServer(reply='네').start()
+        self.addCleanup(self.server.stop)
+        self.addCleanup(llm.reset_clients)
+
+    def configure(self, **client_settings):
+        settings = override_settings(
+            OPENAI_API_KEY='test', OPENAI_BASE_URL=self.server.base_url,
+            LLM_CLIENT={'BACKOFF_BASE': 0.01, 'HEDGE': False, **client_settings},
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        llm.reset_clients()
+
+    async def test_retries_server_errors(self):
+        self.configure(MAX_RETRIES=2)
+        self.server.set_reply('네', failures=2)
+        self.assertEqual(await llm.complete(self.MESSAGES), '네')
+        self.assertEqual(len(self.server.requests), 3)
+
+    async def test_gives_up_after_the_retry_budget(self):
+        self.configure(MAX_RETRIES=1)
+        self.server.set_reply('네', failures=5)
+        with self.assertRaises(llm.InternalServerError):
+            await llm.complete(self.MESSAGES)
+        self.assertEqual(len(self.server.requests), 2)
+
+    async def test_deadline_bounds_a_hung_upstream(self):
+        self.configure(MAX_RETRIES=0)
+        self.server.set_reply('네', delay=2.0)
+        with self.assertRaises(llm.LLMTimeout):
+            await llm.complete(self.MESSAGES, timeout=0.2)
+
+    async def test_runs_without_asyncio_timeout(self):
+        # runtime.txt pins Python 3.10, which has no asyncio.timeout.
+        self.configure(MAX_RETRIES=0)
+        self.server.set_reply('네', delay=2.0)
+        with mock.patch.object(asyncio, 'timeout', None):
+            with self.assertRaises(llm.LLMTimeout):
+                await llm.complete(self.MESSAGES, timeout=0.2)
+            with self.assertRaises(llm.LLMTimeout):
+                async for _ in llm.stream(self.MESSAGES, timeout=0.2):
+                    pass
+
+    async def test_hedges_requests_slower_than_the_recent_p95(self):
+        self.configure(HEDGE=True, HEDGE_MIN_SAMPLES=5)
+        for _ in range(5):
+            llm.latencies.add(0.05)
+        self.server.set_reply('네', delay=lambda index: 2.0 if index == 0 else 0)
+        self.assertEqual(await asyncio.wait_for(llm.complete(self.MESSAGES), 1.0), '네')
+        self.assertEqual(len(self.server.requests), 2)
+
+    async def test_identical_concurrent_calls_share_one_request(self):
+        self.configure()
+        metrics.reset()
+        self.server.set_reply('네', delay=0.2)
+        other = [{'role': 'user', 'content': '메뉴 뭐 있어'}]
+        results = await asyncio.gather(*[llm.complete(self.MESSAGES) for _ in range(5)], llm.complete(other))
+        self.assertEqual(results, ['네'] * 6)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(metrics.snapshot()['counters']['single_flight.saved'], 4)
+
+    def test_calls_from_different_threads_are_coalesced(self):
+        self.configure()
+        self.server.set_reply('네', delay=0.3)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: async_to_sync(llm.complete)(self.MESSAGES), range(4)))
+        self.assertEqual(results, ['네'] * 4)
+        self.assertEqual(len(self.server.requests), 1)
+
+    async def test_followers_share_the_leaders_failure(self):
+        self.configure(MAX_RETRIES=0)
+        self.server.set_reply('네', delay=0.1, failures=1)
+        results = await asyncio.gather(*[llm.complete(self.MESSAGES) for _ in range(3)], return_exceptions=True)
+        self.assertTrue(all(isinstance(result, llm.InternalServerError) for result in results))
+        self.assertEqual(len(self.server.requests), 1)
+
+    async def test_waits_for_a_call_in_flight_in_another_worker(self):
+        self.configure()
+        key = single_flight.prompt_key(llm.CHAT_MODEL, self.MESSAGES)
+        await cache.aadd(f'orders:llm:flight:{key}:lock', 1, 30)
+
+        async def other_worker_finishes():
+            await asyncio.sleep(0.1)
+            await cache.aset(f'orders:llm:flight:{key}:result', '다른 워커의 답', 10)
+
+        with override_settings(LLM_SINGLE_FLIGHT={'CROSS_PROCESS': True, 'POLL_INTERVAL': 0.01}):
+            result, _ = await asyncio.gather(llm.complete(self.MESSAGES), other_worker_finishes())
+        self.assertEqual(result, '다른 워커의 답')
+        self.assertEqual(self.server.requests, [])
+        await cache.aclear()
+
+    async def test_cross_process_coalescing_goes_through_the_shared_cache(self):
+        self.configure()
+        self.server.set_reply('네')
+        key = single_flight.prompt_key(llm.CHAT_MODEL, self.MESSAGES)
+        self.addCleanup(caches['shared'].clear)
+        with override_settings(LLM_SINGLE_FLIGHT={**settings.LLM_SINGLE_FLIGHT, 'CROSS_PROCESS': True}):
+            self.assertEqual(await llm.complete(self.MESSAGES), '네')
+        # The default cache is per process; other workers could never see a result left there.
+        self.assertEqual(await caches['shared'].aget(f'orders:llm:flight:{key}:result'), '네')
+        self.assertIsNone(await cache.aget(f'orders:llm:flight:{key}:result'))
+
+    async def test_waiting_on_another_worker_respects_the_deadline(self):
+        self.configure()
+        key = single_flight.prompt_key(llm.CHAT_MODEL, self.MESSAGES)
+        await cache.aadd(f'orders:llm:flight:{key}:lock', 1, 30)
+        self.addCleanup(cache.clear)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        with override_settings(LLM_SINGLE_FLIGHT={'CROSS_PROCESS': True, 'POLL_INTERVAL': 0.01, 'LOCK_TIMEOUT': 30}):
+            with self.assertRaises(llm.LLMTimeout):
+                await llm.complete(self.MESSAGES, timeout=0.2)
+        self.assertLess(loop.time() - started, 1.0)
+        self.assertEqual(self.server.requests, [])
+
+    async def test_followers_wait_without_asyncio_timeout(self):
+        # runtime.txt pins Python 3.10, which has no asyncio.timeout.
+        self.configure()
+        self.server.set_reply('네', delay=0.2)
+        with mock.patch.object(asyncio, 'timeout', None):
+            results = await asyncio.gather(*[llm.complete(self.MESSAGES) for _ in range(3)])
+            self.assertEqual(results, ['네'] * 3)
+            self.server.set_reply('네', delay=1.0)
+            results = await asyncio.gather(
+                llm.complete(self.MESSAGES, timeout=2.0), llm.complete(self.MESSAGES, timeout=0.1),
+                return_exceptions=True,
+            )
+        self.assertEqual(results[0], '네')
+        self.assertIsInstance(results[1], llm.LLMTimeout)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_backoff_is_jittered_and_capped(self):
+        config = {'BACKOFF_BASE': 0.2, 'BACKOFF_MAX': 1.0}
+        delays = [llm.backoff_delay(10, config) for _ in range(50)]
+        self.assertTrue(all(0 <= delay <= 1.0 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+
+@override_settings(LLM_CIRCUIT_BREAKER={'WINDOW': 4, 'MIN_CALLS': 4, 'FAILURE_RATE': 0.5, 'SLOW_CALL_SECONDS': 1.0, 'OPEN_SECONDS': 30})
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = breaker.CircuitBreaker(clock=lambda: self.now)
+
+    def test_opens_on_failure_rate_and_recovers_through_a_probe(self):
+        for failed in (False, True, False, True):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record(0.1, failed=failed)
+        self.assertEqual(self.breaker.state, breaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+        self.now = 31
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, breaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow())  # only one probe at a time
+        self.breaker.record(0.1)
+        self.assertEqual(self.breaker.state, breaker.CLOSED)
+
+    def test_failed_or_slow_probe_reopens(self):
+        for _ in range(4):
+            self.breaker.record(5.0)  # slow, not failed
+        self.assertEqual(self.breaker.state, breaker.OPEN)
+        self.now = 31
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(5.0)
+        self.assertEqual(self.breaker.state, breaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.now = 62
+        self.assertTrue(self.breaker.allow())
+
+    def test_lost_probe_is_replaced_after_the_open_period(self):
+        for _ in range(4):
+            self.breaker.record(0.1, failed=True)
+        self.now = 31
+        self.assertTrue(self.breaker.allow())
+        self.now = 62
+        self.assertTrue(self.breaker.allow())
+
+
+class DegradedModeTests(TestCase):
+    def setUp(self):
+        invalidate_catalog()
+        llm_cache.reset_backend()
+        llm.reset_clients()
+        self.addCleanup(llm.reset_clients)
+
+    def post_chat(self, **data):
+        return self.client.post('/api/orders/chat/', data, content_type='application/json')
+
+    def open_breaker(self):
+        for _ in range(llm.breaker._outcomes.maxlen):
+            llm.breaker.record(0.0, failed=True)
+        self.assertEqual(llm.breaker.state, breaker.OPEN)
+
+    def test_open_breaker_answers_from_the_catalog_without_calling_upstream(self):
+        self.open_breaker()
+        with mock.patch('orders.llm.get_client') as get_client, self.assertLogs('orders.views', 'WARNING'):
+            generic = self.post_chat(message='오늘 날씨 어때').json()
+            menu = self.post_chat(message='맘스터치 천안쌍용점 뭐가 맛있어').json()
+            stores = self.post_chat(message='커피 추천 좀').json()
+            ambiguous = self.post_chat(message='싸이버거 2개 주세요').json()
+            order = self.post_chat(message='아메리카노 한 잔 주세요').json()
+        get_client.assert_not_called()
+
+        self.assertEqual(generic['reply'], DEGRADED_REPLY)
+        self.assertTrue(generic['degraded'])
+        self.assertIn('싸이버거(4600원)', menu['reply'])
+        self.assertIn('컴포즈커피 천안용암마을점', stores['reply'])
+        self.assertIn('맘스터치, 맘스터치 천안쌍용점에서 판매합니다', ambiguous['reply'])
+        self.assertEqual(order['currentOrder']['items'][0]['name'], '아메리카노')
+        self.assertNotIn('degraded', order)
+
+    def test_upstream_timeout_falls_back_to_a_local_answer(self):
+        with mock.patch('orders.llm.complete', mock.AsyncMock(side_effect=llm.LLMTimeout('deadline'))):
+            with self.assertLogs('orders.views', 'WARNING') as logs:
+                response = self.post_chat(message='커피 추천 좀')
+        self.assertEqual(logs.output, ['WARNING:orders.views:LLM unavailable, answering locally: deadline'])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['degraded'])
+
+
+class OrderEventsTests(TestCase):
+    def setUp(self):
+        invalidate_catalog()
+        events.reset_backend()
+        self.addCleanup(events.reset_backend)
+        self.store = Store.objects.create(name="테스트주방")
+        MenuItem.objects.create(store=self.store, name="김밥", price=3000)
+        invalidate_catalog()
+
+    def add_item(self, state=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            state, _ = _update_order('김밥', self.store.name, state or {})
+        return state
+
+    async def test_cart_writes_and_status_changes_are_logged(self):
+        state = await sync_to_async(self.add_item)()
+        state = await sync_to_async(self.add_item)(state)
+        with mock.patch('orders.llm.complete', mock.AsyncMock()):
+            await self.async_client.post(
+                '/api/orders/chat/', {'message': '결제할게요', 'currentState': state}, content_type='application/json',
+            )
+        logged = [
+            (event.kind, event.status, event.payload.get('itemCount'))
+            async for event in OrderEvent.objects.filter(order_id=state['orderId']).order_by('id')
+        ]
+        self.assertEqual(logged, [
+            ('order_created', 'pending', 1), ('cart_updated', 'pending', 2), ('status_changed', 'awaiting_payment', None),
+        ])
+
+    async def test_stream_replays_the_log_then_follows_live_events(self):
+        state = await sync_to_async(self.add_item)()
+        stream = events.stream(self.store.id, after=0)
+        first = await anext(stream)
+        self.assertEqual((first['kind'], first['payload']['itemCount']), ('order_created', 1))
+
+        live = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        await sync_to_async(self.add_item)(state)
+        second = await asyncio.wait_for(live, 1)
+        self.assertEqual((second['kind'], second['payload']['itemCount']), ('cart_updated', 2))
+        await stream.aclose()
+        self.assertEqual(events.get_backend().subscriber_count(), 0)
+
+        resumed = events.stream(self.store.id, after=first['id'])
+        self.assertEqual((await anext(resumed))['id'], second['id'])
+        await resumed.aclose()
+
+    @override_settings(ORDER_EVENTS={'KEEPALIVE_SECONDS': 0.05})
+    async def test_stream_without_an_offset_is_live_only(self):
+        state = await sync_to_async(self.add_item)()
+        with mock.patch.object(asyncio, 'timeout', None):  # not on Python 3.10
+            stream = events.stream(self.store.id)
+            self.assertIsNone(await anext(stream))  # the logged event is not replayed
+            await sync_to_async(self.add_item)(state)
+            live = await asyncio.wait_for(anext(stream), 1)
+        self.assertEqual((live['kind'], live['payload']['itemCount']), ('cart_updated', 2))
+        await stream.aclose()
+
+        response = await self.async_client.get(f'/api/orders/stores/{self.store.id}/events/')
+        frames = aiter(response.streaming_content)
+        self.assertEqual(await anext(frames), b'retry: 3000\n\n')
+        self.assertEqual(await anext(frames), b': keepalive\n\n')  # subscribed; nothing replayed
+        await sync_to_async(self.add_item)(state)
+        frame = (await asyncio.wait_for(anext(frames), 1)).decode()
+        self.assertIn('"itemCount": 3', frame)
+        await frames.aclose()
+
+    @override_settings(ORDER_EVENTS={'QUEUE_SIZE': 1, 'KEEPALIVE_SECONDS': 0.05})
+    async def test_slow_subscriber_catches_up_from_the_log(self):
+        stream = events.stream(self.store.id)
+        self.assertIsNone(await anext(stream))  # idle keepalive
+
+        state = None
+        for _ in range(3):
+            state = await sync_to_async(self.add_item)(state)
+        await asyncio.sleep(0)  # let the fan-out callbacks run
+        received = [await anext(stream) for _ in range(3)]
+        self.assertEqual([event['payload']['itemCount'] for event in received], [1, 2, 3])
+        self.assertIsNone(await anext(stream))  # nothing delivered twice
+        await stream.aclose()
+
+    def test_listener_logs_a_lost_connection_and_catches_up(self):
+        backend = events.PostgresBackend('order_events')
+
+        class Stop(Exception):
+            pass
+
+        with mock.patch.object(backend, '_listen', side_effect=OSError('connection reset')), \
+                mock.patch.object(backend, 'catch_up_all') as catch_up_all, \
+                mock.patch('orders.events.time.sleep', side_effect=Stop), \
+                self.assertLogs('orders.events', 'ERROR') as logs:
+            with self.assertRaises(Stop):
+                backend._listen_forever()
+        self.assertIn('Order event listener lost its connection', logs.output[0])
+        self.assertIn('OSError: connection reset', logs.output[0])
+        catch_up_all.assert_called_once()
+
+    async def test_sse_endpoint_resumes_after_last_event_id(self):
+        state = await sync_to_async(self.add_item)()
+        await sync_to_async(self.add_item)(state)
+        first_id = await OrderEvent.objects.filter(store=self.store).order_by('id').values_list('id', flat=True).afirst()
+
+        response = await self.async_client.get(
+            f'/api/orders/stores/{self.store.id}/events/', headers={'Last-Event-ID': str(first_id)},
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        frames = aiter(response.streaming_content)
+        self.assertEqual(await anext(frames), b'retry: 3000\n\n')
+        frame = (await anext(frames)).decode()
+        self.assertTrue(frame.startswith(f'id: {first_id + 1}\nevent: cart_updated\n'))
+        await frames.aclose()
+
+        self.assertEqual((await self.async_client.get('/api/orders/stores/999999/events/')).status_code, 404)
+        bad = await self.async_client.get(f'/api/orders/stores/{self.store.id}/events/?after=x')
+        self.assertEqual(bad.status_code, 400)
+
+
+class SpokenTextFilterTests(TestCase):
+    def test_holds_back_action_block_split_across_chunks(self):
+        spoken = SpokenTextFilter()
+        chunks = ["네, 싸이버거를 ", "추가했습니다.\n`", "``json\n{", '"action": "add_to_cart"}', "\n```"]
+        text = ''.join(spoken.feed(chunk) for chunk in chunks) + spoken.flush()
+        self.assertEqual(text, "네, 싸이버거를 추가했습니다.\n")
+
+    def test_plain_reply_is_passed_through(self):
+        spoken = SpokenTextFilter()
+        text = spoken.feed("메뉴는 ") + spoken.feed("세 가지입니다`") + spoken.flush()
+        self.assertEqual(text, "메뉴는 세 가지입니다`")
+
+
+class ChatStreamingTests(TestCase):
+    def setUp(self):
+        invalidate_catalog()
+        llm_cache.reset_backend()
+
+    async def read_events(self, response):
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        events = []
+        for frame in body.strip().split('\n\n'):
+            event_line, data_line = frame.split('\n')
+            events.append((event_line[len('event: '):], json.loads(data_line[len('data: '):])))
+        return events
+
+    async def test_streams_tokens_then_final_state(self):
+        async def fake_stream(messages):
+            for start in range(0, len(FAKE_ADD_TO_CART_REPLY), 7):
+                yield FAKE_ADD_TO_CART_REPLY[start:start + 7]
+
+        with mock.patch('orders.llm.stream', fake_stream):
+            response = await self.async_client.post(
+                '/api/orders/chat/', {'message': '싸이버거 하나 주문할게'},
+                content_type='application/json', headers={'Accept': 'text/event-stream'},
+            )
+            events = await self.read_events(response)
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        spoken = ''.join(data['text'] for event, data in events if event == 'token')
+        self.assertNotIn('add_to_cart', spoken)
+        self.assertTrue(spoken.startswith("네, 싸이버거를 장바구니에 추가했습니다."))
+
+        event, final = events[-1]
+        self.assertEqual(event, 'done')
+        self.assertIsNone(final['action'])
+        self.assertEqual(final['currentOrder']['items'][0]['name'], '싸이버거')
+        self.assertIn('conversationState', final)
+
+    async def test_streamed_turn_is_timed_until_its_last_event(self):
+        async def fake_stream(messages):
+            await asyncio.sleep(0.01)
+            yield FAKE_ADD_TO_CART_REPLY
+
+        metrics.reset()
+        with mock.patch('orders.llm.stream', fake_stream), self.assertLogs('orders.timing', 'INFO') as logs:
+            response = await self.async_client.post(
+                '/api/orders/chat/', {'message': '싸이버거 하나 주문할게', 'stream': True}, content_type='application/json',
+            )
+            self.assertEqual(logs.output, [])  # not logged before the body is sent
+            await self.read_events(response)
+
+        logged = json.loads(logs.records[-1].getMessage())
+        self.assertGreaterEqual(logged['first_token_ms'], 10)
+        self.assertEqual(logged['completion_tokens'], count_tokens(FAKE_ADD_TO_CART_REPLY))
+        self.assertIn('update_order', logged['stages'])
+        self.assertEqual(metrics.snapshot()['timings']['llm.first_token']['count'], 1)
+
+    async def test_upstream_failure_before_any_text_degrades(self):
+        async def failing_stream(messages):
+            raise llm.CircuitOpen('open')
+            yield
+
+        with mock.patch('orders.llm.stream', failing_stream), self.assertLogs('orders.views', 'WARNING'):
+            response = await self.async_client.post(
+                '/api/orders/chat/', {'message': '오늘 날씨 어때', 'stream': True}, content_type='application/json',
+            )
+            events = await self.read_events(response)
+
+        self.assertEqual([event for event, _ in events], ['token', 'done'])
+        self.assertEqual(events[0][1]['text'], DEGRADED_REPLY)
+        self.assertTrue(events[1][1]['degraded'])
+
+    async def test_failure_mid_answer_is_logged_and_reported(self):
+        async def failing_stream(messages):
+            yield "네, "
+            raise RuntimeError('connection reset')
+
+        with mock.patch('orders.llm.stream', failing_stream), self.assertLogs('orders.views', 'ERROR') as logs:
+            response = await self.async_client.post(
+                '/api/orders/chat/', {'message': '오늘 날씨 어때', 'stream': True}, content_type='application/json',
+            )
+            events = await self.read_events(response)
+
+        self.assertEqual(events[-1], ('error', {'error': 'connection reset'}))
+        self.assertIn('connection reset', logs.output[0])  # with the traceback
+
+    async def test_local_intent_is_sent_as_single_turn(self):
+        response = await self.async_client.post(
+            '/api/orders/chat/', {'message': '롯데리아 메뉴 뭐 있어', 'stream': True}, content_type='application/json',
+        )
+        events = await self.read_events(response)
+        self.assertEqual([event for event, _ in events], ['token', 'done'])
+        self.assertIn("'롯데리아'의 메뉴는", events[1][1]['reply'])
+
+
+class BenchmarkSuiteTests(TestCase):
+    def tearDown(self):
+        invalidate_catalog()
+
+    def test_runs_offline_and_reports_every_stage(self):
+        results = run_benchmarks(sizes=[10], iterations=2)
+        self.assertEqual(
+            [r['name'] for r in results],
+            ['simple_nlu', 'get_category_from_item_x1000', 'update_order', 'db_search_result', 'indexed_name_search', 'chat_post'],
+        )
+        for result in results:
+            self.assertEqual(result['catalog_size'], 10)
+            self.assertGreaterEqual(result['p95_ms'], result['p50_ms'])
+
+    def test_query_plans_use_the_schema_indexes(self):
+        # Two sizes: the second pass once explained from plans cached by the first.
+        results = run_query_plans(sizes=[10, 20], iterations=1)
+        self.assertEqual([r['indexed'] for r in results], ([False] * 4 + [True] * 4) * 2)
+        for size in (10, 20):
+            indexed = {r['name']: r['plan'] for r in results if r['indexed'] and r['catalog_size'] == size}
+            self.assertIn('orders_store_name_lower', indexed['plan_store_by_name'])
+            self.assertIn('unique_menu_item_store_name', indexed['plan_menu_item_by_store_and_name'])
+            self.assertIn('orders_order_status_created', indexed['plan_orders_awaiting_payment'])
+            for result in results:
+                if not result['indexed'] and result['catalog_size'] == size:
+                    for name in SCHEMA_INDEXES:
+                        self.assertNotIn(name, result['plan'], result['name'])
+
+    def test_lower_lookup_is_limited_to_the_indexed_names(self):
+        self.assertIn('LOWER(', str(MenuItem.objects.filter(name__lower='a').query))
+        self.assertIn('LOWER(', str(Store.objects.filter(name__lower='a').query))
+        for queryset in (lambda: Order.objects.filter(status__lower='a'), lambda: User.objects.filter(username__lower='a')):
+            with self.assertRaises(FieldError):
+                queryset()
+
+    def test_compare_flags_slower_results(self):
+        baseline = [{'name': 'simple_nlu', 'catalog_size': 10, 'p50_ms': 1.0}]
+        current = [{'name': 'simple_nlu', 'catalog_size': 10, 'p50_ms': 1.5}]
+        self.assertEqual(compare_results(current, baseline, 1.2)[0]['ratio'], 1.5)
+        self.assertEqual(compare_results(current, baseline, 2.0), [])
+
+
+class ChatSessionTests(TestCase):
+    session_id = 'kiosk-01-session'
+
+    def setUp(self):
+        invalidate_catalog()
+        llm_cache.reset_backend()
+        cache.clear()
+
+    def post_chat(self, message, **data):
+        data = {'message': message, 'sessionId': self.session_id, **data}
+        return self.client.post('/api/orders/chat/', data, content_type='application/json')
+
+    def test_delta_requests_use_server_side_state(self):
+        with mock.patch('orders.llm.complete', mock.AsyncMock(return_value=FAKE_ADD_TO_CART_REPLY)) as complete:
+            first = self.post_chat('싸이버거 하나 주문할게').json()
+            self.post_chat('하나 더 주문할게')
+
+        self.assertEqual(first['sessionId'], self.session_id)
+        second_prompt = complete.await_args.args[0]
+        self.assertIn({'role': 'user', 'content': '싸이버거 하나 주문할게'}, second_prompt)
+
+        body = self.post_chat('결제할게요').json()
+        self.assertEqual(body['action'], 'navigate_to_payment')
+        self.assertEqual(body['currentOrder']['items'][0]['quantity'], 2)
+
+        body = self.post_chat('결제 성공').json()
+        self.assertEqual(body['action'], 'navigate_to_home')
+        self.assertEqual(async_to_sync(sessions.load)(self.session_id)['history'], [])
+
+    def test_turn_log_is_bounded(self):
+        with override_settings(CHAT_SESSIONS={'ALIAS': 'shared', 'MAX_TURNS': 4}):
+            for i in range(5):
+                self.post_chat(f'롯데리아 메뉴 뭐 있어 {i}')
+        history = async_to_sync(sessions.load)(self.session_id)['history']
+        self.assertEqual(len(history), 4)
+        self.assertEqual(history[-2], {'sender': 'user', 'text': '롯데리아 메뉴 뭐 있어 4'})
+
+    def test_sessions_outlive_the_worker(self):
+        self.post_chat('롯데리아 메뉴 뭐 있어')
+        # Kept in the database, where every worker (and the next deploy) reads it, not in this process.
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT cache_key FROM orders_cache')
+            self.assertIn(f':1:orders:session:{self.session_id}', [key for key, in cursor.fetchall()])
+        caches['default'].clear()
+        session = async_to_sync(sessions.load)(self.session_id)
+        self.assertEqual(session['history'][0], {'sender': 'user', 'text': '롯데리아 메뉴 뭐 있어'})
+
+    def test_rejects_malformed_session_id(self):
+        response = self.post_chat('안녕', sessionId='../../etc')
+        self.assertEqual(response.status_code, 400)
+
+    def test_old_turns_are_folded_into_the_summary(self):
+        with override_settings(CHAT_SESSIONS={'ALIAS': 'shared', 'MAX_TURNS': 4}):
+            for i in range(3):
+                self.post_chat(f'롯데리아 메뉴 뭐 있어 {i}')
+            with mock.patch('orders.llm.complete', mock.AsyncMock(return_value='네')) as complete:
+                self.post_chat('오늘 뭐 먹지')
+
+        session = async_to_sync(sessions.load)(self.session_id)
+        self.assertEqual(session['summary'][0], '고객: 롯데리아 메뉴 뭐 있어 0')
+        summary_message = complete.await_args.args[0][2]
+        self.assertEqual(summary_message['role'], 'system')
+        self.assertIn('고객: 롯데리아 메뉴 뭐 있어 0', summary_message['content'])
+
+
+    def test_each_message_is_summarized_once(self):
+        with override_settings(CHAT_PROMPT={'RECENT_MESSAGES': 4, 'FOLD_EVERY': 2, 'SUMMARY_MAX_TOKENS': 10000}):
+            with mock.patch('orders.prompt.summarize_message', wraps=summarize_message) as summarize:
+                for i in range(6):
+                    self.post_chat(f'롯데리아 메뉴 뭐 있어 {i}')
+                with mock.patch('orders.llm.complete', mock.AsyncMock(return_value='네')):
+                    self.post_chat('오늘 뭐 먹지')
+
+        session = async_to_sync(sessions.load)(self.session_id)
+        self.assertEqual(len(session['history']), 4)
+        self.assertEqual(session['summary'][0], '고객: 롯데리아 메뉴 뭐 있어 0')
+        # The LLM turn reused the stored lines instead of summarizing the older turns again.
+        self.assertEqual(summarize.call_count, len(session['summary']))
+
+class PromptBudgetTests(TestCase):
+    history = [
+        {'sender': 'user' if i % 2 == 0 else 'assistant', 'text': f'{i}번째 메시지 ' + '가나다라마바사' * 10}
+        for i in range(20)
+    ]
+
+    def test_keeps_recent_messages_and_summarizes_the_rest(self):
+        with override_settings(CHAT_PROMPT={'MAX_TOKENS': 10000, 'RECENT_MESSAGES': 4}):
+            messages, token_counts = build_prompt('시스템', '결과', self.history, '질문', digest='카탈로그')
+        self.assertEqual(token_counts['history_messages'], 4)
+        self.assertEqual(messages[-3]['content'], self.history[-1]['text'])
+        self.assertTrue(messages[2]['content'].startswith('이전 대화 요약:'))
+        self.assertEqual(token_counts['total'], count_message_tokens(messages))
+
+    def test_stable_parts_come_first_and_fold_in_steps(self):
+        history = self.history[:10] + [{'sender': 'assistant', 'text': '추가했습니다.\n```json\n{"action": "update_cart"}\n```'}]
+        with override_settings(CHAT_PROMPT={'MAX_TOKENS': 10000, 'RECENT_MESSAGES': 4, 'FOLD_EVERY': 4}):
+            layouts = [build_prompt('시스템', f'결과 {n}', history[:n], f'질문 {n}', digest='카탈로그')[0] for n in (8, 9, 10, 11)]
+            folded = build_prompt('시스템', '결과', self.history[:12], '질문', digest='카탈로그')[0]
+        self.assertEqual([m['content'] for m in layouts[0][:2]], ['시스템', '카탈로그'])
+        self.assertEqual(layouts[0][-2:], [{'role': 'system', 'content': 'DB 검색 결과: 결과 8'}, {'role': 'user', 'content': '질문 8'}])
+        # Between folds a turn only appends to the previous turn's history, so everything before the search block is reused.
+        for before, after in zip(layouts, layouts[1:]):
+            self.assertEqual(after[:len(before) - 2], before[:-2])
+        self.assertNotEqual(folded[2], layouts[-1][2])
+        self.assertEqual(layouts[3][-3], {'role': 'assistant', 'content': '추가했습니다.'})
+
+    def test_catalog_digest_is_ordered_and_cached_per_version(self):
+        invalidate_catalog()
+        catalog = get_catalog()
+        digest = get_catalog_digest(catalog)
+        self.assertIs(get_catalog_digest(catalog), digest)
+        store_names = [line[2:].split(': ')[0] for line in digest.splitlines() if line.startswith('- ')]
+        self.assertEqual(store_names, sorted(store.name for store in catalog.stores))
+        self.assertRegex(digest, r'\n- 컴포즈커피 천안용암마을점: (.+, )?커피 \(메뉴 \d+개\)')
+
+        with override_settings(CHAT_PROMPT={'DIGEST_MAX_TOKENS': 60}):
+            invalidate_catalog()
+            short = get_catalog_digest(get_catalog())
+        self.assertLess(count_tokens(short), count_tokens(digest))
+        self.assertRegex(short.splitlines()[-1], r'^- 외 \d+개 가게$')
+
+    def test_enforces_the_token_budget(self):
+        with override_settings(CHAT_PROMPT={'MAX_TOKENS': 300, 'RECENT_MESSAGES': 8, 'SUMMARY_MAX_TOKENS': 100}):
+            messages, token_counts = build_prompt('시스템', '결과', self.history, '질문')
+        self.assertLessEqual(token_counts['total'], 300)
+        self.assertLess(token_counts['history_messages'], 8)
+        self.assertEqual(messages[-1], {'role': 'user', 'content': '질문'})
+
+    def test_summary_lines_strip_code_blocks(self):
+        line = summarize_message({'sender': 'assistant', 'text': '추가했습니다.\n```json\n{"action": "add_to_cart"}\n```'})
+        self.assertEqual(line, '안내: 추가했습니다.')
+
+
+class RequestTimingTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        invalidate_catalog()
+        llm_cache.reset_backend()
+
+    def test_server_timing_header_reports_stages_and_queries(self):
+        with mock.patch('orders.llm.complete', mock.AsyncMock(return_value=FAKE_ADD_TO_CART_REPLY)):
+            response = self.post_chat_within_budget('싸이버거 먹고 싶어')
+
+        header = response['Server-Timing']
+        for stage in ('nlu', 'catalog_search', 'llm', 'parse', 'update_order', 'total'):
+            self.assertIn(f'{stage};dur=', header)
+        timer = response.request_timing
+        prompt_tokens = timer.tags.pop('prompt_tokens')
+        self.assertEqual(timer.tags, {
+            'intent': 'general_query', 'action': 'add_to_cart', 'completion_tokens': count_tokens(FAKE_ADD_TO_CART_REPLY),
+        })
+        self.assertEqual(prompt_tokens['history_messages'], 0)
+        self.assertEqual(prompt_tokens['prefix'], prompt_tokens['system'] + prompt_tokens['digest'])
+        self.assertEqual(prompt_tokens['total'], prompt_tokens['prefix'] + prompt_tokens['search'] + prompt_tokens['user'])
+        self.assertEqual(timer.queries, timer.stages['update_order'][1])
+
+    def test_local_intents_stay_within_query_budgets(self):
+        with mock.patch('orders.llm.complete', mock.AsyncMock(return_value=FAKE_ADD_TO_CART_REPLY)):
+            order = self.post_chat_within_budget('싸이버거 하나 주문할게').json()['currentOrder']
+        self.post_chat_within_budget('싸이버거 한 개 더', currentState=order)
+        self.post_chat_within_budget('롯데리아 메뉴 뭐 있어')
+        self.post_chat_within_budget('버거 파는 가게 어디야')
+        self.post_chat_within_budget('결제할게요', currentState=order)
+        self.post_chat_within_budget('결제 취소', currentState=order)
+        self.post_chat_within_budget('결제 성공', currentState=order)
+
+    def test_span_is_noop_outside_a_request(self):
+        with span('nlu'):
+            simple_nlu('안녕하세요')
+
+
+class MenuResolverTests(TestCase):
+    store_name = "맘스터치 천안쌍용점"
+
+    def setUp(self):
+        invalidate_catalog()
+        self.resolver = get_resolver(get_catalog())
+
+    def resolve(self, item_name, store_name=store_name):
+        item = self.resolver.resolve(item_name, store_name)
+        return item and (item.name, item.store.name)
+
+    def test_tolerates_spacing_typos_and_choseong(self):
+        for spoken in ("싸이 버거", "싸이버가", "ㅆㅇㅂㄱ", "싸이버거!"):
+            self.assertEqual(self.resolve(spoken), ("싸이버거", self.store_name), spoken)
+        self.assertEqual(self.resolve("싸이버거", "맘스터치 천안 쌍용점"), ("싸이버거", self.store_name))
+
+    def test_rejects_distant_names_and_unknown_stores(self):
+        self.assertIsNone(self.resolve("김치찌개"))
+        self.assertIsNone(self.resolve("싸이버거", "버거킹"))
+
+    def test_searches_every_store_without_a_store_name(self):
+        item = self.resolver.resolve_item("아메리 카노")
+        self.assertEqual(item.name, "아메리카노")
+
+    def test_resolver_is_rebuilt_only_on_catalog_change(self):
+        self.assertIs(get_resolver(get_catalog()), self.resolver)
+        invalidate_catalog()
+        self.assertIsNot(get_resolver(get_catalog()), self.resolver)
+
+    def test_update_order_accepts_misheard_item_names(self):
+        state, message = _update_order("싸이 버가", self.store_name, {})
+        self.assertEqual(state['items'], [{'name': '싸이버거', 'quantity': 1, 'price': state['items'][0]['price']}])
+        self.assertIn("싸이버거", message)
+
+
+class UpdateOrderTests(TestCase):
+    def setUp(self):
+        invalidate_catalog()
+        self.store = Store.objects.create(name="테스트버거")
+        self.items = [MenuItem.objects.create(store=self.store, name=f"버거{i}", price=1000 + i) for i in range(12)]
+        invalidate_catalog()
+        get_catalog()
+
+    def add(self, item, state):
+        with CaptureQueriesContext(connection) as queries:
+            state, _ = _update_order(item.name, self.store.name, state)
+        return state, len(queries)
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        state, _ = self.add(self.items[0], {})
+        state, small_cart_queries = self.add(self.items[1], state)
+        for item in self.items[2:11]:
+            state, _ = self.add(item, state)
+        state, large_cart_queries = self.add(self.items[11], state)
+        self.assertEqual(large_cart_queries, small_cart_queries)
+        self.assertEqual(len(state['items']), 12)
+        self.assertEqual(state['totalPrice'], float(sum(item.price for item in self.items)))
+
+    def test_repeated_add_increments_single_row(self):
+        state, _ = self.add(self.items[0], {})
+        state, _ = self.add(self.items[0], state)
+        self.assertEqual(state['items'], [{'name': '버거0', 'quantity': 2, 'price': 1000.0}])
+        self.assertEqual(OrderItem.objects.filter(order_id=state['orderId']).count(), 1)
+        self.assertEqual(OrderItem.objects.get(order_id=state['orderId']).quantity, 2)
+
+    def test_item_from_another_store_starts_new_order(self):
+        state, _ = self.add(self.items[0], {})
+        new_state, _ = _update_order('싸이버거', '맘스터치 천안쌍용점', state)
+        self.assertNotEqual(new_state['orderId'], state['orderId'])
+        self.assertEqual(Order.objects.get(id=new_state['orderId']).store.name, '맘스터치 천안쌍용점')
+
+    def test_unknown_item_leaves_order_untouched(self):
+        state, message = _update_order('없는메뉴', self.store.name, {})
+        self.assertIsNone(state)
+        self.assertIn('찾을 수 없습니다', message)
+
+
+class CartOperationsTests(TestCase):
+    def setUp(self):
+        invalidate_catalog()
+        self.store = Store.objects.create(name="테스트버거")
+        self.items = [MenuItem.objects.create(store=self.store, name=f"버거{i}", price=1000) for i in range(6)]
+        invalidate_catalog()
+        get_catalog()
+
+    def apply(self, state, *operations):
+        with CaptureQueriesContext(connection) as queries:
+            state, message = cart.apply_operations(self.store.name, [CartOperation(*op) for op in operations], state)
+        return state, message, len(queries)
+
+    def quantities(self, state):
+        return {item['name']: item['quantity'] for item in state['items']}
+
+    def test_applies_add_remove_and_set_in_one_turn(self):
+        state, _, _ = self.apply({}, ('add', '버거0', 2), ('add', '버거1'), ('add', '버거2'))
+        state, message, _ = self.apply(
+            state, ('remove', '버거0', 0), ('set_quantity', '버거1', 5), ('add', '버거2', 2), ('add', '버거3'),
+        )
+        self.assertEqual(self.quantities(state), {'버거1': 5, '버거2': 3, '버거3': 1})
+        self.assertIn('버거0을(를) 장바구니에서 뺐습니다', message)
+
+    def test_query_count_does_not_grow_with_operation_count(self):
+        state, _, _ = self.apply({}, *[('add', item.name) for item in self.items])
+        _, _, one_operation = self.apply(state, ('add', '버거0'))
+        _, _, six_operations = self.apply(state, *[('add', item.name) for item in self.items])
+        self.assertEqual(one_operation, six_operations)
+
+    def test_order_totals_follow_every_change(self):
+        state, _, _ = self.apply({}, ('add', '버거0', 2), ('add', '버거1'))
+        self.assertEqual((state['totalPrice'], state['itemCount']), (3000.0, 3))
+        state, _, _ = self.apply(state, ('set_quantity', '버거0', 5), ('remove', '버거1'), ('add', '버거2', 4))
+        self.assertEqual((state['totalPrice'], state['itemCount']), (9000.0, 9))
+        order = Order.objects.get(id=state['orderId'])
+        self.assertEqual((order.total_price, order.item_count), (9000, 9))
+
+    def test_totals_use_database_prices_when_the_snapshot_lags(self):
+        # Repriced by another process: this worker's snapshot still says 1000.
+        MenuItem.objects.filter(id=self.items[0].id).update(price=1500)
+        self.assertEqual(get_catalog().find_item('버거0', self.store.name).price, 1000)
+        state, _, _ = self.apply({}, ('add', '버거0', 2))
+        self.assertEqual(state['totalPrice'], sum(item['price'] * item['quantity'] for item in state['items']))
+        self.assertEqual(Order.objects.get(id=state['orderId']).total_price, 3000)
+
+    def test_repair_recomputes_drifted_totals(self):
+        state, _, _ = self.apply({}, ('add', '버거0', 2))
+        untouched, _, _ = self.apply({}, ('add', '버거1'))
+        OrderItem.objects.filter(order_id=state['orderId']).update(quantity=7)
+        self.assertEqual(cart.repair_order_totals(batch_size=1), 1)
+        order = Order.objects.get(id=state['orderId'])
+        self.assertEqual((order.total_price, order.item_count), (7000, 7))
+        self.assertEqual(cart.repair_order_totals(), 0)
+
+    def test_unknown_item_rejects_the_whole_action(self):
+        state, _, _ = self.apply({}, ('add', '버거0'))
+        new_state, message, _ = self.apply(state, ('add', '버거1'), ('add', '없는메뉴'))
+        self.assertIsNone(new_state)
+        self.assertIn('없는메뉴', message)
+        self.assertEqual(OrderItem.objects.filter(order_id=state['orderId']).count(), 1)
+
+
+class CartActionParsingTests(TestCase):
+    def test_finds_the_action_object_without_a_greedy_match(self):
+        text = '네 {기분 좋은} 주문이네요 {"action": "update_cart", "store_name": "가", "operations": []} 그리고 {끝}'
+        self.assertEqual(cart.find_action(text)['action'], 'update_cart')
+        self.assertEqual(cart.find_action(FAKE_ADD_TO_CART_REPLY)['item_name'], '싸이버거')
+        self.assertIsNone(cart.find_action('메뉴를 골라주세요 {}'))
+
+    def test_validates_operations(self):
+        store_name, operations = cart.parse_cart_action({
+            'action': 'update_cart', 'store_name': '가게',
+            'operations': [{'op': 'add', 'item_name': 'a'}, {'op': 'set_quantity', 'item_name': 'b', 'quantity': 0}],
+        })
+        self.assertEqual(operations, [CartOperation('add', 'a', 1), CartOperation('set_quantity', 'b', 0)])
+        for invalid in (
+            {'action': 'update_cart', 'store_name': '가게', 'operations': []},
+            {'action': 'update_cart', 'store_name': '가게', 'operations': [{'op': 'eat', 'item_name': 'a'}]},
+            {'action': 'update_cart', 'store_name': '가게', 'operations': [{'op': 'set_quantity', 'item_name': 'a'}]},
+            {'action': 'update_cart', 'store_name': '가게', 'operations': [{'op': 'add', 'item_name': 'a', 'quantity': 0}]},
+            {'action': 'add_to_cart', 'store_name': '가게'},
+        ):
+            self.assertIsNone(cart.parse_cart_action(invalid), invalid)
+
+    def test_legacy_add_to_cart_becomes_one_operation(self):
+        parsed = cart.parse_cart_action({'action': 'add_to_cart', 'item_name': '싸이버거', 'store_name': '맘스터치'})
+        self.assertEqual(parsed, ('맘스터치', [CartOperation('add', '싸이버거', 1)]))
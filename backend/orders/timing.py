@@ -0,0 +1,115 @@
+"""
+Per-request stage timing and SQL query counting.
+
+`RequestTimingMiddleware` starts a `RequestTimer` for every request and keeps
+it in a context variable, which asgiref carries into `sync_to_async` threads.
+Code marks its stages with `span('name')`; every SQL statement executed while
+the timer is active is counted against the innermost open span. The result is
+reported in a `Server-Timing` header and one structured log line per request.
+
+A streaming response's body is produced after the view has returned, so the
+middleware makes the timer current again while it is iterated: spans and tags
+set while streaming (e.g. the time to the first LLM token) go into the log
+line, which is written when the stream ends. The `Server-Timing` header,
+sent before the body, only covers what ran before it.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+
+_current_timer = contextvars.ContextVar('orders_request_timer', default=None)
+
+
+class RequestTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}  # name -> [duration in seconds, query count]
+        self.queries = 0
+        self.tags = {}
+        self._stack = []
+
+    def record_query(self):
+        self.queries += 1
+        if self._stack:
+            self.stages[self._stack[-1]][1] += 1
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """Formats the stages as a `Server-Timing` header value."""
+        parts = [
+            f'{name};dur={duration * 1000:.3f};desc="{queries} queries"'
+            for name, (duration, queries) in self.stages.items()
+        ]
+        parts.append(f'total;dur={self.elapsed * 1000:.3f};desc="{self.queries} queries"')
+        return ', '.join(parts)
+
+    def as_dict(self):
+        return {
+            'total_ms': round(self.elapsed * 1000, 3),
+            'queries': self.queries,
+            'stages': {
+                name: {'ms': round(duration * 1000, 3), 'queries': queries}
+                for name, (duration, queries) in self.stages.items()
+            },
+            **self.tags,
+        }
+
+
+def current_timer():
+    return _current_timer.get()
+
+
+def start_timer():
+    """Starts a timer for the current context and returns `(timer, reset_token)`."""
+    timer = RequestTimer()
+    return timer, _current_timer.set(timer)
+
+
+def resume_timer(timer):
+    """Makes an already started `timer` current again and returns the reset token."""
+    return _current_timer.set(timer)
+
+
+def stop_timer(token):
+    _current_timer.reset(token)
+
+
+@contextmanager
+def span(name):
+    """Times a stage of the current request. A no-op outside a timed request."""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    stage = timer.stages.setdefault(name, [0.0, 0])
+    timer._stack.append(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage[0] += time.perf_counter() - started
+        timer._stack.pop()
+
+
+def tag(key, value):
+    """Attaches a label (e.g. the detected intent) to the current request's timing record."""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.tags[key] = value
+
+
+def count_queries(execute, sql, params, many, context):
+    """Database execute wrapper feeding the current request's timer."""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.record_query()
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(sender, connection, **kwargs):
+    """`connection_created` receiver that hooks `count_queries` into each new connection."""
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
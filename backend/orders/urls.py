@@ -1,6 +1,9 @@
 from django.urls import path
-from .views import ChatWithAIView
+from .views import CatalogView, ChatWithAIView, MetricsView, OrderEventsView
 
 urlpatterns = [
     path('chat/', ChatWithAIView.as_view(), name='chat-with-ai'),
+    path('catalog/', CatalogView.as_view(), name='catalog'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('stores/<int:store_id>/events/', OrderEventsView.as_view(), name='order-events'),
 ]
@@ -1,139 +1,146 @@
-import openai
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.db.models import Q
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
+import hmac
 import json
+import logging
 import re
-from rest_framework.views import APIView
-from rest_framework.response import Response
+import time
 from rest_framework import status
-from .models import Store, MenuItem, Order, OrderItem
+from . import cart, catalog_api, events, llm, llm_cache, metrics, sessions, timing
+from .cart import CART_ACTIONS, CartOperation, find_action
+from .catalog import get_catalog
+from .llm_cache import make_cache_key
+from .matcher import KeywordAutomaton
+from .order_parser import parse_order, pick_store
+from .prompt import SYSTEM_PROMPT, build_prompt, count_tokens, get_catalog_digest
+from .streaming import SpokenTextFilter, sse_event
+from .models import Order, Store
+
+logger = logging.getLogger(__name__)
 
 # --- Helper Functions ---
 
-def get_category_from_item(item_name):
-    """Extracts a representative category from a menu item name."""
-    if '버거' in item_name: return '버거'
-    if '커피' in item_name or '라떼' in item_name: return '커피'
-    if '김밥' in item_name: return '김밥'
-    if '마라탕' in item_name or '마라샹궈' in item_name: return '마라'
-    if '떡볶이' in item_name or '라면' in item_name: return '분식'
-    if '토스트' in item_name: return '토스트'
-    if '스무디' in item_name or '티' in item_name or '에이드' in item_name: return '음료'
-    if '베이글' in item_name or '크로와상' in item_name: return '베이커리'
-    if '샌드위치' in item_name: return '샌드위치'
-    if '과일' in item_name: return '과일'
-    return None
+def _json_response(payload, status=status.HTTP_200_OK):
+    # Keep Korean text as UTF-8 rather than \uXXXX escapes, as DRF's renderer did.
+    return JsonResponse(payload, status=status, json_dumps_params={'ensure_ascii': False})
 
-def _update_order(item_name, store_name, current_order_state):
+def _update_order(item_name, store_name, current_order_state, quantity=1):
     """
-    Adds a specified item to the order or creates a new order.
-    Returns the updated order state.
+    Adds `quantity` of a specified item to the order or creates a new order.
+    Returns the updated order state. See `cart.apply_operations`.
     """
-    menu_item = MenuItem.objects.filter(name__iexact=item_name, store__name__iexact=store_name).first()
-    if not menu_item:
-        return None, f"죄송합니다. '{store_name}'에서 '{item_name}' 메뉴를 찾을 수 없습니다."
+    return cart.apply_operations(store_name, [CartOperation('add', item_name, quantity)], current_order_state)
+
+
+# --- NLU keyword tables ---
+# Each group is matched as a unit: the NLU only cares whether any keyword of a
+# group occurs in the utterance.
+NLU_KEYWORD_GROUPS = {
+    'payment_success': ['결제 성공'],
+    'payment_cancel': ['결제 취소'],
+    'payment_confirmation': ['네', '응', '예', '맞아', '좋아', '그렇게'],
+    'negative': ['아니요'],
+    'finalization': ['포장이요', '배달이요', '주문 완료', '결제', '계산', '돈 낼게', '그만', '됐어'],
+    'burger': ['버거', '햄버거'],
+    # '네', '응', '예', '맞아', '좋아', '그렇게', '주문할게', '주문해줘' 등은 AI가 문맥을 파악하도록 general_query로 둠
+    'confirmation': ['네', '응', '예', '맞아', '좋아', '그렇게', '주문할게', '주문해줘'],
+    'menu_query': ['메뉴', '뭐 팔아', '메뉴판', '뭐 있어'],
+    'store_query': ['가게', '어디', '파는 곳', '매장'],
+}
+# The follow-up question after a cart update; a '아니요' answer to it finalizes the order.
+ADD_MORE_QUESTION = '추가로 필요하신 거 있으세요?'
+# General category check (after specific ones, exclude '버거' as it's handled separately)
+NLU_CATEGORIES = ['커피', '김밥', '마라', '분식', '토스트', '음료', '베이거리', '샌드위치', '과일']
 
-    order = None
-    order_id = current_order_state.get('orderId')
+_nlu_automaton = None
 
-    if order_id:
-        try:
-            order = Order.objects.get(id=order_id)
-            if order.store and order.store != menu_item.store:
-                order = Order.objects.create(store=menu_item.store)
-            elif not order.store:
-                order.store = menu_item.store
-                order.save()
-        except Order.DoesNotExist:
-            order = Order.objects.create(store=menu_item.store)
-    else:
-        order = Order.objects.create(store=menu_item.store)
 
-    order_item, created = OrderItem.objects.get_or_create(
-        order=order,
-        menu_item=menu_item,
-        defaults={'quantity': 1}
-    )
-    if not created:
-        order_item.quantity += 1
-        order_item.save()
-
-    order_items = OrderItem.objects.filter(order=order)
-    items_data = [{'name': item.menu_item.name, 'quantity': item.quantity, 'price': float(item.menu_item.price)} for item in order_items]
-    total_price = sum(item.menu_item.price * item.quantity for item in order_items)
-
-    updated_order_state = {
-        'orderId': order.id,
-        'storeName': order.store.name,
-        'items': items_data,
-        'totalPrice': float(total_price),
-        'status': order.status
-    }
-    return updated_order_state, f"{menu_item.store.name}의 {menu_item.name}을(를) 장바구니에 추가했습니다."
+def _build_nlu_automaton(catalog):
+    patterns = [(kw, group) for group, keywords in NLU_KEYWORD_GROUPS.items() for kw in keywords]
+    patterns += [(category, ('category', i)) for i, category in enumerate(NLU_CATEGORIES)]
+    patterns += [(store.name_lower, ('store', i)) for i, store in enumerate(catalog.stores)]
+    return KeywordAutomaton(patterns)
+
+
+def get_nlu_automaton(catalog):
+    """Returns the keyword automaton for `catalog`, rebuilding it only when the catalog version changes."""
+    global _nlu_automaton
+    cached = _nlu_automaton
+    if cached is None or cached[0] != catalog.version:
+        cached = (catalog.version, _build_nlu_automaton(catalog))
+        _nlu_automaton = cached
+    return cached[1]
 
 
 def simple_nlu(text, conversation_state=None):
     """
     A simple Natural Language Understanding function to detect user intent and entities.
+    All keywords and store names are found in a single pass; the checks below only
+    consult the set of matched groups, in the same priority order as before.
     """
     intent = {'intent': 'unknown', 'entities': {}}
     text = text.lower().strip()
 
+    catalog = get_catalog()
+    matched = get_nlu_automaton(catalog).find(text)
+
     # --- Intent Detection (Priority-based) ---
     # These are special commands from the frontend, not natural user speech
-    if '결제 성공' in text:
+    if 'payment_success' in matched:
         intent['intent'] = 'payment_success'
         return intent
-    if '결제 취소' in text:
+    if 'payment_cancel' in matched:
         intent['intent'] = 'payment_cancel'
         return intent
 
     # Check for payment confirmation if awaiting it
     if conversation_state and conversation_state.get('awaiting_payment_confirmation'):
-        confirmation_keywords = ['네', '응', '예', '맞아', '좋아', '그렇게']
-        if any(kw in text for kw in confirmation_keywords):
+        if 'payment_confirmation' in matched:
             intent['intent'] = 'payment_success'
             return intent
 
     # '아니요'가 '추가로 필요하신 거 있으세요?'에 대한 응답일 경우, 주문 확정으로 간주
     # 이 로직은 OpenAI의 system_prompt와 연계하여 작동해야 합니다.
-    if '아니요' in text and conversation_state and conversation_state.get('last_ai_question') == '추가로 필요하신 거 있으세요?':
+    if 'negative' in matched and conversation_state and conversation_state.get('last_ai_question') == ADD_MORE_QUESTION:
         intent['intent'] = 'finalize_order'
         return intent
 
-    finalization_keywords = ['포장이요', '배달이요', '주문 완료', '결제', '계산', '돈 낼게', '그만', '됐어']
-    if any(kw in text for kw in finalization_keywords):
+    if 'finalization' in matched:
         intent['intent'] = 'finalize_order'
         return intent
 
     # --- Entity Extraction ---
-    all_stores = list(Store.objects.values_list('name', flat=True))
-    
     # Check for '버거' or '햄버거' specifically
-    if '버거' in text or '햄버거' in text:
+    if 'burger' in matched:
         intent['entities']['category'] = '버거'
-    
-    for store in all_stores:
-        if store.lower() in text:
-            intent['entities']['store_name'] = store
-            break
-    
-    # General category check (after specific ones, exclude '버거' as it's handled above)
-    for category in ['커피', '김밥', '마라', '분식', '토스트', '음료', '베이거리', '샌드위치', '과일']:
-        if category in text:
-            intent['entities']['category'] = category
-            break
 
-    # '네', '응', '예', '맞아', '좋아', '그렇게', '주문할게', '주문해줘' 등은 AI가 문맥을 파악하도록 general_query로 둠
-    confirmation_keywords = ['네', '응', '예', '맞아', '좋아', '그렇게', '주문할게', '주문해줘']
-    if any(kw in text for kw in confirmation_keywords):
+    # The first store (in catalog order) and the first category (in list order) win.
+    store_hits = [tag[1] for tag in matched if isinstance(tag, tuple) and tag[0] == 'store']
+    if store_hits:
+        intent['entities']['store_name'] = catalog.stores[min(store_hits)].name
+
+    category_hits = [tag[1] for tag in matched if isinstance(tag, tuple) and tag[0] == 'category']
+    if category_hits:
+        intent['entities']['category'] = NLU_CATEGORIES[min(category_hits)]
+
+    # Explicit orders ("불고기버거 2개 주세요") are answered without the LLM.
+    parsed_order = parse_order(text, catalog)
+    if parsed_order:
+        intent['intent'] = 'add_to_cart'
+        intent['entities']['order'] = parsed_order
+        return intent
+
+    if 'confirmation' in matched:
         intent['intent'] = 'general_query'
         return intent
 
-    menu_query_keywords = ['메뉴', '뭐 팔아', '메뉴판', '뭐 있어']
-    if 'store_name' in intent['entities'] and any(kw in text for kw in menu_query_keywords):
+    if 'store_name' in intent['entities'] and 'menu_query' in matched:
         intent['intent'] = 'list_menu_by_store'
         return intent
         
@@ -142,8 +149,7 @@ def simple_nlu(text, conversation_state=None):
             intent['intent'] = 'list_menu_by_store'
             return intent
 
-    store_query_keywords = ['가게', '어디', '파는 곳', '매장']
-    if 'category' in intent['entities'] and any(kw in text for kw in store_query_keywords):
+    if 'category' in intent['entities'] and 'store_query' in matched:
         intent['intent'] = 'find_stores_by_category'
         return intent
 
@@ -151,222 +157,504 @@ def simple_nlu(text, conversation_state=None):
     return intent
 
 
+def _handle_local_intent(intent, entities, current_order_state, conversation_state):
+    """
+    Answers the intents that don't need the LLM.
+    Returns a `(payload, status_code)` pair, or None to fall back to OpenAI.
+    """
+    if intent == 'finalize_order':
+        order_id = current_order_state.get('orderId')
+        if order_id and current_order_state.get('items'):
+            try:
+                order = Order.objects.get(id=order_id)
+                order.status = 'awaiting_payment'
+                order.save(update_fields=['status', 'updated_at'])
+                current_order_state['status'] = 'awaiting_payment'
+                conversation_state['awaiting_payment_confirmation'] = True
+                return {
+                    'reply': "결제 페이지로 이동합니다. 결제 방법을 선택해주세요.",
+                    'action': 'navigate_to_payment',
+                    'currentOrder': current_order_state,
+                    'conversationState': conversation_state
+                }, status.HTTP_200_OK
+            except Order.DoesNotExist:
+                return {'error': '주문을 찾을 수 없습니다.'}, status.HTTP_404_NOT_FOUND
+        else:
+            return {
+                'reply': "장바구니가 비어있습니다. 먼저 주문할 메뉴를 말씀해주세요.",
+                'currentOrder': current_order_state,
+                'conversationState': conversation_state
+            }, status.HTTP_200_OK
+
+    if intent == 'payment_success':
+        order_id = current_order_state.get('orderId')
+        if order_id:
+            order = Order.objects.get(id=order_id)
+            order.status = 'completed'
+            order.save(update_fields=['status', 'updated_at'])
+            return {
+                'reply': "결제가 성공적으로 완료되었습니다. 주문해주셔서 감사합니다!",
+                'action': 'navigate_to_home',
+                'currentOrder': {},
+                'conversationState': {}
+            }, status.HTTP_200_OK
+
+    if intent == 'payment_cancel':
+        order_id = current_order_state.get('orderId')
+        if order_id:
+            order = Order.objects.get(id=order_id)
+            order.status = 'pending'
+            order.save(update_fields=['status', 'updated_at'])
+            current_order_state['status'] = 'pending'
+            conversation_state['awaiting_payment_confirmation'] = False
+            return {
+                'reply': "결제를 취소하고 주문 화면으로 돌아갑니다.",
+                'action': 'navigate_to_order',
+                'currentOrder': current_order_state,
+                'conversationState': conversation_state
+            }, status.HTTP_200_OK
+
+    if intent == 'add_to_cart':
+        parsed_order = entities['order']
+        store = pick_store(parsed_order, current_order_state.get('storeName'))
+        if store is None:
+            # e.g. the item is sold by several stores: the LLM asks which one.
+            return None
+        operations = [
+            CartOperation('add', next(item for item in line.items if item.store.id == store.id).name, line.quantity)
+            for line in parsed_order.lines
+        ]
+        timing.tag('action', 'add_to_cart')
+        with timing.span('update_order'):
+            new_order_state, message = cart.apply_operations(store.name, operations, current_order_state)
+        if new_order_state is None:
+            return None
+        current_order_state = new_order_state
+        conversation_state['awaiting_payment_confirmation'] = False
+        conversation_state['last_ai_question'] = ADD_MORE_QUESTION
+        return {
+            'reply': f"{message} {ADD_MORE_QUESTION}",
+            'currentOrder': current_order_state,
+            'conversationState': conversation_state
+        }, status.HTTP_200_OK
+
+    if intent == 'find_stores_by_category':
+        category = entities['category']
+        stores = get_catalog().stores_for_category(category)
+        if stores:
+            store_names = [store.name for store in stores]
+            reply = f"'{category}' 메뉴를 판매하는 가게는 {', '.join(store_names)}입니다. 어느 가게 메뉴를 보시겠어요?"
+            conversation_state['last_inquired_category'] = category
+            conversation_state['presented_stores'] = store_names
+        else:
+            reply = f"죄송하지만 '{category}' 메뉴를 판매하는 가게를 찾지 못했습니다."
+            conversation_state = {}
+        return {'reply': reply, 'currentOrder': current_order_state, 'conversationState': conversation_state}, status.HTTP_200_OK
+
+    if intent == 'list_menu_by_store':
+        store_name = entities['store_name']
+        menu_items = get_catalog().items_for_store(store_name)
+        if menu_items:
+            menu_list = [f"{item.name}({int(item.price)}원)" for item in menu_items]
+            reply = f"'{store_name}'의 메뉴는 {', '.join(menu_list)}입니다. 무엇을 주문하시겠어요?"
+        else:
+            reply = f"죄송하지만 '{store_name}'의 메뉴 정보를 찾을 수 없습니다."
+        conversation_state = {}
+        return {'reply': reply, 'currentOrder': current_order_state, 'conversationState': conversation_state}, status.HTTP_200_OK
+
+    return None
+
+
+DEGRADED_REPLY = (
+    "죄송합니다. 지금은 AI 상담이 원활하지 않아 간단한 요청만 도와드릴 수 있어요. "
+    "'불고기버거 2개 주세요'처럼 메뉴와 수량을 말씀하시거나, '버거 파는 가게 어디야'처럼 물어봐 주세요."
+)
+
+
+def _degraded_reply(entities, current_order_state, conversation_state):
+    """
+    Answers a turn the LLM can't take (breaker open, deadline, upstream error)
+    from the catalog alone: the stores selling an ordered item, a store's menu
+    or the stores for a category. Orders with a known store never get here;
+    the local parser already took them.
+    """
+    metrics.incr('llm.degraded')
+    parsed_order = entities.get('order')
+    if parsed_order:
+        store_names = None
+        for line in parsed_order.lines:
+            names = {item.store.name for item in line.items}
+            store_names = names if store_names is None else store_names & names
+        if store_names:
+            example = f"{min(store_names)} {parsed_order.lines[0].items[0].name}"
+            reply = f"{', '.join(sorted(store_names))}에서 판매합니다. '{example}'처럼 가게 이름과 함께 말씀해주세요."
+        else:
+            reply = "한 가게에서 모두 판매하는 메뉴가 아니에요. 가게를 하나 골라 다시 말씀해주세요."
+        payload = {'reply': reply, 'currentOrder': current_order_state, 'conversationState': conversation_state}
+    elif 'store_name' in entities:
+        payload, _ = _handle_local_intent('list_menu_by_store', entities, current_order_state, conversation_state)
+    elif 'category' in entities:
+        payload, _ = _handle_local_intent('find_stores_by_category', entities, current_order_state, conversation_state)
+    else:
+        payload = {'reply': DEGRADED_REPLY, 'currentOrder': current_order_state, 'conversationState': conversation_state}
+    return {**payload, 'degraded': True}
+
+
+def _build_db_search_result(user_message, entities):
+    """
+    Summarizes the catalog entries relevant to the utterance for the prompt.
+    The categories live in the catalog digest, not here.
+    """
+    catalog = get_catalog()
+    items_to_display = catalog.search(
+        category=entities.get('category'),
+        store_name=entities.get('store_name'),
+        text=user_message,
+    )
+    stores_data = {}
+    if items_to_display:
+        for item in items_to_display: 
+            if item.store.name not in stores_data: stores_data[item.store.name] = []
+            stores_data[item.store.name].append(f"{item.name}({int(item.price)}원)")
+    
+    result_texts = [f"'{store_name}' 메뉴: {', '.join(items)}" for store_name, items in sorted(stores_data.items())]
+    return " ".join(result_texts) if result_texts else "검색 결과 없음 (주문 가능한 음식 종류와 가게는 메뉴 카탈로그 참고)"
+
+
+def _prepare_llm_request(user_message, entities, history, conversation_state, summary_lines=()):
+    """Returns the prompt messages and the response cache key for a general query."""
+    catalog = get_catalog()
+    db_search_result = _build_db_search_result(user_message, entities)
+    cache_key = make_cache_key(user_message, conversation_state, db_search_result, catalog.version, history, summary_lines)
+    conversation_history, token_counts = build_prompt(
+        SYSTEM_PROMPT, db_search_result, history, user_message, summary_lines, digest=get_catalog_digest(catalog),
+    )
+    timing.tag('prompt_tokens', token_counts)
+    metrics.incr('prompt.turns')
+    metrics.incr('prompt.tokens', token_counts['total'])
+    metrics.incr('prompt.prefix_tokens', token_counts['prefix'])
+    return conversation_history, cache_key
+
+
+def _record_completion(text, first_token_seconds=None):
+    """Accounts for a completion the LLM actually produced (not one served from the response cache)."""
+    tokens = count_tokens(text)
+    timing.tag('completion_tokens', tokens)
+    metrics.incr('prompt.completion_tokens', tokens)
+    if first_token_seconds is not None:
+        timing.tag('first_token_ms', round(first_token_seconds * 1000, 1))
+        metrics.observe('llm.first_token', first_token_seconds)
+
+
+def _apply_ai_response(ai_response_text, current_order_state, conversation_state):
+    """Parses the completion, applies any cart action and returns the response payload."""
+    # --- Robust AI Response Processing ---
+    updated_order = current_order_state
+
+    # Step 1: Find the action object in the AI response, fenced or not.
+    action_data = find_action(ai_response_text)
+
+    # Step 2: Apply cart actions: a list of operations, or the older single add_to_cart.
+    if action_data and action_data.get('action') in CART_ACTIONS:
+        parsed_action = cart.parse_cart_action(action_data)
+        if parsed_action:
+            store_name, operations = parsed_action
+            timing.tag('action', action_data['action'])
+            with timing.span('update_order'):
+                new_order_state, message = cart.apply_operations(store_name, operations, current_order_state)
+            final_reply = message  # Always use the message from the helper
+            if new_order_state:
+                updated_order = new_order_state
+            # If new_order_state is None (error), keep the original order state
+        else:
+            final_reply = "죄송합니다. 주문하시려는 메뉴와 가게 이름을 정확히 말씀해주세요."
+
+    # Step 3: For any other JSON, or a JSON block that doesn't parse, only keep the text around it.
+    elif action_data or '```json' in ai_response_text:
+        final_reply = re.sub(r'```json.*?```', '', ai_response_text, flags=re.DOTALL).strip()
+        if not final_reply:
+            final_reply = "죄송합니다. 다시 한번 말씀해 주시겠어요?"
+
+    # Step 4: Plain text response.
+    else:
+        final_reply = ai_response_text
+
+    # --- Post-processing and final response ---
+
+    # Check if the AI's reply is a payment instruction and set awaiting_payment_confirmation
+    if "카드 결제를 진행합니다" in final_reply or "QR 결제를 진행합니다" in final_reply:
+        conversation_state['awaiting_payment_confirmation'] = True
+    else:
+        conversation_state['awaiting_payment_confirmation'] = False
+
+    # Save the last question for context
+    conversation_state['last_ai_question'] = final_reply if final_reply.endswith('?') else None
+
+    return {
+        'reply': final_reply, 
+        'currentOrder': updated_order,
+        'conversationState': conversation_state
+    }
+
+
 @method_decorator(csrf_exempt, name='dispatch')
-class ChatWithAIView(APIView):
-    authentication_classes = []
-    permission_classes = []
+class ChatWithAIView(View):
+    """
+    Chat endpoint. The handler is async so that a worker served through
+    `config.asgi` keeps serving other kiosks while a completion is in flight;
+    all ORM work runs in `sync_to_async` helpers.
+
+    Clients that send `Accept: text/event-stream` (or `"stream": true`) get
+    the reply as Server-Sent Events: `token` events with speakable text as it
+    arrives, then one `done` event with the same payload as the JSON mode.
+
+    Clients that send a `sessionId` may omit `history`, `currentState` and
+    `conversationState`; they are then read from the server-side session
+    (see `orders.sessions`). Fields that are sent still take precedence.
+    """
 
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         try:
-            history = request.data.get('history', [])
-            user_message = request.data.get('message')
-            current_order_state = request.data.get('currentState', {})
-            conversation_state = request.data.get('conversationState', {})
+            try:
+                data = json.loads(request.body or b'{}')
+            except ValueError:
+                return _json_response({'error': 'Invalid JSON body'}, status=status.HTTP_400_BAD_REQUEST)
 
+            user_message = data.get('message')
             if not user_message:
-                return Response({'error': 'Message not provided'}, status=status.HTTP_400_BAD_REQUEST)
-
-            nlu_result = simple_nlu(user_message, conversation_state)
-            intent = nlu_result['intent']
-            entities = nlu_result['entities']
-
-            # --- Intent-based direct actions ---
-
-            if intent == 'finalize_order':
-                order_id = current_order_state.get('orderId')
-                if order_id and current_order_state.get('items'):
-                    try:
-                        order = Order.objects.get(id=order_id)
-                        order.status = 'awaiting_payment'
-                        order.save()
-                        current_order_state['status'] = 'awaiting_payment'
-                        conversation_state['awaiting_payment_confirmation'] = True
-                        return Response({
-                            'reply': "결제 페이지로 이동합니다. 결제 방법을 선택해주세요.",
-                            'action': 'navigate_to_payment',
-                            'currentOrder': current_order_state,
-                            'conversationState': conversation_state
-                        })
-                    except Order.DoesNotExist:
-                        return Response({'error': '주문을 찾을 수 없습니다.'}, status=status.HTTP_404_NOT_FOUND)
-                else:
-                    return Response({
-                        'reply': "장바구니가 비어있습니다. 먼저 주문할 메뉴를 말씀해주세요.",
-                        'currentOrder': current_order_state,
-                        'conversationState': conversation_state
-                    })
-
-            if intent == 'payment_success':
-                order_id = current_order_state.get('orderId')
-                if order_id:
-                    order = Order.objects.get(id=order_id)
-                    order.status = 'completed'
-                    order.save()
-                    return Response({
-                        'reply': "결제가 성공적으로 완료되었습니다. 주문해주셔서 감사합니다!",
-                        'action': 'navigate_to_home',
-                        'currentOrder': {},
-                        'conversationState': {}
-                    })
-
-            if intent == 'payment_cancel':
-                order_id = current_order_state.get('orderId')
-                if order_id:
-                    order = Order.objects.get(id=order_id)
-                    order.status = 'pending'
-                    order.save()
-                    current_order_state['status'] = 'pending'
-                    conversation_state['awaiting_payment_confirmation'] = False
-                    return Response({
-                        'reply': "결제를 취소하고 주문 화면으로 돌아갑니다.",
-                        'action': 'navigate_to_order',
-                        'currentOrder': current_order_state,
-                        'conversationState': conversation_state
-                    })
-
-            if intent == 'find_stores_by_category':
-                category = entities['category']
-                stores = Store.objects.filter(menuitem__name__icontains=category).distinct()
-                if stores:
-                    store_names = [store.name for store in stores]
-                    reply = f"'{category}' 메뉴를 판매하는 가게는 {', '.join(store_names)}입니다. 어느 가게 메뉴를 보시겠어요?"
-                    conversation_state['last_inquired_category'] = category
-                    conversation_state['presented_stores'] = store_names
-                else:
-                    reply = f"죄송하지만 '{category}' 메뉴를 판매하는 가게를 찾지 못했습니다."
-                    conversation_state = {}
-                return Response({'reply': reply, 'currentOrder': current_order_state, 'conversationState': conversation_state})
-
-            if intent == 'list_menu_by_store':
-                store_name = entities['store_name']
-                menu_items = MenuItem.objects.filter(store__name__iexact=store_name)
-                if menu_items:
-                    menu_list = [f"{item.name}({int(item.price)}원)" for item in menu_items]
-                    reply = f"'{store_name}'의 메뉴는 {', '.join(menu_list)}입니다. 무엇을 주문하시겠어요?"
-                else:
-                    reply = f"죄송하지만 '{store_name}'의 메뉴 정보를 찾을 수 없습니다."
-                conversation_state = {}
-                return Response({'reply': reply, 'currentOrder': current_order_state, 'conversationState': conversation_state})
-
-            # --- Fallback to OpenAI for general queries ---
-            openai.api_key = settings.OPENAI_API_KEY
-            
-            system_prompt = (
-                "너는 AI 키오스크 '보이스오더'의 친절한 안내원이야. 너의 목표는 사용자가 DB에 있는 메뉴를 주문하고 결제하도록 돕는 거야."
-                "1. **DB 검색 결과 활용:** 사용자가 메뉴, 가게, 추천을 물어보면, 반드시 'DB 검색 결과' 섹션에 제공된 정보만을 사용해서 답변해야 해. 없는 것은 절대 제안해서는 안 돼."
-                "2. **주문 실행 (장바구니 추가):** 사용자가 특정 메뉴 주문을 요청하면, '네, [메뉴이름]을 장바구니에 추가했습니다. 추가로 주문할 상품이 있으신가요?'와 같은 확인 메시지와 함께 다음 JSON 형식을 반드시 응답의 마지막에 포함해야 해."
-                '''```json
-{
-  "action": "add_to_cart",
-  "item_name": "메뉴이름",
-  "store_name": "가게이름"
-}
-```'''
-                "   - `item_name`과 `store_name`에는 'DB 검색 결과'에 명시된 정확한 전체 이름을 사용해야 해. 사용자가 모호하게 말하면, 명확한 메뉴를 다시 물어봐줘."
-                "   - 이 액션 외의 다른 말은 절대로 JSON에 넣지 마."
-                "3. **결제 안내:** 사용자가 '카드 결제', 'QR 결제' 등 결제 방식을 말하면, 그에 맞는 안내 메시지를 생성해줘. 예를 들어 '카드로 결제할게요'라고 하면 '네, 카드 결제를 진행합니다. 잠시만 기다려주세요.' 와 같이 답변해. 이 때는 JSON을 생성하면 안 돼."
-                "4. **일반 대화:** 주문과 관련 없는 일반 대화나, JSON 행동이 필요 없는 경우에는 JSON 블록 없이 자유롭게 답변해."
-                "5. **금지된 행동:** '결제할게', '주문 완료' 같은 말에는 직접 반응하지 마. 백엔드가 이 말을 먼저 처리해서 결제 페이지로 안내할 거야. 또한 '결제 성공', '결제 취소' 같은 시스템 용어에도 반응하지 마."
-                "6. **명확한 안내:** 가게 이름, 메뉴 이름, 가격을 명확하게 말해서 사용자가 혼동하지 않게 해야 해."
-                "7. **'아니요' 처리:** 만약 AI가 '추가로 필요하신 거 있으세요?'라고 물었을 때 사용자가 '아니요'라고 답하면, 이는 주문을 확정하고 결제 단계로 넘어가겠다는 의미로 해석하고, '결제 페이지로 이동합니다. 결제 방법을 선택해주세요.'라고 안내해줘. 이 때는 JSON을 생성하면 안 돼."
+                return _json_response({'error': 'Message not provided'}, status=status.HTTP_400_BAD_REQUEST)
+
+            session_id = data.get('sessionId')
+            session = sessions.new_session()
+            if session_id is not None:
+                if not sessions.is_valid_session_id(session_id):
+                    return _json_response({'error': 'Invalid sessionId'}, status=status.HTTP_400_BAD_REQUEST)
+                session = await sessions.load(session_id)
+
+            history = data.get('history', session['history'])
+            current_order_state = data.get('currentState', session['currentOrder'])
+            conversation_state = data.get('conversationState', session['conversationState'])
+
+            if data.get('stream') or 'text/event-stream' in request.headers.get('Accept', ''):
+                response = StreamingHttpResponse(
+                    self._stream_turn(user_message, history, current_order_state, conversation_state, session_id, session),
+                    content_type='text/event-stream',
+                )
+                response['Cache-Control'] = 'no-cache'
+                response['X-Accel-Buffering'] = 'no'
+                return response
+
+            local_result, conversation_history, cache_key, entities = await self._prepare_turn(
+                user_message, history, current_order_state, conversation_state, session.get('summary', []),
             )
-            
-            db_search_result = ""
-            base_items_queryset = MenuItem.objects.all().select_related('store')
-            q_objects = Q()
-            if 'category' in entities: q_objects |= Q(name__icontains=entities['category'])
-            if 'store_name' in entities: q_objects |= Q(store__name__icontains=entities['store_name'])
-            if not q_objects: q_objects |= Q(name__icontains=user_message) | Q(store__name__icontains=user_message)
-            items_to_display = base_items_queryset.filter(q_objects).distinct()
-            all_available_categories = sorted(list(set(c for c in [get_category_from_item(item.name) for item in base_items_queryset] if c)))
-
-            stores_data = {}
-            if items_to_display:
-                for item in items_to_display: 
-                    if item.store.name not in stores_data: stores_data[item.store.name] = []
-                    stores_data[item.store.name].append(f"{item.name}({int(item.price)}원)")
-            
-            result_texts = []
-            if all_available_categories: result_texts.append(f"주문 가능한 주요 음식 종류: {', '.join(all_available_categories)}")
-            if stores_data:
-                for store_name, items in sorted(stores_data.items()):
-                    result_texts.append(f"'{store_name}' 메뉴: {', '.join(items)}")
-            
-            db_search_result = " ".join(result_texts) if result_texts else f"검색 결과 없음. 주문 가능한 주요 음식 종류는 {', '.join(all_available_categories)}입니다."
-
-            conversation_history = [{"role": "system", "content": system_prompt}, {"role": "system", "content": f"DB 검색 결과: {db_search_result}"}]
-            conversation_history.extend([{"role": "user" if msg.get("sender") == "user" else "assistant", "content": msg.get("text")} for msg in history])
-            conversation_history.append({"role": "user", "content": user_message})
-            
-            response = openai.chat.completions.create(model="gpt-3.5-turbo", messages=conversation_history)
-            ai_response_text = response.choices[0].message.content
-
-            # --- Robust AI Response Processing ---
-            final_reply = ai_response_text
-            updated_order = current_order_state
-            action_data = None
+            if local_result is not None:
+                payload, status_code = local_result
+                if status_code == status.HTTP_200_OK:
+                    payload = await self._save_session(session_id, session, user_message, payload)
+                return _json_response(payload, status=status_code)
 
+            # --- Fallback to OpenAI for general queries ---
             try:
-                # Step 1: Find JSON in the AI response, with or without markdown.
-                json_str = None
-                json_match_markdown = re.search(r'```json\n({.*?})\n```', ai_response_text, re.DOTALL)
-                if json_match_markdown:
-                    json_str = json_match_markdown.group(1)
-                else:
-                    # If no markdown, find the first valid JSON object in the text
-                    json_match_raw = re.search(r'\{.*\}', ai_response_text, re.DOTALL)
-                    if json_match_raw:
-                        json_str = json_match_raw.group(0)
-
-                # Step 2: If JSON is found, try to parse it and act on it.
-                if json_str:
-                    action_data = json.loads(json_str)
-                    
-                    # Step 3: Handle 'add_to_cart' action
-                    if action_data.get('action') == 'add_to_cart':
-                        item_name = action_data.get('item_name')
-                        store_name = action_data.get('store_name')
-                        
-                        if item_name and store_name:
-                            new_order_state, message = _update_order(item_name, store_name, current_order_state)
-                            final_reply = message  # Always use the message from the helper
-                            if new_order_state:
-                                updated_order = new_order_state
-                            # If new_order_state is None (error), keep the original order state
-                        else:
-                            final_reply = "죄송합니다. 주문하시려는 메뉴와 가게 이름을 정확히 말씀해주세요."
-                    else:
-                        # If it's some other JSON action, just use the text part of the AI response
-                        final_reply = re.sub(r'```json.*?```', '', ai_response_text, flags=re.DOTALL).strip()
-
-                # Step 4: If no JSON was found or parsed, just use the text response.
-                else:
-                    final_reply = ai_response_text
-
-            except (json.JSONDecodeError, AttributeError):
-                # If anything goes wrong, fall back to a safe state.
-                # Clean up the AI response to avoid sending garbage to the user.
-                final_reply = re.sub(r'```json.*?```', '', ai_response_text, flags=re.DOTALL).strip()
-                if not final_reply:
-                    final_reply = "죄송합니다. 다시 한번 말씀해 주시겠어요?"
-            
-            # --- Post-processing and final response ---
-
-            # Check if the AI's reply is a payment instruction and set awaiting_payment_confirmation
-            if "카드 결제를 진행합니다" in final_reply or "QR 결제를 진행합니다" in final_reply:
-                conversation_state['awaiting_payment_confirmation'] = True
+                with timing.span('llm'):
+                    ai_response_text = await llm_cache.cached_completion(cache_key, lambda: self._complete(conversation_history))
+            except llm.UNAVAILABLE_ERRORS as e:
+                logger.warning("LLM unavailable, answering locally: %s", e)
+                payload = await sync_to_async(_degraded_reply)(entities, current_order_state, conversation_state)
             else:
-                conversation_state['awaiting_payment_confirmation'] = False
+                with timing.span('parse'):
+                    payload = await sync_to_async(_apply_ai_response)(ai_response_text, current_order_state, conversation_state)
+            payload = await self._save_session(session_id, session, user_message, payload)
+            return _json_response(payload)
 
-            # Save the last question for context
-            conversation_state['last_ai_question'] = final_reply if final_reply.endswith('?') else None
+        except Exception as e:
+            print(f"Error in ChatWithAIView: {e}")
+            return _json_response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @staticmethod
+    async def _complete(messages):
+        text = await llm.complete(messages)
+        _record_completion(text)
+        return text
+
+    async def _prepare_turn(self, user_message, history, current_order_state, conversation_state, summary_lines=()):
+        """
+        Runs the NLU and the local intent handlers.
+        Returns `(local_result, conversation_history, cache_key, entities)`: the
+        first is set when the turn was answered locally, the others when it needs
+        the LLM. `entities` are kept for a local answer if the LLM is unavailable.
+        """
+        with timing.span('nlu'):
+            nlu_result = await sync_to_async(simple_nlu)(user_message, conversation_state)
+        intent = nlu_result['intent']
+        entities = nlu_result['entities']
+        timing.tag('intent', intent)
+
+        # --- Intent-based direct actions ---
+        with timing.span('local_intent'):
+            local_result = await sync_to_async(_handle_local_intent)(intent, entities, current_order_state, conversation_state)
+        if local_result is not None:
+            return local_result, None, None, entities
+
+        with timing.span('catalog_search'):
+            conversation_history, cache_key = await sync_to_async(_prepare_llm_request)(
+                user_message, entities, history, conversation_state, summary_lines,
+            )
+        return None, conversation_history, cache_key, entities
 
-            return Response({
-                'reply': final_reply, 
-                'currentOrder': updated_order,
-                'conversationState': conversation_state
-            })
+    async def _save_session(self, session_id, session, user_message, payload):
+        """Records the turn in the server-side session, if the client uses one."""
+        if session_id is not None:
+            await sessions.save_turn(session_id, session, user_message, payload)
+            payload['sessionId'] = session_id
+        return payload
+
+    async def _stream_turn(self, user_message, history, current_order_state, conversation_state, session_id, session):
+        try:
+            local_result, conversation_history, cache_key, entities = await self._prepare_turn(
+                user_message, history, current_order_state, conversation_state, session.get('summary', []),
+            )
+            if local_result is not None:
+                payload, status_code = local_result
+                if status_code != status.HTTP_200_OK:
+                    yield sse_event('error', payload)
+                    return
+                payload = await self._save_session(session_id, session, user_message, payload)
+                yield sse_event('token', {'text': payload['reply']})
+                yield sse_event('done', {**payload, 'action': payload.get('action')})
+                return
+
+            spoken = SpokenTextFilter()
+            ai_response_text = await llm_cache.get_cached(cache_key)
+            if ai_response_text is not None:
+                text = spoken.feed(ai_response_text)
+                if text:
+                    yield sse_event('token', {'text': text})
+            else:
+                started = time.perf_counter()
+                first_token = None
+                chunks = []
+                try:
+                    async for chunk in llm.stream(conversation_history):
+                        if first_token is None:
+                            first_token = time.perf_counter() - started
+                        chunks.append(chunk)
+                        text = spoken.feed(chunk)
+                        if text:
+                            yield sse_event('token', {'text': text})
+                except llm.UNAVAILABLE_ERRORS as e:
+                    if chunks:
+                        raise  # part of the answer is already spoken; it can't be replaced
+                    logger.warning("LLM unavailable, answering locally: %s", e)
+                    payload = await sync_to_async(_degraded_reply)(entities, current_order_state, conversation_state)
+                    payload = await self._save_session(session_id, session, user_message, payload)
+                    yield sse_event('token', {'text': payload['reply']})
+                    yield sse_event('done', {**payload, 'action': payload.get('action')})
+                    return
+                ai_response_text = ''.join(chunks)
+                _record_completion(ai_response_text, first_token)
+                await llm_cache.store(cache_key, ai_response_text, time.perf_counter() - started)
+            text = spoken.flush()
+            if text:
+                yield sse_event('token', {'text': text})
+
+            payload = await sync_to_async(_apply_ai_response)(ai_response_text, current_order_state, conversation_state)
+            payload = await self._save_session(session_id, session, user_message, payload)
+            yield sse_event('done', {**payload, 'action': payload.get('action')})
 
         except Exception as e:
-            print(f"Error in ChatWithAIView: {e}")
-            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            logger.exception("ChatWithAIView stream failed")
+            yield sse_event('error', {'error': str(e)})
+
+
+class OrderEventsView(View):
+    """
+    Server-Sent Events stream of one store's order events, for kitchen displays.
+
+    Resumes after the `Last-Event-ID` header, which EventSource sends on
+    reconnect, or after the `after` query parameter (`after=0` replays the
+    whole log). Without either, only new events are sent. Serve it through
+    `config.asgi`: each open stream is then a queue on the worker's event
+    loop rather than a blocked thread. See `orders.events`.
+    """
+    RECONNECT_MS = 3000
+
+    async def get(self, request, store_id, *args, **kwargs):
+        try:
+            offset = request.headers.get('Last-Event-ID') or request.GET.get('after')
+            after = None if offset is None else int(offset)
+        except ValueError:
+            return _json_response({'error': 'Invalid event offset'}, status=status.HTTP_400_BAD_REQUEST)
+        if not await Store.objects.filter(id=store_id).aexists():
+            return _json_response({'error': 'Store not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        response = StreamingHttpResponse(self._stream(store_id, after), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    async def _stream(self, store_id, after):
+        yield f"retry: {self.RECONNECT_MS}\n\n"
+        async for event in events.stream(store_id, after):
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield sse_event(event['kind'], event, event_id=event['id'])
+
+
+class CatalogView(View):
+    """
+    Read-only menu catalog for kiosks: `?store=<id>` narrows it to one store,
+    `?page=<n>` walks it `PAGE_SIZE` items at a time.
+
+    Pages are rendered and gzipped once per catalog version (see
+    `orders.catalog_api`). Each response carries a strong ETag, so a kiosk can
+    keep the menu locally and revalidate with `If-None-Match`; an unchanged
+    menu costs a 304 without a body.
+    """
+    ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            store_id = int(request.GET['store']) if request.GET.get('store') else None
+            page = int(request.GET.get('page') or 1)
+        except ValueError:
+            return _json_response({'error': 'store and page must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        if page < 1:
+            return _json_response({'error': 'page starts at 1'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            rendered = await sync_to_async(catalog_api.get_page)(store_id, page)
+        except catalog_api.PageNotFound as e:
+            return _json_response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+
+        gzipped = rendered.gzipped is not None and self.ACCEPTS_GZIP.search(request.headers.get('Accept-Encoding', ''))
+        if rendered.matches(parse_etags(request.headers.get('If-None-Match', ''))):
+            metrics.incr('catalog_api.not_modified')
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(rendered.gzipped if gzipped else rendered.body, content_type='application/json')
+            response['Content-Length'] = len(response.content)
+            if gzipped:
+                response['Content-Encoding'] = 'gzip'
+        response['ETag'] = rendered.gzip_etag if gzipped else rendered.etag
+        response['Cache-Control'] = catalog_api.cache_control()
+        patch_vary_headers(response, ['Accept-Encoding'])
+        return response
+
+
+async def _may_read_metrics(request):
+    token = getattr(settings, 'METRICS', {}).get('TOKEN')
+    if token and hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+        return True
+    return (await request.auser()).is_staff
+
+
+class MetricsView(View):
+    """
+    Per-worker counters and timings (cache hit rate, latencies) as JSON, for
+    staff users and for scrapers holding `settings.METRICS['TOKEN']`.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        if not await _may_read_metrics(request):
+            return _json_response({'error': 'Forbidden'}, status=status.HTTP_403_FORBIDDEN)
+        return _json_response(metrics.snapshot())
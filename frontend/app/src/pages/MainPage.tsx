@@ -22,7 +22,6 @@ const MainPage = () => {
   // No need to select state here, as we use getState() in callbacks
   const { speak, speaking } = useTextToSpeech(); // Import useTextToSpeech // eslint-disable-line @typescript-eslint/no-unused-vars
   
-  const [conversationState, setConversationState] = useState<any>({});
   const [agentStatus, setAgentStatus] = useState<AgentStatus>('idle');
   const [inputValue, setInputValue] = useState('');
   const processedTranscriptRef = useRef<string | null>(null);
@@ -36,28 +35,22 @@ const MainPage = () => {
 
     setAgentStatus('thinking');
     try {
-      // Get the latest state directly from the store to avoid stale state issues
-      const { orderId, storeName, items } = useOrderStore.getState();
-      const orderData = { orderId, storeName, items };
+      // The backend keeps the history, order and conversation state for this session,
+      // so only the new utterance is sent.
+      const { sessionId } = useChatStore.getState();
 
       const response = await axios.post('https://ai-agentic-kiosk-production.up.railway.app/api/orders/chat/', {
         message: command,
-        history: messages.slice(-10),
-        currentState: orderData,
-        conversationState: conversationState,
+        sessionId,
       });
 
-      const { reply, currentOrder, conversationState: newConversationState, action } = response.data;
+      const { reply, currentOrder, action } = response.data;
 
       if (currentOrder) {
         // setOrder is the action from the store, it's safe to call
         useOrderStore.getState().setOrder(currentOrder);
       }
 
-      if (newConversationState) {
-        setConversationState(newConversationState);
-      }
-
       // Reset manual stop state before AI speaks, allowing listening to resume automatically after.
       userManuallyStoppedListeningRef.current = false;
       addMessage({ sender: 'assistant', text: reply });
@@ -84,7 +77,7 @@ const MainPage = () => {
       addMessage({ sender: 'assistant', text: errorText });
       resetTranscript();
     }
-  }, [messages, addMessage, resetTranscript, conversationState, navigate, speak]);
+  }, [addMessage, resetTranscript, navigate, speak]);
 
   // This effect is responsible for processing the transcript after a pause in speech.
   useEffect(() => {
@@ -2,6 +2,7 @@ import React, { useState, useEffect, useCallback, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { Box, Typography, Button, Paper, Container, Grid, CircularProgress, Divider } from '@mui/material';
 import { useOrderStore, OrderItem as OrderItemType } from '../store/orderStore';
+import { useChatStore } from '../store/chatStore';
 import { useTextToSpeech } from '../hooks/useTextToSpeech';
 import useVoiceRecognition from '../hooks/useVoiceRecognition'; // 음성 인식 훅 추가
 import axios from 'axios';
@@ -43,11 +44,10 @@ const PaymentPage = () => {
     if (!command) return; // 빈 명령은 전송하지 않음
     setAgentStatus('thinking');
     try {
-      const { ...orderData } = useOrderStore.getState();
+      const { sessionId } = useChatStore.getState();
       const response = await axios.post('https://ai-agentic-kiosk-production.up.railway.app/api/orders/chat/', {
         message: command,
-        currentState: orderData,
-        history: [{ sender: 'user', text: command }]
+        sessionId,
       });
 
       const { reply, action, currentOrder } = response.data; // eslint-disable-line @typescript-eslint/no-unused-vars
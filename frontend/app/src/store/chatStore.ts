@@ -15,6 +15,7 @@ interface ConversationState {
 
 // Defines the overall state managed by the chat store
 interface ChatState {
+  sessionId: string;
   messages: Message[];
   conversationState: ConversationState;
   addMessage: (message: Message) => void;
@@ -24,6 +25,7 @@ interface ChatState {
 /**
  * Zustand store for managing the chat interface state.
  *
+ * @property {string} sessionId - Identifies this kiosk's conversation on the backend, which keeps the history and order state.
  * @property {Message[]} messages - The list of messages in the chat.
  * @property {ConversationState} conversationState - The context of the ongoing conversation.
  * @function addMessage - Adds a new message to the chat history.
@@ -31,6 +33,7 @@ interface ChatState {
  */
 export const useChatStore = create<ChatState>((set) => ({
   // Initial state
+  sessionId: crypto.randomUUID(),
   messages: [{ sender: 'assistant', text: '안녕하세요! 음성으로 주문을 시작해보세요.' }],
   conversationState: {},
 